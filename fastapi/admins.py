@@ -0,0 +1,54 @@
+# admins.py
+# Grant or revoke access to the admin-only endpoints (bulk import, profiling,
+# /system and /metrics).
+#   python admins.py list
+#   python admins.py grant <email>
+#   python admins.py revoke <email>
+#   python admins.py token <email>    print a 30-day bearer token, e.g. for Prometheus
+#
+# The flag lives in users.is_admin (migration 14) and is checked by user id on
+# every admin request, so changes apply immediately to existing sessions and tokens.
+import asyncio
+import sys
+from auth import create_access_token
+from database import database
+from logging_config import configure_logging
+from migrations import migrate
+
+SET_ADMIN = "UPDATE users SET is_admin = :is_admin WHERE email = :email RETURNING user_id, username"
+LIST_ADMINS = "SELECT user_id, username, email FROM users WHERE is_admin ORDER BY user_id"
+GET_ADMIN = "SELECT user_id, email FROM users WHERE email = :email AND is_admin"
+
+
+async def main(command: str, email: str = None) -> int:
+    await database.connect()
+    try:
+        await migrate()
+        if command == "list":
+            for row in await database.fetch_all(LIST_ADMINS):
+                print(f"{row['user_id']:6d} {row['username']:<30} {row['email']}")
+            return 0
+        if command == "token":
+            row = await database.fetch_one(GET_ADMIN, values={"email": email})
+            if row is None:
+                print(f"No admin with email {email}")
+                return 1
+            print(create_access_token({"id": row["user_id"], "email": row["email"]}, remember_me=True))
+            return 0
+        row = await database.fetch_one(SET_ADMIN, values={"is_admin": command == "grant", "email": email})
+        if row is None:
+            print(f"No user with email {email}")
+            return 1
+        print(f"✅ {'Granted' if command == 'grant' else 'Revoked'} admin for {row['username']} (user {row['user_id']})")
+        return 0
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not (args == ["list"] or (len(args) == 2 and args[0] in ("grant", "revoke", "token"))):
+        print("usage: python admins.py list | grant <email> | revoke <email> | token <email>")
+        sys.exit(2)
+    configure_logging()
+    sys.exit(asyncio.run(main(*args)))
@@ -0,0 +1,339 @@
+# admission.py
+# Admission control: decides before routing whether a request is served now, told
+# to slow down (429) or turned away because the server is overloaded (503).
+#
+# Rate limits: token buckets per client. Every request spends a token from its IP's
+# RATE_LIMIT_DEFAULT bucket; the expensive routes in ROUTE_RULES (posting a review,
+# login and sign-up, which run bcrypt) also have their own, smaller buckets per IP
+# and, when the access_token cookie is valid, per user. An empty bucket answers 429
+# with Retry-After. Limits are "<requests>/<seconds>": that many in a burst, refilled
+# evenly over the period; an empty value turns a limit off, RATE_LIMITS_ENABLED=0
+# all of them (load tests, which send everything from one address).
+#
+# Concurrency: each ROUTE_RULES route may run at most its max_in_flight requests at
+# once per worker; more get a 503 straight away instead of queueing behind them.
+#
+# Load shedding: with ADMISSION_MAX_IN_FLIGHT requests already running in this
+# worker, or a request that has waited ADMISSION_MAX_POOL_WAIT_MS for a database
+# connection, new requests get a 503 with Retry-After instead of joining the queue,
+# so the ones already admitted keep their latency. Monitoring (/metrics, /system)
+# is never limited; the live feed stream only counts against the rate limit.
+#
+# Buckets live in each worker's memory by default, so with N workers a client can
+# get up to N times a limit. ADMISSION_BACKEND=postgres keeps them in an UNLOGGED
+# table (migration 13) shared by all workers, at one statement per request; or
+# name a custom RateLimitBackend as "package.module:Class".
+import asyncio
+import importlib
+import logging
+import math
+import os
+import time
+from typing import NamedTuple, Optional
+import jwt
+from auth import ALGORITHM, SECRET_KEY
+from database import database
+from metrics import Counter
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimit(NamedTuple):
+    burst: int
+    per_second: float
+
+    @classmethod
+    def parse(cls, text: str) -> Optional["RateLimit"]:
+        if not text.strip():
+            return None
+        requests, _, seconds = text.partition("/")
+        return cls(int(requests), int(requests) / float(seconds or 1))
+
+
+class RouteRule(NamedTuple):
+    name: str
+    limit: Optional[RateLimit]
+    max_in_flight: int
+    per_user: bool
+
+
+RATE_LIMITS_ENABLED = os.getenv("RATE_LIMITS_ENABLED", "1") == "1"
+RATE_LIMIT_DEFAULT = RateLimit.parse(os.getenv("RATE_LIMIT_DEFAULT", "600/60"))
+# (method, path without trailing slash) -> rule
+ROUTE_RULES = {
+    ("POST", "/api/reviews"): RouteRule(
+        "review_create", RateLimit.parse(os.getenv("RATE_LIMIT_REVIEW_CREATE", "20/60")),
+        int(os.getenv("ADMISSION_REVIEW_CREATE_CONCURRENCY", "32")), per_user=True,
+    ),
+    ("POST", "/users/login"): RouteRule(
+        "login", RateLimit.parse(os.getenv("RATE_LIMIT_LOGIN", "10/60")),
+        int(os.getenv("ADMISSION_LOGIN_CONCURRENCY", "32")), per_user=False,
+    ),
+    ("POST", "/users/create"): RouteRule(
+        "signup", RateLimit.parse(os.getenv("RATE_LIMIT_SIGNUP", "5/300")),
+        int(os.getenv("ADMISSION_SIGNUP_CONCURRENCY", "8")), per_user=False,
+    ),
+}
+# A bucket untouched this long has refilled completely, which is the same as having none
+FULL_REFILL_SECONDS = max(
+    (limit.burst / limit.per_second
+     for limit in (RATE_LIMIT_DEFAULT, *(rule.limit for rule in ROUTE_RULES.values())) if limit),
+    default=0.0,
+)
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "256"))
+ADMISSION_MAX_POOL_WAIT_MS = float(os.getenv("ADMISSION_MAX_POOL_WAIT_MS", "1000"))
+# "memory", "postgres" or "package.module:BackendClass" for a custom RateLimitBackend
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "memory")
+SHED_RETRY_AFTER_SECONDS = 1
+
+EXEMPT_PREFIXES = ("/metrics", "/system")
+# Held open for as long as the client stays; not "in flight" work
+LONG_LIVED_PATHS = ("/api/reviews/stream",)
+
+REQUESTS_THROTTLED = Counter(
+    "http_requests_throttled_total", "Requests answered 429 by a rate limit, by rule and key", ("rule", "key"),
+)
+REQUESTS_SHED = Counter("http_requests_shed_total", "Requests answered 503 by admission control, by reason", ("reason",))
+
+
+class RateLimitBackend:
+    """Storage for the token buckets.
+
+    Methods are async so a backend can keep the buckets somewhere all workers share.
+    """
+
+    name = "custom"
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        """Spend one token from key's bucket: 0 if there was one, else seconds until there is."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Per-process buckets."""
+
+    name = "memory"
+    PRUNE_EVERY = 10_000
+
+    def __init__(self):
+        self._buckets = {}  # key -> [tokens, time of last refill]
+        self._takes = 0
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(limit.burst), now]
+        else:
+            bucket[0] = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.per_second)
+            bucket[1] = now
+        self._takes += 1
+        if self._takes % self.PRUNE_EVERY == 0:
+            self._prune(now)
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / limit.per_second
+
+    def _prune(self, now: float) -> None:
+        for key in [key for key, (_, refilled) in self._buckets.items() if now - refilled > FULL_REFILL_SECONDS]:
+            del self._buckets[key]
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "buckets": len(self._buckets)}
+
+
+# Refill by the time since the last take, capped at the burst
+REFILLED = "LEAST(:burst, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * :per_second)"
+
+# No row comes back when the bucket is empty: the WHERE skips the update
+TAKE_TOKEN = f"""
+INSERT INTO rate_limit_buckets AS b (key, tokens, updated_at)
+VALUES (:key, :burst - 1, clock_timestamp())
+ON CONFLICT (key) DO UPDATE SET tokens = {REFILLED} - 1, updated_at = clock_timestamp()
+WHERE {REFILLED} >= 1
+RETURNING tokens
+"""
+
+PRUNE_BUCKETS = "DELETE FROM rate_limit_buckets WHERE updated_at < clock_timestamp() - make_interval(secs => :seconds)"
+
+
+class PostgresRateLimitBackend(RateLimitBackend):
+    """Buckets in the rate_limit_buckets table, shared by every worker."""
+
+    name = "postgres"
+    PRUNE_INTERVAL_SECONDS = 600.0
+
+    def __init__(self):
+        self._pruned_at = time.monotonic()
+        self._pruner = None
+        self.failing = False
+        self.errors = 0
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        if time.monotonic() - self._pruned_at > self.PRUNE_INTERVAL_SECONDS:
+            self._pruned_at = time.monotonic()
+            self._pruner = asyncio.create_task(self._prune())
+        try:
+            row = await database.fetch_one(TAKE_TOKEN, {
+                "key": key, "burst": limit.burst, "per_second": limit.per_second,
+            })
+        except Exception as e:
+            # Limits are protection, not correctness: without the table, let traffic through
+            if not self.failing:
+                logger.warning("Rate limit backend failed, not limiting until it recovers: %s", e)
+            self.failing = True
+            self.errors += 1
+            return 0.0
+        if self.failing:
+            logger.info("Rate limit backend recovered")
+            self.failing = False
+        return 0.0 if row is not None else 1 / limit.per_second
+
+    async def _prune(self) -> None:
+        try:
+            await database.execute(PRUNE_BUCKETS, {"seconds": FULL_REFILL_SECONDS})
+        except Exception:
+            logger.exception("Pruning rate limit buckets failed")
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "failing": self.failing, "errors": self.errors}
+
+
+def load_rate_limit_backend(spec: str) -> RateLimitBackend:
+    if spec == "memory":
+        return MemoryRateLimitBackend()
+    if spec == "postgres":
+        return PostgresRateLimitBackend()
+    module_name, _, class_name = spec.partition(":")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class()
+
+
+def _user_id(scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name != b"cookie":
+            continue
+        for part in value.decode("latin-1").split(";"):
+            key, _, token = part.strip().partition("=")
+            if key == "access_token":
+                try:
+                    return str(jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["id"])
+                except (jwt.PyJWTError, KeyError):
+                    return None
+    return None
+
+
+class AdmissionController:
+    def __init__(self, backend: RateLimitBackend):
+        self.backend = backend
+        self.in_flight = 0
+        self.route_in_flight = {rule.name: 0 for rule in ROUTE_RULES.values()}
+
+    def shed_reason(self) -> Optional[str]:
+        if self.in_flight >= ADMISSION_MAX_IN_FLIGHT:
+            return "in_flight"
+        if database.oldest_pool_wait() * 1000 >= ADMISSION_MAX_POOL_WAIT_MS:
+            return "pool_wait"
+        return None
+
+    async def throttle(self, scope, rule: Optional[RouteRule]) -> Optional[float]:
+        """Seconds to wait before retrying if a bucket of this request's client is empty."""
+        if not RATE_LIMITS_ENABLED:
+            return None
+        client = scope.get("client")
+        ip = client[0] if client else "unknown"
+        checks = []
+        if RATE_LIMIT_DEFAULT:
+            checks.append(("default", "ip", f"ip:{ip}", RATE_LIMIT_DEFAULT))
+        if rule is not None and rule.limit:
+            checks.append((rule.name, "ip", f"{rule.name}:ip:{ip}", rule.limit))
+            user_id = _user_id(scope) if rule.per_user else None
+            if user_id is not None:
+                checks.append((rule.name, "user", f"{rule.name}:user:{user_id}", rule.limit))
+        for name, key_kind, key, limit in checks:
+            wait = await self.backend.take(key, limit)
+            if wait:
+                REQUESTS_THROTTLED.inc(name, key_kind)
+                return wait
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": ADMISSION_MAX_IN_FLIGHT,
+            "oldest_pool_wait_ms": round(database.oldest_pool_wait() * 1000, 3),
+            "max_pool_wait_ms": ADMISSION_MAX_POOL_WAIT_MS,
+            "routes": {
+                rule.name: {
+                    "in_flight": self.route_in_flight[rule.name],
+                    "max_in_flight": rule.max_in_flight,
+                    "limit": f"{rule.limit.burst}/{rule.limit.burst / rule.limit.per_second:g}s" if rule.limit else None,
+                }
+                for rule in ROUTE_RULES.values()
+            },
+            "rate_limits": {"enabled": RATE_LIMITS_ENABLED, **self.backend.stats()},
+        }
+
+
+admission = AdmissionController(load_rate_limit_backend(ADMISSION_BACKEND))
+
+
+async def _reject(send, status: int, detail: str, retry_after: float) -> None:
+    body = dumps({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """Applies the rate limits, route concurrency limits and load shedding above."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path.startswith(EXEMPT_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        rule = ROUTE_RULES.get((scope["method"], path.rstrip("/")))
+        long_lived = path.startswith(LONG_LIVED_PATHS)
+        if not long_lived:
+            reason = admission.shed_reason()
+            if reason is None and rule is not None and admission.route_in_flight[rule.name] >= rule.max_in_flight:
+                reason = rule.name
+            if reason is not None:
+                REQUESTS_SHED.inc(reason)
+                await _reject(send, 503, "Server is busy, please try again shortly", SHED_RETRY_AFTER_SECONDS)
+                return
+
+        wait = await admission.throttle(scope, rule)
+        if wait is not None:
+            await _reject(send, 429, "Too many requests, please slow down", wait)
+            return
+
+        if long_lived:
+            await self.app(scope, receive, send)
+            return
+        admission.in_flight += 1
+        if rule is not None:
+            admission.route_in_flight[rule.name] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.in_flight -= 1
+            if rule is not None:
+                admission.route_in_flight[rule.name] -= 1
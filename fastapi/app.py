@@ -1,14 +1,40 @@
+import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from database import connect_db, disconnect_db
-from init_db import init_db  # add this line
+import logging
+from logging_config import configure_logging
+from metrics import MetricsMiddleware
+from compression import CompressionMiddleware
+from db_router import ReadYourWritesMiddleware
+from admission import AdmissionMiddleware
+from storage import UploadLimitMiddleware
+from database import cache_invalidation_bridge, connect_db, disconnect_db, place_index
+from thumbnails import shutdown_thumbnail_pool
+from init_db import init_db
+from sync import start_tombstone_pruner, stop_tombstone_pruner
+from jobs import job_queue
 
-from routes.reviews import router as reviews_router
+from routes.reviews import router as reviews_router, review_feed_bridge
 from routes.users import router as users_router
+from routes.places import router as places_router
+from routes.system import router as system_router
+from routes.images import router as images_router
+from routes.imports import router as imports_router
+from routes.metrics import router as metrics_router
+from routes.profiling import router as profiling_router
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# serve.py migrates once before forking workers and turns this off for them
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
 
 app = FastAPI(title="Review API")
 
+app.add_middleware(UploadLimitMiddleware)
+# Innermost but for the upload limit, so its 429/503 responses still get CORS headers
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://nextjs:3000"],
@@ -17,17 +43,41 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+# Added last so it is outermost and times everything, CORS preflights included
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(reviews_router)
 app.include_router(users_router)
+app.include_router(places_router)
+app.include_router(system_router)
+app.include_router(images_router)
+app.include_router(imports_router)
+app.include_router(metrics_router)
+app.include_router(profiling_router)
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 @app.on_event("startup")
 async def startup():
     await connect_db()
-    await init_db()  # 🔥 auto create tables on startup
-    print("✅ FastAPI server started and DB initialized")
+    if MIGRATE_ON_STARTUP:
+        await init_db()  # applies pending migrations; a single version check when up to date
+    review_feed_bridge.start()
+    cache_invalidation_bridge.start()
+    await place_index.reload()
+    place_index.start()
+    start_tombstone_pruner()
+    job_queue.start()
+    logger.info("FastAPI server started and DB initialized")
 
 @app.on_event("shutdown")
 async def shutdown():
+    # Jobs first: running ones still need the database and the thumbnail pool
+    await job_queue.stop()
+    await review_feed_bridge.stop()
+    await cache_invalidation_bridge.stop()
+    await place_index.stop()
+    await stop_tombstone_pruner()
     await disconnect_db()
+    shutdown_thumbnail_pool()
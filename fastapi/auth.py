@@ -4,12 +4,29 @@ import jwt
 from jwt import ExpiredSignatureError, DecodeError
 from fastapi import HTTPException, Depends, Request
 from fastapi.security import OAuth2PasswordBearer
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import bcrypt
+import os
+import time
+from database import is_user_admin
+from profiling import record_phase
 
 SECRET_KEY = "advcompro"  # change this in production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 1 # 1 day
 
+# bcrypt cost factor for new hashes; stored hashes with a different cost are rehashed on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Hashes running at once (bcrypt releases the GIL, so threads use separate cores)
+BCRYPT_MAX_CONCURRENCY = int(os.getenv("BCRYPT_MAX_CONCURRENCY", str(os.cpu_count() or 2)))
+# Hashes allowed to wait for a thread before new requests get a 503
+BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", "32"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=BCRYPT_MAX_CONCURRENCY, thread_name_prefix="bcrypt")
+_hash_jobs_in_flight = 0  # running + queued; only touched from the event loop thread
+_hash_jobs_rejected = 0
+
 # pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/users/login")
 
@@ -27,7 +44,7 @@ def verify_password_str(plain_password: str, hashed_password_str: str) -> bool:
 def get_password_hash(password):
     return bcrypt.hashpw(
         bytes(password, encoding="utf-8"),
-        bcrypt.gensalt(),
+        bcrypt.gensalt(rounds=BCRYPT_ROUNDS),
     )
 
 
@@ -36,12 +53,56 @@ def get_password_hash_str(password: str) -> str:
     return hashed_bytes.decode('utf-8')
 
 
+def password_needs_rehash(hashed_password_str: str) -> bool:
+    # bcrypt hashes look like $2b$12$<salt+hash>; the second field is the cost
+    try:
+        return int(hashed_password_str.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+async def _run_hash_job(fn, *args):
+    """Run a bcrypt call on the hashing pool without blocking the event loop."""
+    global _hash_jobs_in_flight, _hash_jobs_rejected
+    if _hash_jobs_in_flight >= BCRYPT_MAX_CONCURRENCY + BCRYPT_MAX_QUEUE:
+        _hash_jobs_rejected += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    _hash_jobs_in_flight += 1
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _hash_jobs_in_flight -= 1
+        record_phase("password_hash", time.perf_counter() - started)
+
+
+async def get_password_hash_str_async(password: str) -> str:
+    return await _run_hash_job(get_password_hash_str, password)
+
+
+async def verify_password_str_async(plain_password, hashed_password_str: str) -> bool:
+    return await _run_hash_job(verify_password_str, plain_password, hashed_password_str)
+
+
+def hashing_stats() -> dict:
+    return {
+        "in_flight": _hash_jobs_in_flight,
+        "max_concurrency": BCRYPT_MAX_CONCURRENCY,
+        "max_queue": BCRYPT_MAX_QUEUE,
+        "rejected": _hash_jobs_rejected,
+        "rounds": BCRYPT_ROUNDS,
+    }
+
+
 def create_access_token(data: dict, remember_me: bool = False) -> str:
     payload = {**data, "exp": datetime.now(timezone.utc) + (timedelta(days=30) if remember_me else timedelta(hours=24))}
     if "id" in payload:
         payload["id"] = str(payload["id"])
 
-    print(payload)
     encoded_jwt = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -76,7 +137,23 @@ def decode_access_token(token: str):
 
 async def get_current_user(request: Request):
     token = request.cookies.get("access_token")
+    if not token:
+        # Clients without cookies (e.g. a Prometheus scraper) send the token as a bearer token
+        scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer":
+            token = credentials.strip()
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     payload = decode_access_token(token)
-    return payload
\ No newline at end of file
+    return payload
+
+
+async def require_admin(current_user=Depends(get_current_user)):
+    # users.is_admin is granted with admins.py; the token's email is whatever the user signed up with
+    try:
+        user_id = int(current_user["id"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    if not await is_user_admin(user_id):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
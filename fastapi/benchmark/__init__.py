@@ -0,0 +1,5 @@
+# benchmark/
+# Synthetic data and load tests for the API. Run from the fastapi/ directory:
+#   python -m benchmark.datagen --reviews 100000        fill the database
+#   python -m benchmark.loadtest --out before.json      drive the running server
+#   python -m benchmark.compare before.json after.json  diff two reports
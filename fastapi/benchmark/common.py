@@ -0,0 +1,50 @@
+# benchmark/common.py
+# Values shared by the data generator and the load generator.
+import io
+import random
+from PIL import Image, ImageDraw
+
+# Every generated user has this password so the load test can log in as any of them
+BENCH_PASSWORD = "bench-password"
+BENCH_EMAIL_DOMAIN = "bench.test"
+
+# (name, latitude, longitude): places are scattered around these
+CITIES = [
+    ("Bangkok", 13.7563, 100.5018),
+    ("Chiang Mai", 18.7883, 98.9853),
+    ("Phuket", 7.8804, 98.3923),
+    ("Tokyo", 35.6762, 139.6503),
+    ("Singapore", 1.3521, 103.8198),
+    ("Seoul", 37.5665, 126.9780),
+    ("London", 51.5074, -0.1278),
+    ("Paris", 48.8566, 2.3522),
+    ("New York", 40.7128, -74.0060),
+    ("San Francisco", 37.7749, -122.4194),
+    ("Sydney", -33.8688, 151.2093),
+    ("Sao Paulo", -23.5505, -46.6333),
+]
+# Standard deviation of a place's distance from its city centre, in degrees (~5.5km)
+CITY_SPREAD_DEGREES = 0.05
+
+WORDS = (
+    "great nice quiet busy friendly cozy clean cheap pricey slow fast tasty fresh "
+    "view staff service coffee food room beach park music seats parking menu "
+    "morning evening weekend crowded relaxing lovely average terrible amazing"
+).split()
+
+
+def bench_email(index: int) -> str:
+    return f"bench{index}@{BENCH_EMAIL_DOMAIN}"
+
+
+def render_image(rng: random.Random) -> bytes:
+    """A small JPEG of random rectangles; different for every call."""
+    image = Image.new("RGB", (320, 240), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(320), rng.randrange(240)
+        draw.rectangle((x, y, x + rng.randint(10, 120), y + rng.randint(10, 90)),
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=80)
+    return out.getvalue()
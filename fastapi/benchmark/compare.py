@@ -0,0 +1,59 @@
+# benchmark/compare.py
+# Compare two loadtest reports, e.g. from the parent commit and from yours.
+#   python -m benchmark.compare base.json new.json --threshold 10
+# Exits with 1 when any operation's p95 or throughput got worse by more than
+# --threshold percent, so it can gate a CI job.
+import argparse
+import json
+import sys
+
+METRICS = (
+    # (label, getter, higher_is_better)
+    ("rps", lambda op: op["throughput_rps"], True),
+    ("p50", lambda op: op["latency_ms"]["p50"], False),
+    ("p95", lambda op: op["latency_ms"]["p95"], False),
+    ("p99", lambda op: op["latency_ms"]["p99"], False),
+)
+GATED = ("rps", "p95")
+
+
+def change_percent(old: float, new: float) -> float:
+    return (new - old) / old * 100 if old else 0.0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare two load test reports")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args()
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"base {base['meta']['commit']}  new {new['meta']['commit']}")
+    print(f"{'operation':<10}" + "".join(f"{label:>26}" for label, _, _ in METRICS))
+    regressions = []
+    for name in sorted(set(base["operations"]) & set(new["operations"])):
+        old_op, new_op = base["operations"][name], new["operations"][name]
+        if not old_op["latency_ms"] or not new_op["latency_ms"]:
+            continue
+        cells = []
+        for label, get, higher_is_better in METRICS:
+            old_value, new_value = get(old_op), get(new_op)
+            change = change_percent(old_value, new_value)
+            cells.append(f"{old_value:>9.1f} -> {new_value:>9.1f} {change:+5.0f}%")
+            worse = -change if higher_is_better else change
+            if label in GATED and worse > args.threshold:
+                regressions.append(f"{name} {label} {change:+.1f}%")
+        print(f"{name:<10}" + "".join(f"{cell:>26}" for cell in cells))
+
+    if regressions:
+        print("Regressions over threshold: " + ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+# benchmark/datagen.py
+# Fill a local database with synthetic users, places, reviews and images.
+#   python -m benchmark.datagen --reviews 1000000 --users 20000 --places 100000
+#   python -m benchmark.datagen --reviews 10000 --truncate     start from empty tables
+#
+# The same --seed always produces the same rows. Places cluster around the cities
+# in common.py and their popularity is skewed, so a few places get most reviews.
+# Rows are streamed through binary COPY in batches of --batch-size, so memory
+# stays flat up to 10M reviews. Users are bench<N>@bench.test with the password
+# common.BENCH_PASSWORD, which the load test logs in with.
+import argparse
+import asyncio
+import hashlib
+import itertools
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from auth import get_password_hash_str
+from database import database
+from geo import geohash_encode
+from place_stats import rebuild_place_stats
+from storage import content_path
+from benchmark.common import (
+    BENCH_EMAIL_DOMAIN, BENCH_PASSWORD, CITIES, CITY_SPREAD_DEGREES, WORDS, bench_email, render_image,
+)
+
+CATEGORY_COUNT = 10
+# Relative frequency of 1..5 stars
+RATING_WEIGHTS = (5, 8, 15, 32, 40)
+REVIEW_HISTORY_DAYS = 730
+# Pareto shape for place popularity; lower is more skewed
+POPULARITY_ALPHA = 1.2
+
+
+def log(message: str) -> None:
+    print(f"[{time.strftime('%H:%M:%S')}] {message}", flush=True)
+
+
+def sentence(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize()
+
+
+def place_records(rng: random.Random, count: int):
+    seen = set()
+    while len(seen) < count:
+        _, city_lat, city_lng = rng.choice(CITIES)
+        latitude = round(rng.gauss(city_lat, CITY_SPREAD_DEGREES), 6)
+        longitude = round(rng.gauss(city_lng, CITY_SPREAD_DEGREES), 6)
+        if (latitude, longitude) in seen:
+            continue
+        seen.add((latitude, longitude))
+        yield (
+            f"{sentence(rng, 1, 2)} {rng.choice(['Cafe', 'Bistro', 'Park', 'Market', 'Gallery', 'Bar'])}",
+            rng.randint(1, CATEGORY_COUNT),
+            f"{rng.randint(1, 999)} {rng.choice(WORDS).capitalize()} Road",
+            latitude,
+            longitude,
+            geohash_encode(latitude, longitude),
+        )
+
+
+def store_images(rng: random.Random, count: int) -> list:
+    """Write `count` distinct JPEGs to content-addressed storage; returns (hash, path) pairs."""
+    images = []
+    for _ in range(count):
+        data = render_image(rng)
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = content_path(content_hash, ".jpg")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        images.append((content_hash, path))
+    return images
+
+
+def review_batches(rng, count, user_ids, place_ids, images, image_ratio, batch_size):
+    # Cumulative Pareto weights: the first places in the shuffled list are the popular ones
+    weights = list(itertools.accumulate(rng.paretovariate(POPULARITY_ALPHA) for _ in place_ids))
+    now = datetime.now().replace(microsecond=0)
+    remaining = count
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        places = rng.choices(place_ids, cum_weights=weights, k=size)
+        ratings = rng.choices(range(1, 6), weights=RATING_WEIGHTS, k=size)
+        batch = []
+        for place_id, rating in zip(places, ratings):
+            image_hash, image_path = rng.choice(images) if images and rng.random() < image_ratio else (None, None)
+            batch.append((
+                rng.choice(user_ids),
+                place_id,
+                rating,
+                sentence(rng, 2, 5),
+                sentence(rng, 8, 30),
+                image_path,
+                image_hash,
+                now - timedelta(seconds=rng.randrange(REVIEW_HISTORY_DAYS * 86400)),
+            ))
+        remaining -= size
+        yield batch
+
+
+async def generate(args) -> None:
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    await database.connect()
+    try:
+        async with database.connection() as connection:
+            raw = connection.raw_connection
+            if args.truncate:
+                await raw.execute("TRUNCATE users, places, reviews, photos, place_stats, tombstones, jobs RESTART IDENTITY CASCADE")
+                log("Truncated users, places, reviews, photos, place_stats and tombstones")
+
+            # Users: one bcrypt hash shared by all, inserted unless the email already exists
+            password_hash = get_password_hash_str(BENCH_PASSWORD)
+            async with raw.transaction():
+                await raw.execute("CREATE TEMP TABLE bench_users_stage (username VARCHAR(50), email VARCHAR(100)) ON COMMIT DROP")
+                await raw.copy_records_to_table(
+                    "bench_users_stage",
+                    records=((f"bench{i}", bench_email(i)) for i in range(args.users)),
+                    columns=["username", "email"],
+                )
+                await raw.execute(
+                    "INSERT INTO users (username, email, password_hash) "
+                    "SELECT username, email, $1 FROM bench_users_stage ON CONFLICT DO NOTHING",
+                    password_hash,
+                )
+            user_ids = [row["user_id"] for row in await raw.fetch(
+                "SELECT user_id FROM users WHERE email LIKE $1 ORDER BY user_id", f"%@{BENCH_EMAIL_DOMAIN}"
+            )]
+            log(f"{len(user_ids)} users ready")
+
+            async with raw.transaction():
+                await raw.execute("""
+                CREATE TEMP TABLE bench_places_stage (
+                    name VARCHAR(100), category_id INT, address TEXT,
+                    latitude DECIMAL(9,6), longitude DECIMAL(9,6), geohash VARCHAR(12)
+                ) ON COMMIT DROP
+                """)
+                await raw.copy_records_to_table(
+                    "bench_places_stage",
+                    records=place_records(rng, args.places),
+                    columns=["name", "category_id", "address", "latitude", "longitude", "geohash"],
+                )
+                status = await raw.execute("""
+                INSERT INTO places (name, category_id, address, latitude, longitude, geohash)
+                SELECT name, category_id, address, latitude, longitude, geohash FROM bench_places_stage
+                ON CONFLICT (latitude, longitude) DO NOTHING
+                """)
+            log(f"{status.split()[-1]} places created")
+            # Reviews go to every place, so a rerun without --truncate still has places to use
+            place_ids = [row["place_id"] for row in await raw.fetch("SELECT place_id FROM places ORDER BY place_id")]
+            rng.shuffle(place_ids)
+
+            images = store_images(rng, args.images)
+            if images:
+                await raw.executemany(
+                    "INSERT INTO photos (photo_url, content_hash, ref_count) VALUES ($2, $1, 0) "
+                    "ON CONFLICT (content_hash) DO NOTHING",
+                    images,
+                )
+            log(f"{len(images)} images stored")
+
+            written = 0
+            for batch in review_batches(rng, args.reviews, user_ids, place_ids, images,
+                                        args.image_ratio, args.batch_size):
+                await raw.copy_records_to_table(
+                    "reviews",
+                    records=batch,
+                    columns=["user_id", "place_id", "rating", "title", "comment",
+                             "image_path", "image_hash", "created_at"],
+                )
+                written += len(batch)
+                if written % (args.batch_size * 10) == 0 or written == args.reviews:
+                    rate = written / (time.perf_counter() - started)
+                    log(f"{written}/{args.reviews} reviews ({rate:.0f} rows/s overall)")
+
+            # Derived data the write paths would normally maintain
+            await rebuild_place_stats()
+            await raw.execute("""
+            UPDATE photos ph SET ref_count = c.n, place_id = c.place_id
+            FROM (SELECT image_hash, COUNT(*) AS n, MIN(place_id) AS place_id
+                  FROM reviews WHERE image_hash IS NOT NULL GROUP BY image_hash) c
+            WHERE ph.content_hash = c.image_hash
+            """)
+            await raw.execute("ANALYZE users, places, reviews, photos, place_stats")
+            log(f"Done in {time.perf_counter() - started:.1f}s")
+    finally:
+        await database.disconnect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark data")
+    parser.add_argument("--reviews", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--places", type=int, default=None, help="defaults to reviews / 10")
+    parser.add_argument("--images", type=int, default=50, help="distinct image files to create")
+    parser.add_argument("--image-ratio", type=float, default=0.2, help="share of reviews with an image")
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true",
+                        help="empty users, places, reviews and photos first (local databases only)")
+    args = parser.parse_args()
+    args.places = args.places or max(1, args.reviews // 10)
+    asyncio.run(generate(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# benchmark/loadtest.py
+# Closed-loop load test against a running server filled by benchmark.datagen.
+#   python -m benchmark.loadtest --concurrency 50 --duration 60 --out results.json
+#   python -m benchmark.loadtest --mix list=50,nearby=50 --users 1000
+#
+# Each of --concurrency workers picks an operation by --mix weight, sends it,
+# waits for the full response and repeats until --duration runs out. Requests
+# during the first --warmup seconds are not recorded. The JSON report has
+# throughput, status counts and p50/p95/p99 latency per operation, plus the
+# git commit, so benchmark.compare can diff runs. Start the server with
+# RATE_LIMITS_ENABLED=0: all the load comes from one address (see admission.py).
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import time
+from collections import Counter
+from datetime import datetime, timezone
+import httpx
+from benchmark.common import BENCH_PASSWORD, CITIES, CITY_SPREAD_DEGREES, WORDS, bench_email, render_image
+
+DEFAULT_MIX = "list=35,nearby=30,create=10,login=5,me=20"
+NEARBY_RADIUS_M = 2000
+PAGE_SIZE = 50
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.recording = False
+
+    def record(self, operation: str, seconds: float, status) -> None:
+        if not self.recording:
+            return
+        self.latencies.setdefault(operation, []).append(seconds)
+        self.statuses.setdefault(operation, Counter())[str(status)] += 1
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    # Nearest-rank
+    index = max(0, min(len(sorted_values) - 1, int(round(p * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: list, statuses: Counter, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if not status.startswith(("2", "3")))
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "status_counts": dict(statuses),
+        "throughput_rps": round(len(ordered) / elapsed, 2),
+        "latency_ms": {
+            "p50": round(percentile(ordered, 0.50) * 1000, 2),
+            "p95": round(percentile(ordered, 0.95) * 1000, 2),
+            "p99": round(percentile(ordered, 0.99) * 1000, 2),
+            "mean": round(sum(ordered) / len(ordered) * 1000, 2),
+            "max": round(ordered[-1] * 1000, 2),
+        } if ordered else None,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise SystemExit(f"unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def random_location(rng: random.Random) -> tuple:
+    _, latitude, longitude = rng.choice(CITIES)
+    return rng.gauss(latitude, CITY_SPREAD_DEGREES), rng.gauss(longitude, CITY_SPREAD_DEGREES)
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.recorder = Recorder()
+        self.tokens = []  # access_token cookies of logged-in bench users
+        # Every created review with an image uploads the same bytes, like a popular photo
+        self.image = render_image(self.rng)
+
+    def user_index(self) -> int:
+        return self.rng.randrange(self.args.users)
+
+    async def timed(self, operation: str, request) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            self.recorder.record(operation, time.perf_counter() - started, type(e).__name__)
+            return None
+        self.recorder.record(operation, time.perf_counter() - started, response.status_code)
+        return response
+
+    async def op_list(self, client: httpx.AsyncClient) -> None:
+        await self.timed("list", client.get("/api/reviews/", params={"limit": PAGE_SIZE}))
+
+    async def op_nearby(self, client: httpx.AsyncClient) -> None:
+        latitude, longitude = random_location(self.rng)
+        await self.timed("nearby", client.get("/api/reviews/", params={
+            "latitude": latitude, "longitude": longitude, "radius_m": NEARBY_RADIUS_M, "limit": PAGE_SIZE,
+        }))
+
+    async def op_create(self, client: httpx.AsyncClient) -> None:
+        latitude, longitude = random_location(self.rng)
+        data = {
+            "title": " ".join(self.rng.choice(WORDS) for _ in range(3)),
+            "comment": " ".join(self.rng.choice(WORDS) for _ in range(20)),
+            "rating": str(self.rng.randint(1, 5)),
+            "latitude": f"{latitude:.6f}",
+            "longitude": f"{longitude:.6f}",
+            "address": "Benchmark Road",
+            "user_id": str(self.rng.choice(self.user_ids)),
+        }
+        files = {"image": ("bench.jpg", self.image, "image/jpeg")} if self.rng.random() < self.args.image_ratio else None
+        await self.timed("create", client.post("/api/reviews/", data=data, files=files))
+
+    async def op_login(self, client: httpx.AsyncClient) -> None:
+        response = await self.timed("login", client.post("/users/login", json={
+            "email": bench_email(self.user_index()), "password": BENCH_PASSWORD, "remember_me": False,
+        }))
+        token = response.cookies.get("access_token") if response is not None else None
+        if token:
+            self.tokens.append(token)
+            del self.tokens[:-self.args.users]
+
+    async def op_me(self, client: httpx.AsyncClient) -> None:
+        token = self.rng.choice(self.tokens)
+        await self.timed("me", client.get("/users/me", headers={"Cookie": f"access_token={token}"}))
+
+    async def prepare(self, client: httpx.AsyncClient) -> None:
+        # Tokens for /users/me, and ids of users that may post reviews
+        self.user_ids = []
+        for _ in range(min(self.args.users, 20)):
+            index = self.user_index()
+            response = await client.post("/users/login", json={
+                "email": bench_email(index), "password": BENCH_PASSWORD, "remember_me": False,
+            })
+            if response.status_code != 200:
+                raise SystemExit(f"login as {bench_email(index)} failed ({response.status_code}); "
+                                 "run benchmark.datagen first")
+            self.tokens.append(response.cookies["access_token"])
+            self.user_ids.append(response.json()["user"]["user_id"])
+
+    async def worker(self, client: httpx.AsyncClient, deadline: float) -> None:
+        names = list(self.mix)
+        weights = list(self.mix.values())
+        while time.perf_counter() < deadline:
+            operation = self.rng.choices(names, weights=weights)[0]
+            await OPERATIONS[operation](self, client)
+
+    async def run(self) -> dict:
+        self.mix = parse_mix(self.args.mix)
+        limits = httpx.Limits(max_connections=self.args.concurrency, max_keepalive_connections=self.args.concurrency)
+        async with httpx.AsyncClient(base_url=self.args.base_url, limits=limits, timeout=self.args.timeout) as client:
+            await self.prepare(client)
+            started = time.perf_counter()
+            deadline = started + self.args.warmup + self.args.duration
+            workers = [asyncio.create_task(self.worker(client, deadline)) for _ in range(self.args.concurrency)]
+            await asyncio.sleep(self.args.warmup)
+            self.recorder.recording = True
+            measured_from = time.perf_counter()
+            await asyncio.gather(*workers)
+            elapsed = time.perf_counter() - measured_from
+
+        operations = {
+            name: summarize(self.recorder.latencies.get(name, []), self.recorder.statuses.get(name, Counter()), elapsed)
+            for name in self.mix
+        }
+        all_latencies = [value for values in self.recorder.latencies.values() for value in values]
+        all_statuses = sum(self.recorder.statuses.values(), Counter())
+        return {
+            "meta": {
+                "commit": git_commit(),
+                "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "base_url": self.args.base_url,
+                "concurrency": self.args.concurrency,
+                "duration_s": round(elapsed, 2),
+                "warmup_s": self.args.warmup,
+                "mix": self.mix,
+                "seed": self.args.seed,
+                "client_python": platform.python_version(),
+            },
+            "operations": operations,
+            "total": summarize(all_latencies, all_statuses, elapsed),
+        }
+
+
+OPERATIONS = {
+    "list": LoadTest.op_list,
+    "nearby": LoadTest.op_nearby,
+    "create": LoadTest.op_create,
+    "login": LoadTest.op_login,
+    "me": LoadTest.op_me,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the review API")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unrecorded seconds before measuring")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation=weight list, default {DEFAULT_MIX}")
+    parser.add_argument("--users", type=int, default=1000, help="bench users created by datagen")
+    parser.add_argument("--image-ratio", type=float, default=0.2, help="share of created reviews with an image")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(LoadTest(args).run())
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# benchmark/payload.py
+# Response size and encoding CPU of the review listing formats, measured in-process
+# against the database filled by benchmark.datagen (run from fastapi/ with DATABASE_URL set).
+#   python -m benchmark.payload --rows 500 --repeat 50
+#
+# For one page of --rows reviews it encodes the full rows the old way
+# (json.dumps(jsonable_encoder(...))), the full rows with orjson and the compact
+# marker columns with orjson, then compresses each body with gzip and brotli at the
+# server's levels. CPU is process time per encode or compress, averaged over --repeat.
+import argparse
+import asyncio
+import json
+import time
+from fastapi.encoders import jsonable_encoder
+from compression import compress
+from database import connect_db, database, disconnect_db
+from routes.reviews import MARKER_SELECT, REVIEW_SELECT, row_to_dict, rows_to_columns
+from serialization import dumps
+
+PAGE_QUERY = " ORDER BY r.created_at DESC, r.review_id DESC LIMIT :limit"
+
+
+def cpu_ms(fn, repeat: int) -> float:
+    started = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - started) / repeat * 1000
+
+
+async def load(limit: int) -> tuple:
+    await connect_db()
+    try:
+        rows = await database.fetch_all(REVIEW_SELECT + PAGE_QUERY, {"limit": limit})
+        markers = await database.fetch_all(MARKER_SELECT + PAGE_QUERY, {"limit": limit})
+    finally:
+        await disconnect_db()
+    return rows, markers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure listing payload size and encoding CPU")
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rows, markers = asyncio.run(load(args.rows))
+    if not rows:
+        raise SystemExit("No reviews; fill the database with benchmark.datagen first")
+
+    def legacy_rows():
+        return json.dumps(jsonable_encoder({"reviews": [row_to_dict(row) for row in rows]})).encode()
+
+    def orjson_rows():
+        return dumps({"reviews": [row_to_dict(row) for row in rows]})
+
+    def orjson_markers():
+        return dumps({"columns": rows_to_columns(markers), "count": len(markers)})
+
+    print(f"{len(rows)} reviews, {args.repeat} repeats")
+    print(f"{'format':<18}{'encode ms':>10}{'identity B':>12}{'gzip B':>10}{'gzip ms':>9}{'br B':>10}{'br ms':>8}")
+    for label, encode in (("rows json", legacy_rows), ("rows orjson", orjson_rows), ("markers orjson", orjson_markers)):
+        body = encode()
+        sizes, times = {}, {}
+        for encoding in ("gzip", "br"):
+            sizes[encoding] = len(compress(body, encoding))
+            times[encoding] = cpu_ms(lambda: compress(body, encoding), args.repeat)
+        print(f"{label:<18}{cpu_ms(encode, args.repeat):>10.2f}{len(body):>12}"
+              f"{sizes['gzip']:>10}{times['gzip']:>9.2f}{sizes['br']:>10}{times['br']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# benchmark/workers.py
+# Throughput of serve.py as the number of worker processes grows.
+#   python -m benchmark.workers --workers 1,2,4,8 --duration 20 --out scaling.json
+#
+# For each worker count it starts `python serve.py --workers N` on --port, waits
+# until it answers, drives it with --clients benchmark.loadtest processes (a single
+# client process runs out of CPU before several workers do) and stops it again.
+# Throughput and errors are summed over the clients; latency percentiles are those
+# of the slowest client. Run against a database filled by benchmark.datagen, on a
+# machine with at least as many cores as the largest count plus the clients. The
+# server runs with rate limits off, as every client connects from one address.
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from benchmark.loadtest import DEFAULT_MIX, git_commit
+
+SERVER_BOOT_TIMEOUT = 120.0
+
+
+def wait_until_up(base_url: str, server: subprocess.Popen) -> None:
+    deadline = time.monotonic() + SERVER_BOOT_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"serve.py exited with {server.returncode}; see --server-log")
+        try:
+            if httpx.get(f"{base_url}/openapi.json", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"serve.py did not come up within {SERVER_BOOT_TIMEOUT:.0f}s")
+
+
+def stop(server: subprocess.Popen) -> None:
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def run_clients(args, base_url: str) -> list:
+    with tempfile.TemporaryDirectory() as directory:
+        outputs = [os.path.join(directory, f"client{index}.json") for index in range(args.clients)]
+        clients = [
+            subprocess.Popen([
+                sys.executable, "-m", "benchmark.loadtest", "--base-url", base_url,
+                "--concurrency", str(args.concurrency), "--duration", str(args.duration),
+                "--warmup", str(args.warmup), "--mix", args.mix, "--users", str(args.users),
+                "--seed", str(args.seed + index), "--out", output,
+            ], stdout=subprocess.DEVNULL)
+            for index, output in enumerate(outputs)
+        ]
+        for client in clients:
+            if client.wait() != 0:
+                raise SystemExit("a load test client failed")
+        reports = []
+        for output in outputs:
+            with open(output) as f:
+                reports.append(json.load(f))
+    return reports
+
+
+def combine(workers: int, reports: list) -> dict:
+    totals = [report["total"] for report in reports]
+    latencies = [total["latency_ms"] for total in totals if total["latency_ms"]]
+    return {
+        "workers": workers,
+        "requests": sum(total["requests"] for total in totals),
+        "errors": sum(total["errors"] for total in totals),
+        "throughput_rps": round(sum(total["throughput_rps"] for total in totals), 2),
+        "latency_ms": {
+            key: max(latency[key] for latency in latencies) for key in ("p50", "p95", "p99")
+        } if latencies else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure throughput against serve.py worker count")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--clients", type=int, default=2, help="load test processes")
+    parser.add_argument("--concurrency", type=int, default=25, help="connections per client")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds per count")
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--users", type=int, default=1000, help="bench users created by datagen")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--server-log", help="append serve.py output here")
+    parser.add_argument("--out", help="write the JSON report here as well")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    log = open(args.server_log, "a") if args.server_log else subprocess.DEVNULL
+    results = []
+    try:
+        for workers in (int(count) for count in args.workers.split(",")):
+            server = subprocess.Popen(
+                [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(workers)],
+                stdout=log, stderr=log, env={**os.environ, "RATE_LIMITS_ENABLED": "0"},
+            )
+            try:
+                wait_until_up(base_url, server)
+                results.append(combine(workers, run_clients(args, base_url)))
+            finally:
+                stop(server)
+            result = results[-1]
+            print(f"{workers:>3} workers  {result['throughput_rps']:>9.1f} rps  "
+                  f"p95 {result['latency_ms']['p95']:>8.2f}ms  errors {result['errors']}", file=sys.stderr)
+    finally:
+        if log is not subprocess.DEVNULL:
+            log.close()
+
+    baseline = results[0]["throughput_rps"] or 1
+    print(f"{'workers':>8}{'rps':>10}{'speedup':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for result in results:
+        latency = result["latency_ms"] or {"p50": 0, "p95": 0, "p99": 0}
+        print(f"{result['workers']:>8}{result['throughput_rps']:>10.1f}{result['throughput_rps'] / baseline:>8.2f}x"
+              f"{latency['p50']:>9.2f}{latency['p95']:>9.2f}{latency['p99']:>9.2f}{result['errors']:>8}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "meta": {"commit": git_commit(), "cpu_count": os.cpu_count(), "clients": args.clients,
+                         "concurrency": args.concurrency, "duration_s": args.duration, "mix": args.mix},
+                "results": results,
+            }, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# bulk_import.py
+# Bulk load places and reviews from CSV or NDJSON.
+#   python bulk_import.py reviews.ndjson
+#   python bulk_import.py places.csv --format csv
+#
+# Each row is one review with its place, or just a place when user_id/rating are empty:
+#   latitude, longitude, place_name, address, category_id,
+#   user_id, rating, title, comment, created_at
+# Rows are parsed in batches, streamed through binary COPY into a temp staging
+# table, and merged into places/reviews/place_stats by one set-based statement.
+import argparse
+import asyncio
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Iterator, Optional
+from starlette.concurrency import run_in_threadpool
+from database import database, invalidate_cache
+from geo import geohash_encode
+
+IMPORT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 20
+COORDINATE_STEP = Decimal("0.000001")  # places.latitude/longitude are DECIMAL(9,6)
+
+STAGING_COLUMNS = [
+    "line_no", "latitude", "longitude", "geohash", "place_name", "address", "category_id",
+    "user_id", "rating", "title", "comment", "created_at",
+]
+
+CREATE_STAGING = """
+CREATE TEMP TABLE import_staging (
+    line_no INT NOT NULL,
+    latitude DECIMAL(9,6) NOT NULL,
+    longitude DECIMAL(9,6) NOT NULL,
+    geohash VARCHAR(12) COLLATE "C",
+    place_name VARCHAR(100) NOT NULL,
+    address TEXT,
+    category_id INT,
+    user_id INT,
+    rating INT,
+    title VARCHAR(200),
+    comment TEXT,
+    created_at TIMESTAMP
+) ON COMMIT DROP
+"""
+
+# New places (first row wins per coordinate), then every staged review against
+# either a new or an existing place, then the matching place_stats increments.
+# A place committed by another transaction after this statement's snapshot is in
+# neither `existing` nor a DO NOTHING insert; DO UPDATE returns it instead (only
+# such rows conflict after the NOT EXISTS filter, so nothing else is rewritten).
+MERGE_QUERY = """
+WITH coords AS (
+    SELECT DISTINCT ON (latitude, longitude) latitude, longitude, geohash, place_name, address, category_id
+    FROM import_staging
+    ORDER BY latitude, longitude, line_no
+), new_places AS (
+    INSERT INTO places (name, category_id, address, latitude, longitude, geohash)
+    SELECT c.place_name, COALESCE(c.category_id, 1), c.address, c.latitude, c.longitude, c.geohash
+    FROM coords c
+    WHERE NOT EXISTS (
+        SELECT 1 FROM places p WHERE p.latitude = c.latitude AND p.longitude = c.longitude
+    )
+    ON CONFLICT (latitude, longitude) DO UPDATE SET latitude = EXCLUDED.latitude
+    RETURNING place_id, latitude, longitude, (xmax = 0) AS created
+), matched_places AS (
+    SELECT place_id, latitude, longitude FROM new_places
+    UNION ALL
+    SELECT * FROM (
+        SELECT DISTINCT ON (p.latitude, p.longitude) p.place_id, p.latitude, p.longitude
+        FROM places p
+        JOIN coords c ON p.latitude = c.latitude AND p.longitude = c.longitude
+        ORDER BY p.latitude, p.longitude, p.place_id
+    ) existing
+), new_review AS (
+    INSERT INTO reviews (user_id, place_id, rating, title, comment, created_at)
+    SELECT s.user_id, m.place_id, s.rating, s.title, s.comment, COALESCE(s.created_at, NOW())
+    FROM import_staging s
+    JOIN matched_places m ON m.latitude = s.latitude AND m.longitude = s.longitude
+    JOIN users u ON u.user_id = s.user_id
+    RETURNING place_id, rating, created_at
+), stats AS (
+    INSERT INTO place_stats (place_id, review_count, rating_sum,
+                             rating_1, rating_2, rating_3, rating_4, rating_5, last_review_at)
+    SELECT place_id, COUNT(*), COALESCE(SUM(rating), 0),
+           COUNT(*) FILTER (WHERE rating = 1), COUNT(*) FILTER (WHERE rating = 2),
+           COUNT(*) FILTER (WHERE rating = 3), COUNT(*) FILTER (WHERE rating = 4),
+           COUNT(*) FILTER (WHERE rating = 5), MAX(created_at)
+    FROM new_review
+    GROUP BY place_id
+    ON CONFLICT (place_id) DO UPDATE SET
+        review_count = place_stats.review_count + EXCLUDED.review_count,
+        rating_sum = place_stats.rating_sum + EXCLUDED.rating_sum,
+        rating_1 = place_stats.rating_1 + EXCLUDED.rating_1,
+        rating_2 = place_stats.rating_2 + EXCLUDED.rating_2,
+        rating_3 = place_stats.rating_3 + EXCLUDED.rating_3,
+        rating_4 = place_stats.rating_4 + EXCLUDED.rating_4,
+        rating_5 = place_stats.rating_5 + EXCLUDED.rating_5,
+        last_review_at = GREATEST(place_stats.last_review_at, EXCLUDED.last_review_at)
+)
+SELECT (SELECT COUNT(*) FROM new_places WHERE created) AS places_created,
+       (SELECT COUNT(*) FROM new_review) AS reviews_created,
+       (SELECT ARRAY_AGG(s.line_no ORDER BY s.line_no) FROM import_staging s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM matched_places m WHERE m.latitude = s.latitude AND m.longitude = s.longitude
+        )) AS unplaced_lines,
+       (SELECT ARRAY_AGG(s.line_no ORDER BY s.line_no) FROM import_staging s
+        WHERE s.user_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = s.user_id)) AS unknown_user_lines
+"""
+
+
+class RowError(ValueError):
+    pass
+
+
+def _text(row: dict, key: str, max_length: Optional[int] = None) -> Optional[str]:
+    value = row.get(key)
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    if max_length is not None and len(value) > max_length:
+        raise RowError(f"{key} is longer than {max_length} characters")
+    return value
+
+
+def _int(row: dict, key: str) -> Optional[int]:
+    value = _text(row, key)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise RowError(f"{key} must be an integer")
+
+
+def _coordinate(row: dict, key: str, limit: int) -> Decimal:
+    value = _text(row, key)
+    if value is None:
+        raise RowError(f"{key} is required")
+    try:
+        number = Decimal(value).quantize(COORDINATE_STEP)
+    except InvalidOperation:
+        raise RowError(f"{key} must be a number")
+    if not -limit <= number <= limit:
+        raise RowError(f"{key} is out of range")
+    return number
+
+
+def parse_row(line_no: int, row: dict) -> tuple:
+    """Validate one input row and return it as a staging record."""
+    latitude = _coordinate(row, "latitude", 90)
+    longitude = _coordinate(row, "longitude", 180)
+    user_id = _int(row, "user_id")
+    rating = _int(row, "rating")
+    if (user_id is None) != (rating is None):
+        raise RowError("user_id and rating must be given together")
+    if rating is not None and not 1 <= rating <= 5:
+        raise RowError("rating must be between 1 and 5")
+    created_at = _text(row, "created_at")
+    if created_at is not None:
+        try:
+            created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).replace(tzinfo=None)
+        except ValueError:
+            raise RowError("created_at must be an ISO 8601 timestamp")
+    place_name = _text(row, "place_name", 100) or (_text(row, "title", 200) or "Imported place")[:100]
+    return (
+        line_no,
+        latitude,
+        longitude,
+        geohash_encode(float(latitude), float(longitude)),
+        place_name,
+        _text(row, "address"),
+        _int(row, "category_id"),
+        user_id,
+        rating,
+        _text(row, "title", 200),
+        _text(row, "comment"),
+        created_at,
+    )
+
+
+def read_rows(text: io.TextIOBase, fmt: str) -> Iterator[tuple]:
+    """Yield (line_no, dict) pairs; dict is None when the line itself is malformed."""
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_no, None
+            continue
+        yield line_no, row if isinstance(row, dict) else None
+
+
+def next_batch(rows: Iterator[tuple], report: dict) -> list:
+    """Parse up to IMPORT_BATCH_SIZE rows (runs in a worker thread)."""
+    batch = []
+    for line_no, row in rows:
+        try:
+            if row is None:
+                raise RowError("malformed row")
+            batch.append(parse_row(line_no, row))
+        except RowError as e:
+            report["rejected"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"line": line_no, "error": str(e)})
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            break
+    return batch
+
+
+async def import_file(binary_file, fmt: str) -> dict:
+    """Import an open binary file of CSV or NDJSON rows and return a report."""
+    if fmt not in ("csv", "ndjson"):
+        raise ValueError("format must be csv or ndjson")
+    started = time.perf_counter()
+    report = {"accepted": 0, "rejected": 0, "errors": []}
+    text = io.TextIOWrapper(binary_file, encoding="utf-8", newline="")
+    rows = read_rows(text, fmt)
+
+    try:
+        async with database.connection() as connection:
+            async with connection.transaction():
+                raw = connection.raw_connection
+                await raw.execute(CREATE_STAGING)
+                while True:
+                    batch = await run_in_threadpool(next_batch, rows, report)
+                    if not batch:
+                        break
+                    await raw.copy_records_to_table("import_staging", records=batch, columns=STAGING_COLUMNS)
+                    report["accepted"] += len(batch)
+                result = await raw.fetchrow(MERGE_QUERY)
+    finally:
+        # Leave the caller's file open
+        text.detach()
+
+    # Rows the merge could not use; none should be unplaced, but never count them as imported
+    unplaced_lines = result["unplaced_lines"] or []
+    unknown_user_lines = sorted(set(result["unknown_user_lines"] or []) - set(unplaced_lines))
+    for line_nos, error in ((unplaced_lines, "no place for these coordinates"), (unknown_user_lines, "unknown user_id")):
+        report["accepted"] -= len(line_nos)
+        report["rejected"] += len(line_nos)
+        for line_no in line_nos[:max(MAX_REPORTED_ERRORS - len(report["errors"]), 0)]:
+            report["errors"].append({"line": line_no, "error": error})
+
+    elapsed = time.perf_counter() - started
+    report.update({
+        "places_created": result["places_created"],
+        "reviews_created": result["reviews_created"],
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(report["accepted"] / elapsed, 1) if elapsed > 0 else None,
+    })
+    # Stats of arbitrary places changed; cheaper to drop the entity cache than to track them
+    await invalidate_cache(clear=True)
+    return report
+
+
+async def main(path: str, fmt: str) -> None:
+    await database.connect()
+    try:
+        with open(path, "rb") as f:
+            report = await import_file(f, fmt)
+        for error in report["errors"]:
+            print(f"  line {error['line']}: {error['error']}")
+        print(
+            f"✅ Imported {report['accepted']} rows ({report['rejected']} rejected): "
+            f"{report['places_created']} places, {report['reviews_created']} reviews "
+            f"in {report['seconds']}s ({report['rows_per_second']} rows/s)"
+        )
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import places and reviews")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="defaults to the file extension")
+    args = parser.parse_args()
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    asyncio.run(main(args.path, fmt))
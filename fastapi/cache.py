@@ -0,0 +1,222 @@
+# cache.py
+# Caching for read-heavy paths.
+#
+# Response cache: rendered listings keyed on (data version, normalized query); any
+# write bumps the version so older entries are never served again and simply age out.
+#
+# Entity cache: read-through cache for user and place rows, invalidated by the
+# writes in database.py. It sits behind the CacheBackend interface so a shared
+# cache process can replace the per-worker memory backend (ENTITY_CACHE_BACKEND).
+#
+# With the memory backends each uvicorn worker has its own copy; writes reach the
+# other workers' copies over LISTEN/NOTIFY (database.invalidate_cache).
+import hashlib
+import importlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+from fastapi import Request, Response
+import anyio.to_thread
+from db_router import reads_from_primary
+from compression import COMPRESSION_MIN_SIZE, COMPRESSION_THREAD_MIN_SIZE, choose_encoding, compress
+from serialization import dumps
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+ENTITY_CACHE_MAX_ENTRIES = int(os.getenv("ENTITY_CACHE_MAX_ENTRIES", "10000"))
+ENTITY_CACHE_TTL_SECONDS = float(os.getenv("ENTITY_CACHE_TTL_SECONDS", "300"))
+# "memory" or "package.module:BackendClass" for a custom CacheBackend
+ENTITY_CACHE_BACKEND = os.getenv("ENTITY_CACHE_BACKEND", "memory")
+
+
+class TTLCache:
+    """LRU cache with a per-entry time-to-live and hit/miss/eviction counters."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class CacheBackend:
+    """Storage for the entity cache.
+
+    Methods are async so a backend can talk to a shared cache process.
+    Keys are tuples of str/int/float; values are plain dicts of row columns.
+    """
+
+    async def get(self, key: tuple) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, key: tuple, value: Any) -> None:
+        raise NotImplementedError
+
+    async def delete(self, *keys: tuple) -> None:
+        raise NotImplementedError
+
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Per-process backend built on TTLCache."""
+
+    def __init__(self, max_entries: int = ENTITY_CACHE_MAX_ENTRIES, ttl_seconds: float = ENTITY_CACHE_TTL_SECONDS):
+        self._cache = TTLCache(max_entries, ttl_seconds)
+
+    async def get(self, key: tuple) -> Optional[Any]:
+        return self._cache.get(key)
+
+    async def set(self, key: tuple, value: Any) -> None:
+        self._cache.set(key, value)
+
+    async def delete(self, *keys: tuple) -> None:
+        for key in keys:
+            self._cache.delete(key)
+
+    async def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {"backend": "memory", **self._cache.stats()}
+
+
+def load_cache_backend(spec: str) -> CacheBackend:
+    if spec == "memory":
+        return MemoryCacheBackend()
+    module_name, _, class_name = spec.partition(":")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class()
+
+
+response_cache = TTLCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+entity_cache = load_cache_backend(ENTITY_CACHE_BACKEND)
+
+
+def set_entity_cache_backend(backend: CacheBackend) -> None:
+    global entity_cache
+    entity_cache = backend
+
+
+def get_entity_cache() -> CacheBackend:
+    return entity_cache
+
+
+_data_version = 0
+
+
+def data_version() -> int:
+    return _data_version
+
+
+def bump_data_version() -> None:
+    """Call after any write to reviews, places or users so cached listings are skipped."""
+    global _data_version
+    _data_version += 1
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+async def cached_json_response(
+    request: Request,
+    key: tuple,
+    build: Callable[[], Awaitable[Any]],
+    media_type: str = "application/json",
+    vary: str = "",
+) -> Response:
+    """Serve `build()`'s payload as JSON from the response cache, honouring If-None-Match.
+
+    Compressed bodies are kept in the cache entry next to the plain one, so a hot
+    listing is compressed once per encoding rather than once per request.
+    """
+    # Read the version before building so a write that races with us leaves the entry unreachable
+    full_key = (data_version(),) + key
+    # Requests pinned to the primary (read-your-writes) rebuild rather than risk an
+    # entry built from a replica that had not caught up yet
+    entry = None if reads_from_primary() else response_cache.get(full_key)
+    if entry is None:
+        payload = await build()
+        body = dumps(payload)
+        entry = (body, make_etag(body), {})
+        response_cache.set(full_key, entry)
+
+    body, etag, encoded = entry
+    # no-cache: clients may store the body but must revalidate, which costs a 304 at most
+    headers = {"Cache-Control": "no-cache", "Vary": ", ".join(filter(None, (vary, "Accept-Encoding")))}
+    encoding = choose_encoding(request.headers.get("accept-encoding")) if len(body) >= COMPRESSION_MIN_SIZE else None
+    if encoding:
+        if encoding not in encoded:
+            if len(body) >= COMPRESSION_THREAD_MIN_SIZE:
+                encoded[encoding] = await anyio.to_thread.run_sync(compress, body, encoding)
+            else:
+                encoded[encoding] = compress(body, encoding)
+        body = encoded[encoding]
+        # Each encoding is a different representation, so it gets its own validator
+        etag = etag[:-1] + "-" + encoding + '"'
+    headers["ETag"] = etag
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,115 @@
+# compression.py
+# Response compression: brotli when the client accepts it, otherwise gzip.
+#
+# CompressionMiddleware extends Starlette's GZipMiddleware and keeps its rules:
+# bodies under COMPRESSION_MIN_SIZE go out as they are, Server-Sent Events and
+# already-compressed media types are skipped, and streamed bodies (NDJSON) are
+# compressed chunk by chunk with a flush, so every chunk still reaches the client
+# as soon as it is written. Responses that already carry Content-Encoding pass
+# through; cached listings use that to compress once per cache entry (cache.py).
+import os
+import time
+from typing import Optional
+import anyio.to_thread
+import brotli
+import zlib
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder, IdentityResponder
+from profiling import record_phase
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Moderate levels: the top ones cost several times the CPU for a few percent
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+# Larger bodies are compressed in a worker thread so the event loop keeps serving
+COMPRESSION_THREAD_MIN_SIZE = 128 * 1024
+
+# Preferred first when the client accepts both equally
+SUPPORTED_ENCODINGS = ("br", "gzip")
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The encoding to use for an Accept-Encoding header, or None for identity."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip()] = weight
+    best = None
+    for encoding in SUPPORTED_ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > weights.get(best, weights.get("*", 0.0))):
+            best = encoding
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """One-shot compression of a complete body."""
+    started = time.perf_counter()
+    if encoding == "br":
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compressed = compressor.compress(body) + compressor.flush()
+    record_phase("compress", time.perf_counter() - started)
+    return compressed
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int, **kwargs):
+        super().__init__(app, minimum_size, **kwargs)
+        self._compressor = None
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if len(body) >= COMPRESSION_THREAD_MIN_SIZE:
+            return await anyio.to_thread.run_sync(self._compress_body, body, more_body)
+        return self._compress_body(body, more_body)
+
+    def _compress_body(self, body: bytes, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        if more_body:
+            return self._compressor.process(body) + self._compressor.flush()
+        return self._compressor.process(body) + self._compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    def __init__(self, app):
+        super().__init__(
+            app,
+            minimum_size=COMPRESSION_MIN_SIZE,
+            compresslevel=GZIP_LEVEL,
+            thread_minimum_size=COMPRESSION_THREAD_MIN_SIZE,
+        )
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept_encoding)
+        options = {"exclude_content_types": self.exclude_content_types}
+        if encoding == "br":
+            responder = BrotliResponder(self.app, self.minimum_size, **options)
+        elif encoding == "gzip":
+            responder = GZipResponder(
+                self.app, self.minimum_size, compresslevel=self.compresslevel,
+                thread_minimum_size=self.thread_minimum_size, **options,
+            )
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size, **options)
+        await responder(scope, receive, send)
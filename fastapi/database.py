@@ -1,16 +1,34 @@
 # database.py
-from databases import Database
 from typing import Optional, Any
 import asyncio
+import json
+import logging
+import os
+from geo import geohash_encode
+import cache
+from cache import bump_data_version
+from feed import REVIEW_FEED_CHANNEL, NotifyBridge
+from metrics import InstrumentedDatabase
+from db_router import DATABASE_REPLICA_URLS, ReadRouter, reads_from_primary
+from place_index import IndexedPlace, PlaceIndex
+from serialization import dumps_str
 
-POSTGRES_USER = "temp"
-POSTGRES_PASSWORD = "temp"
-POSTGRES_DB = "advcompro"
-POSTGRES_HOST = "db"
-POSTGRES_PORT = 5432
+POSTGRES_USER = os.getenv("POSTGRES_USER", "temp")
+POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "temp")
+POSTGRES_DB = os.getenv("POSTGRES_DB", "advcompro")
+POSTGRES_HOST = os.getenv("POSTGRES_HOST", "db")
+POSTGRES_PORT = int(os.getenv("POSTGRES_PORT", "5432"))
 
-DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-database = Database(DATABASE_URL)
+# DATABASE_URL overrides the POSTGRES_* parts; pool settings are in db_pool.py
+DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}",
+)
+database = InstrumentedDatabase(DATABASE_URL)
+# Read-only lookups and listings; writes and anything that must see them go to `database`
+read_database = ReadRouter(database, [InstrumentedDatabase(url) for url in DATABASE_REPLICA_URLS])
+
+logger = logging.getLogger(__name__)
 
 async def connect_db():
     max_retries = 10
@@ -19,20 +37,99 @@ async def connect_db():
     for attempt in range(max_retries):
         try:
             await database.connect()
-            print(f"✓ Database connected successfully!")
+            logger.info("Database connected")
+            await read_database.connect()
             return
         except Exception as e:
             if attempt < max_retries - 1:
-                print(f"⚠ Database connection attempt {attempt + 1}/{max_retries} failed. Retrying in {retry_delay}s...")
+                logger.warning(
+                    "Database connection attempt %d/%d failed, retrying in %ds: %s",
+                    attempt + 1, max_retries, retry_delay, e,
+                )
                 await asyncio.sleep(retry_delay)
             else:
-                print(f"✗ Failed to connect to database after {max_retries} attempts")
+                logger.error("Failed to connect to database after %d attempts", max_retries)
                 raise e
 
 
 async def disconnect_db() -> None:
+    await read_database.disconnect()
     await database.disconnect()
-    print("Database disconnected")
+    logger.info("Database disconnected")
+
+
+# ---------------- ENTITY CACHE ---------------- #
+# Users and places rarely change, so lookups go through cache.entity_cache.
+# Every write below invalidates the keys it touches before returning, and bumps
+# the response cache's data version. invalidate_cache does both in this worker and
+# sends them on CACHE_INVALIDATION_CHANNEL, which every worker LISTENs on, so the
+# others drop their copies as soon as the write has committed. New reviews need no
+# message of their own: every worker hears of them on the review feed and
+# invalidates their places there (routes/reviews.py publish_new_reviews).
+
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+# NOTIFY payloads are limited to 8000 bytes; larger invalidations clear everything
+CACHE_INVALIDATION_MAX_PAYLOAD = 7000
+
+
+async def drop_cached(keys: list, clear: bool = False) -> None:
+    """Invalidate entity cache keys (or all of them) and cached listings in this worker."""
+    entity_cache = cache.get_entity_cache()
+    if clear:
+        await entity_cache.clear()
+    elif keys:
+        await entity_cache.delete(*keys)
+    bump_data_version()
+
+async def invalidate_cache(*keys: tuple, clear: bool = False) -> None:
+    """drop_cached in every worker. Call after the write has committed."""
+    await drop_cached(list(keys), clear)
+    payload = dumps_str({"keys": keys})
+    if clear or len(payload) > CACHE_INVALIDATION_MAX_PAYLOAD:
+        payload = dumps_str({"clear": True})
+    await database.execute(
+        "SELECT pg_notify(:channel, :payload)",
+        values={"channel": CACHE_INVALIDATION_CHANNEL, "payload": payload},
+    )
+
+async def _apply_invalidations(payloads: list) -> None:
+    # Includes this worker's own messages, which only repeat what it already did
+    keys = []
+    clear = False
+    for payload in payloads:
+        message = json.loads(payload)
+        clear = clear or message.get("clear", False)
+        keys.extend(tuple(key) for key in message.get("keys", ()))
+    await drop_cached(keys, clear)
+
+def _invalidations_missed() -> None:
+    # Messages sent while the LISTEN connection was down are lost
+    asyncio.get_running_loop().create_task(drop_cached([], clear=True))
+
+cache_invalidation_bridge = NotifyBridge(
+    CACHE_INVALIDATION_CHANNEL, database.connect_dedicated, _apply_invalidations, _invalidations_missed,
+)
+
+
+async def _cached_fetch_one(key: tuple, query: str, values: dict) -> Optional[dict]:
+    entity_cache = cache.get_entity_cache()
+    # Pinned requests re-read from the primary, refreshing anything a replica cached stale
+    cached = None if reads_from_primary() else await entity_cache.get(key)
+    if cached is not None:
+        return cached
+    row = await read_database.fetch_one(query=query, values=values)
+    if row is None:
+        return None  # misses are not cached, so inserts need no invalidation
+    value = dict(row._mapping)
+    await entity_cache.set(key, value)
+    return value
+
+def _user_keys(user_id: int, *emails: str) -> list:
+    return [("user", user_id)] + [("user_email", email) for email in emails if email]
+
+def _place_location_key(latitude: float, longitude: float) -> tuple:
+    # Match the DECIMAL(9,6) rounding applied by the database
+    return ("place_location", round(float(latitude), 6), round(float(longitude), 6))
 
 
 # ---------------- USERS ---------------- #
@@ -51,53 +148,240 @@ async def insert_user(username: str, password_hash: str, email: str) -> Any:
 
 async def get_user(user_id: int) -> Optional[Any]:
     query = "SELECT * FROM users WHERE user_id = :user_id"
-    return await database.fetch_one(query=query, values={"user_id": user_id})
+    return await _cached_fetch_one(("user", user_id), query, {"user_id": user_id})
 
 async def get_user_by_email(email: str) -> Optional[Any]:
     query = "SELECT * FROM users WHERE email = :email"
-    return await database.fetch_one(query=query, values={"email": email})
+    return await _cached_fetch_one(("user_email", email), query, {"email": email})
+
+async def is_user_admin(user_id: int) -> bool:
+    # Not cached and not from a replica, so a revoke applies to the next request
+    row = await database.fetch_one("SELECT is_admin FROM users WHERE user_id = :user_id", values={"user_id": user_id})
+    return bool(row and row["is_admin"])
 
 async def update_user(user_id: int, username: str, password_hash: str, email: str) -> Any:
     query = """
+    WITH old AS (SELECT email FROM users WHERE user_id = :user_id)
     UPDATE users
     SET username = :username, password_hash = :password_hash, email = :email
     WHERE user_id = :user_id
-    RETURNING user_id, username, password_hash, email, created_at
+    RETURNING user_id, username, password_hash, email, created_at, (SELECT email FROM old) AS old_email
     """
     values = {"user_id": user_id, "username": username, "password_hash": password_hash, "email": email}
-    return await database.fetch_one(query=query, values=values)
+    result = await database.fetch_one(query=query, values=values)
+    if result is not None:
+        await invalidate_cache(*_user_keys(user_id, result["old_email"], result["email"]))
+    return result
+
+async def update_user_password_hash(user_id: int, password_hash: str) -> None:
+    query = "UPDATE users SET password_hash = :password_hash WHERE user_id = :user_id RETURNING email"
+    result = await database.fetch_one(query=query, values={"user_id": user_id, "password_hash": password_hash})
+    if result is not None:
+        await invalidate_cache(*_user_keys(user_id, result["email"]))
 
 async def delete_user(user_id: int) -> Any:
+    # The user's reviews go with them (ON DELETE CASCADE), so take them out of place_stats first
+    stats_query = """
+    UPDATE place_stats s
+    SET review_count = s.review_count - d.review_count,
+        rating_sum = s.rating_sum - d.rating_sum,
+        rating_1 = s.rating_1 - d.rating_1,
+        rating_2 = s.rating_2 - d.rating_2,
+        rating_3 = s.rating_3 - d.rating_3,
+        rating_4 = s.rating_4 - d.rating_4,
+        rating_5 = s.rating_5 - d.rating_5,
+        last_review_at = (
+            SELECT MAX(r.created_at) FROM reviews r
+            WHERE r.place_id = s.place_id AND r.user_id <> :user_id
+        )
+    FROM (
+        SELECT place_id, COUNT(*) AS review_count, COALESCE(SUM(rating), 0) AS rating_sum,
+               COUNT(*) FILTER (WHERE rating = 1) AS rating_1,
+               COUNT(*) FILTER (WHERE rating = 2) AS rating_2,
+               COUNT(*) FILTER (WHERE rating = 3) AS rating_3,
+               COUNT(*) FILTER (WHERE rating = 4) AS rating_4,
+               COUNT(*) FILTER (WHERE rating = 5) AS rating_5
+        FROM reviews WHERE user_id = :user_id
+        GROUP BY place_id
+    ) d
+    WHERE s.place_id = d.place_id
+    RETURNING s.place_id
+    """
+    # Release the user's references to stored images; storage.py gc removes files at zero
+    photos_query = """
+    UPDATE photos ph
+    SET ref_count = ph.ref_count - d.references
+    FROM (
+        SELECT image_hash, COUNT(*) AS references
+        FROM reviews
+        WHERE user_id = :user_id AND image_hash IS NOT NULL
+        GROUP BY image_hash
+    ) d
+    WHERE ph.content_hash = d.image_hash
+    """
     query = "DELETE FROM users WHERE user_id = :user_id RETURNING *"
-    return await database.fetch_one(query=query, values={"user_id": user_id})
+    async with database.transaction():
+        touched_places = await database.fetch_all(query=stats_query, values={"user_id": user_id})
+        await database.execute(query=photos_query, values={"user_id": user_id})
+        result = await database.fetch_one(query=query, values={"user_id": user_id})
+    if result is not None:
+        await invalidate_cache(
+            *_user_keys(user_id, result["email"]),
+            *[("place", row["place_id"]) for row in touched_places],
+        )
+    return result
 
 
 # ---------------- PLACES ---------------- #
 
 async def insert_place(name: str, category_id: int, address: str, latitude: float, longitude: float) -> Any:
     query = """
-    INSERT INTO places (name, category_id, address, latitude, longitude)
-    VALUES (:name, :category_id, :address, :latitude, :longitude)
-    RETURNING place_id, name, category_id, address, latitude, longitude, created_at
+    INSERT INTO places (name, category_id, address, latitude, longitude, geohash)
+    VALUES (:name, :category_id, :address, :latitude, :longitude, :geohash)
+    RETURNING place_id, name, category_id, address, latitude, longitude, geohash, created_at
     """
-    values = {"name": name, "category_id": category_id, "address": address, "latitude": latitude, "longitude": longitude}
-    return await database.fetch_one(query=query, values=values)
+    values = {
+        "name": name,
+        "category_id": category_id,
+        "address": address,
+        "latitude": latitude,
+        "longitude": longitude,
+        "geohash": geohash_encode(latitude, longitude),
+    }
+    result = await database.fetch_one(query=query, values=values)
+    await invalidate_cache(_place_location_key(latitude, longitude))
+    place_index.upsert(IndexedPlace(result["place_id"], name, float(latitude), float(longitude), 0, None))
+    return result
+
+# Rows for place_index: coordinates plus the rating aggregates it ranks by
+PLACE_INDEX_ROWS = """
+    SELECT p.place_id, p.name, p.latitude::float8 AS latitude, p.longitude::float8 AS longitude,
+           COALESCE(ps.review_count, 0) AS review_count,
+           ps.rating_sum::float8 / NULLIF(ps.rating_1 + ps.rating_2 + ps.rating_3 + ps.rating_4 + ps.rating_5, 0) AS avg_rating
+    FROM places p
+    LEFT JOIN place_stats ps ON ps.place_id = p.place_id
+"""
+
+async def load_place_index_rows() -> list:
+    return await read_database.fetch_all(query=PLACE_INDEX_ROWS)
+
+async def refresh_indexed_places_for_reviews(review_ids: list) -> list:
+    """Re-read the places of just-committed reviews into place_index (from the primary,
+    which has them); returns their place ids."""
+    query = PLACE_INDEX_ROWS + "WHERE p.place_id IN (SELECT place_id FROM reviews WHERE review_id = ANY(:review_ids))"
+    rows = await database.fetch_all(query=query, values={"review_ids": review_ids})
+    place_index.upsert_rows(rows)
+    return [row["place_id"] for row in rows]
+
+place_index = PlaceIndex(load_place_index_rows)
+
+async def get_place(place_id: int) -> Optional[Any]:
+    query = """
+    SELECT p.place_id, p.name, p.description, p.category_id, p.address, p.latitude, p.longitude, p.created_at,
+           COALESCE(ps.review_count, 0) AS review_count,
+           COALESCE(ps.rating_sum, 0) AS rating_sum,
+           ps.rating_sum::float8 / NULLIF(ps.rating_1 + ps.rating_2 + ps.rating_3 + ps.rating_4 + ps.rating_5, 0) AS avg_rating,
+           COALESCE(ps.rating_1, 0) AS rating_1, COALESCE(ps.rating_2, 0) AS rating_2,
+           COALESCE(ps.rating_3, 0) AS rating_3, COALESCE(ps.rating_4, 0) AS rating_4,
+           COALESCE(ps.rating_5, 0) AS rating_5,
+           ps.last_review_at
+    FROM places p
+    LEFT JOIN place_stats ps ON ps.place_id = p.place_id
+    WHERE p.place_id = :place_id
+    """
+    # Cached with its stats; review writes invalidate ("place", place_id)
+    return await _cached_fetch_one(("place", place_id), query, {"place_id": place_id})
 
 async def get_place_by_location(latitude: float, longitude: float) -> Optional[Any]:
     query = "SELECT * FROM places WHERE latitude = :latitude AND longitude = :longitude"
-    return await database.fetch_one(query=query, values={"latitude": latitude, "longitude": longitude})
+    return await _cached_fetch_one(
+        _place_location_key(latitude, longitude), query, {"latitude": latitude, "longitude": longitude}
+    )
 
 
 # ---------------- REVIEWS ---------------- #
 
-async def insert_review(user_id: int, place_id: int, rating: int, comment: str) -> Any:
+# Folds one new review into place_stats. Used as a CTE after an INSERT ... RETURNING
+# named new_review, so the review and its aggregate land in the same statement.
+PLACE_STATS_INCREMENT = """
+    INSERT INTO place_stats (place_id, review_count, rating_sum,
+                             rating_1, rating_2, rating_3, rating_4, rating_5, last_review_at)
+    SELECT place_id, 1, COALESCE(rating, 0),
+           COALESCE((rating = 1)::int, 0), COALESCE((rating = 2)::int, 0), COALESCE((rating = 3)::int, 0),
+           COALESCE((rating = 4)::int, 0), COALESCE((rating = 5)::int, 0), created_at
+    FROM new_review
+    ON CONFLICT (place_id) DO UPDATE SET
+        review_count = place_stats.review_count + EXCLUDED.review_count,
+        rating_sum = place_stats.rating_sum + EXCLUDED.rating_sum,
+        rating_1 = place_stats.rating_1 + EXCLUDED.rating_1,
+        rating_2 = place_stats.rating_2 + EXCLUDED.rating_2,
+        rating_3 = place_stats.rating_3 + EXCLUDED.rating_3,
+        rating_4 = place_stats.rating_4 + EXCLUDED.rating_4,
+        rating_5 = place_stats.rating_5 + EXCLUDED.rating_5,
+        last_review_at = GREATEST(place_stats.last_review_at, EXCLUDED.last_review_at)
+"""
+
+# Registers (or adds a reference to) the stored image of new_review, keyed on its content hash
+PHOTO_REFERENCE = """
+    INSERT INTO photos (place_id, photo_url, content_hash, ref_count, uploaded_at)
+    SELECT place_id, image_path, image_hash, 1, created_at
+    FROM new_review
+    WHERE image_hash IS NOT NULL
+    ON CONFLICT (content_hash) DO UPDATE SET ref_count = photos.ref_count + 1
+"""
+
+# Announces new_review on the live feed (feed.py). NOTIFY is delivered on commit, so
+# listeners never load a review that was rolled back. A SELECT-only CTE is evaluated
+# only when referenced, hence the outer queries list `notify` in their FROM.
+REVIEW_NOTIFY = """
+    SELECT pg_notify(:feed_channel, review_id::text) FROM new_review
+"""
+
+# Job kind for rendering a new image's thumbnails; jobs.JOB_HANDLERS runs it
+DERIVATIVES_JOB = "render_derivatives"
+
+# Queues post-write work for new_review (jobs.py) in the same transaction, so the
+# job exists exactly when the review does and survives a restart right after commit
+REVIEW_JOBS = """
+    INSERT INTO jobs (kind, payload)
+    SELECT :derivatives_job, jsonb_build_object('content_hash', image_hash)
+    FROM new_review
+    WHERE image_hash IS NOT NULL
+"""
+
+async def insert_review(
+    user_id: int,
+    place_id: int,
+    rating: int,
+    comment: str,
+    image_path: Optional[str] = None,
+    image_hash: Optional[str] = None,
+) -> Any:
     query = """
-    INSERT INTO reviews (user_id, place_id, rating, comment, review_date)
-    VALUES (:user_id, :place_id, :rating, :comment, NOW())
-    RETURNING review_id, user_id, place_id, rating, comment, review_date
+    WITH new_review AS (
+        INSERT INTO reviews (user_id, place_id, rating, comment, image_path, image_hash, created_at)
+        VALUES (:user_id, :place_id, :rating, :comment, :image_path, :image_hash, NOW())
+        RETURNING review_id, user_id, place_id, rating, comment, image_path, image_hash, created_at
+    ), stats AS (""" + PLACE_STATS_INCREMENT + """
+    ), photo AS (""" + PHOTO_REFERENCE + """
+    ), review_jobs AS (""" + REVIEW_JOBS + """
+    ), notify AS (""" + REVIEW_NOTIFY + """)
+    SELECT new_review.* FROM new_review, notify
     """
-    values = {"user_id": user_id, "place_id": place_id, "rating": rating, "comment": comment}
-    return await database.fetch_one(query=query, values=values)
+    values = {
+        "user_id": user_id,
+        "place_id": place_id,
+        "rating": rating,
+        "comment": comment,
+        "image_path": image_path,
+        "image_hash": image_hash,
+        "feed_channel": REVIEW_FEED_CHANNEL,
+        "derivatives_job": DERIVATIVES_JOB,
+    }
+    result = await database.fetch_one(query=query, values=values)
+    await cache.get_entity_cache().delete(("place", place_id))
+    bump_data_version()
+    return result
 
 async def get_all_reviews() -> list:
     query = """
@@ -107,7 +391,7 @@ async def get_all_reviews() -> list:
     JOIN places p ON r.place_id = p.place_id
     ORDER BY r.review_date DESC
     """
-    return await database.fetch_all(query=query)
+    return await read_database.fetch_all(query=query)
 
 async def get_review_by_id(review_id: int) -> Optional[Any]:
     query = """
@@ -117,7 +401,7 @@ async def get_review_by_id(review_id: int) -> Optional[Any]:
     JOIN places p ON r.place_id = p.place_id
     WHERE r.review_id = :review_id
     """
-    return await database.fetch_one(query=query, values={"review_id": review_id})
+    return await read_database.fetch_one(query=query, values={"review_id": review_id})
 
 
 # ---------------- PHOTOS ---------------- #
@@ -131,13 +415,99 @@ async def insert_photo(place_id: int, user_id: int, photo_url: str) -> Any:
     return await database.fetch_one(query=query, values={"place_id": place_id, "user_id": user_id, "photo_url": photo_url})
 
 
-# Add to database.py in the PLACES section
+# Get-or-create for places on the (latitude, longitude) unique constraint, as CTEs
+# ending in `place` (data-modifying CTEs cannot be nested, so callers splice these
+# into their own WITH). An existing place is read, not rewritten. The read uses the
+# statement's snapshot, so a place committed by a concurrent insert after it began
+# is missed and `place` comes back empty; run the statement again
+# (PLACE_UPSERT_ATTEMPTS), by when the place is visible.
+PLACE_UPSERT = """
+    inserted_place AS (
+        INSERT INTO places (name, category_id, address, latitude, longitude, geohash)
+        VALUES (:name, :category_id, :address, :latitude, :longitude, :geohash)
+        ON CONFLICT (latitude, longitude) DO NOTHING
+        RETURNING place_id, name, category_id, address, latitude, longitude, geohash, created_at,
+                  TRUE AS place_created
+    ), place AS (
+        SELECT * FROM inserted_place
+        UNION ALL
+        SELECT place_id, name, category_id, address, latitude, longitude, geohash, created_at,
+               FALSE AS place_created
+        FROM places
+        -- Rounded as the insert rounds them, or 7.1234 (a float) would not match 7.123400
+        WHERE latitude = CAST(:latitude AS DECIMAL(9,6)) AND longitude = CAST(:longitude AS DECIMAL(9,6))
+          AND NOT EXISTS (SELECT 1 FROM inserted_place)
+    )
+"""
+PLACE_UPSERT_ATTEMPTS = 2
 
 async def get_or_create_place(name: str, address: str, latitude: float, longitude: float, category_id: int = 1) -> Any:
-    # First try to find existing place
-    existing_place = await get_place_by_location(latitude, longitude)
-    if existing_place:
-        return existing_place
-    
-    # Create new place if not exists
-    return await insert_place(name, category_id, address, latitude, longitude)
\ No newline at end of file
+    values = {
+        "name": name,
+        "category_id": category_id,
+        "address": address,
+        "latitude": latitude,
+        "longitude": longitude,
+        "geohash": geohash_encode(latitude, longitude),
+    }
+    for _ in range(PLACE_UPSERT_ATTEMPTS):
+        place = await database.fetch_one(query="WITH " + PLACE_UPSERT + " SELECT * FROM place", values=values)
+        if place is not None:
+            break
+    else:
+        raise RuntimeError(f"No place at ({latitude}, {longitude}) after {PLACE_UPSERT_ATTEMPTS} attempts")
+    if place["place_created"]:
+        await invalidate_cache()
+    return place
+
+
+async def add_review_at_location(
+    user_id: int,
+    rating: int,
+    comment: str,
+    place_name: str,
+    address: str,
+    latitude: float,
+    longitude: float,
+    image_path: Optional[str] = None,
+    image_hash: Optional[str] = None,
+    category_id: int = 1,
+) -> Any:
+    """Get-or-create the place and insert the review (plus stats and photo refs) in one round-trip."""
+    query = """
+    WITH """ + PLACE_UPSERT + """, new_review AS (
+        INSERT INTO reviews (user_id, place_id, rating, comment, image_path, image_hash, created_at)
+        SELECT :user_id, place_id, :rating, :comment, :image_path, :image_hash, NOW()
+        FROM place
+        RETURNING review_id, user_id, place_id, rating, comment, image_path, image_hash, created_at
+    ), stats AS (""" + PLACE_STATS_INCREMENT + """
+    ), photo AS (""" + PHOTO_REFERENCE + """
+    ), review_jobs AS (""" + REVIEW_JOBS + """
+    ), notify AS (""" + REVIEW_NOTIFY + """)
+    SELECT new_review.*, place.place_created
+    FROM new_review, place, notify
+    """
+    values = {
+        "name": place_name,
+        "category_id": category_id,
+        "address": address,
+        "latitude": latitude,
+        "longitude": longitude,
+        "geohash": geohash_encode(latitude, longitude),
+        "user_id": user_id,
+        "rating": rating,
+        "comment": comment,
+        "image_path": image_path,
+        "image_hash": image_hash,
+        "feed_channel": REVIEW_FEED_CHANNEL,
+        "derivatives_job": DERIVATIVES_JOB,
+    }
+    for _ in range(PLACE_UPSERT_ATTEMPTS):
+        result = await database.fetch_one(query=query, values=values)
+        if result is not None:
+            break
+    else:
+        raise RuntimeError(f"No place at ({latitude}, {longitude}) after {PLACE_UPSERT_ATTEMPTS} attempts")
+    await cache.get_entity_cache().delete(("place", result["place_id"]))
+    bump_data_version()
+    return result
@@ -0,0 +1,188 @@
+# db_pool.py
+# Connection pool settings and telemetry for the asyncpg backend of `databases`.
+#
+# PooledDatabase swaps in a backend whose connections time every pool.acquire(),
+# so /system/pool can tell a slow database (queries slow, few waiters) apart from
+# pool starvation (all connections in use, waiters and acquire time climbing).
+#
+# asyncpg caches a prepared statement per connection for every distinct query
+# string. The queries in database.py and routes/ are fixed strings with bound
+# parameters, so once a connection has run one it skips the parse/plan step;
+# DB_STATEMENT_CACHE_SIZE just has to cover them all. Set it to 0 behind
+# PgBouncer in transaction mode, which cannot keep prepared statements.
+import asyncio
+import asyncpg
+import itertools
+import os
+import time
+from collections import deque
+from databases import Database
+from databases.backends.postgres import PostgresBackend, PostgresConnection
+from fastapi import HTTPException
+from profiling import record_phase
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# Seconds a request may wait for a free connection before it gets a 503
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+# 0 keeps cached statements for the life of the connection (asyncpg's default is 300s)
+DB_MAX_CACHED_STATEMENT_LIFETIME = float(os.getenv("DB_MAX_CACHED_STATEMENT_LIFETIME", "0"))
+# Idle connections above min_size are closed after this many seconds
+DB_MAX_INACTIVE_CONNECTION_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_CONNECTION_LIFETIME", "300"))
+# Per-query timeout in seconds; unset means none
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT")) if os.getenv("DB_COMMAND_TIMEOUT") else None
+
+ACQUIRE_SAMPLES = 1024  # recent acquire waits kept for percentiles
+
+
+class PoolTimeout(HTTPException):
+    """No connection became free within DB_POOL_ACQUIRE_TIMEOUT; answered as a 503."""
+
+    def __init__(self):
+        super().__init__(
+            status_code=503,
+            detail="Database is busy, please try again shortly",
+            headers={"Retry-After": "1"},
+        )
+
+
+class PoolTelemetry:
+    def __init__(self):
+        self.waiting = 0
+        self.max_waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = deque(maxlen=ACQUIRE_SAMPLES)
+        # ticket -> perf_counter() at which it started waiting, oldest first
+        self._waiters = {}
+        self._tickets = itertools.count()
+
+    def record(self, waited: float) -> None:
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.recent_waits.append(waited)
+
+    def start_wait(self, started: float) -> int:
+        ticket = next(self._tickets)
+        self._waiters[ticket] = started
+        return ticket
+
+    def end_wait(self, ticket: int) -> None:
+        del self._waiters[ticket]
+
+    def oldest_wait(self) -> float:
+        """Seconds the longest-waiting acquire has been waiting so far; 0 with none waiting."""
+        for started in self._waiters.values():
+            return time.perf_counter() - started
+        return 0.0
+
+    def stats(self) -> dict:
+        recent = sorted(self.recent_waits)
+
+        def percentile(p: float):
+            if not recent:
+                return None
+            return round(recent[min(len(recent) - 1, int(p * len(recent)))] * 1000, 3)
+
+        return {
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "oldest_waiter_ms": round(self.oldest_wait() * 1000, 3),
+            "acquire_wait_ms": {
+                "mean": round(self.total_wait / self.acquired * 1000, 3) if self.acquired else None,
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(self.max_wait * 1000, 3),
+            },
+        }
+
+
+class InstrumentedPostgresConnection(PostgresConnection):
+    async def acquire(self) -> None:
+        assert self._connection is None, "Connection is already acquired"
+        assert self._database._pool is not None, "DatabaseBackend is not running"
+        telemetry = self._database.telemetry
+        telemetry.waiting += 1
+        telemetry.max_waiting = max(telemetry.max_waiting, telemetry.waiting)
+        started = time.perf_counter()
+        ticket = telemetry.start_wait(started)
+        try:
+            self._connection = await self._database._pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            telemetry.timeouts += 1
+            raise PoolTimeout()
+        finally:
+            telemetry.waiting -= 1
+            telemetry.end_wait(ticket)
+            record_phase("db_wait", time.perf_counter() - started)
+        telemetry.record(time.perf_counter() - started)
+
+
+class InstrumentedPostgresBackend(PostgresBackend):
+    def __init__(self, database_url, **options):
+        super().__init__(database_url, **options)
+        self.telemetry = PoolTelemetry()
+
+    def connection(self) -> InstrumentedPostgresConnection:
+        return InstrumentedPostgresConnection(self, self._dialect)
+
+    def pool_stats(self) -> dict:
+        pool = self._pool
+        if pool is None:
+            return {"connected": False, **self.telemetry.stats()}
+        size = pool.get_size()
+        idle = pool.get_idle_size()
+        return {
+            "connected": True,
+            "size": size,
+            "in_use": size - idle,
+            "idle": idle,
+            "min_size": pool.get_min_size(),
+            "max_size": pool.get_max_size(),
+            **self.telemetry.stats(),
+        }
+
+
+class PooledDatabase(Database):
+    SUPPORTED_BACKENDS = {
+        **Database.SUPPORTED_BACKENDS,
+        "postgresql": "db_pool:InstrumentedPostgresBackend",
+        "postgres": "db_pool:InstrumentedPostgresBackend",
+    }
+
+    def __init__(self, url: str, **options):
+        pool_options = {
+            "min_size": DB_POOL_MIN_SIZE,
+            "max_size": DB_POOL_MAX_SIZE,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "max_cached_statement_lifetime": DB_MAX_CACHED_STATEMENT_LIFETIME,
+            "max_inactive_connection_lifetime": DB_MAX_INACTIVE_CONNECTION_LIFETIME,
+            "command_timeout": DB_COMMAND_TIMEOUT,
+        }
+        pool_options.update(options)
+        super().__init__(url, **pool_options)
+
+    async def connect_dedicated(self) -> asyncpg.Connection:
+        """A connection outside the pool, for sessions held open indefinitely (LISTEN)."""
+        url = self.url
+        return await asyncpg.connect(
+            host=url.hostname, port=url.port or 5432, user=url.username,
+            password=url.password, database=url.database,
+        )
+
+    def oldest_pool_wait(self) -> float:
+        return self._backend.telemetry.oldest_wait()
+
+    def pool_stats(self) -> dict:
+        return {
+            **self._backend.pool_stats(),
+            "acquire_timeout_seconds": DB_POOL_ACQUIRE_TIMEOUT,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        }
@@ -0,0 +1,281 @@
+# db_router.py
+# Sends read-only queries to read replicas while writes stay on the primary.
+#
+# DATABASE_REPLICA_URLS lists the replicas (comma separated). With none configured
+# every read goes to the primary, so a single-database setup behaves as before.
+# Only code that calls read_database (database.py) is routed; writes, migrations,
+# the live feed and delta sync use `database`, the primary, directly.
+#
+# A background check measures each replica's replay lag every
+# DB_REPLICA_CHECK_SECONDS. Replicas that fail the check, lag more than
+# DB_REPLICA_MAX_LAG_SECONDS or drop a connection mid-read are skipped until a
+# later check passes; with none left, reads fall back to the primary.
+#
+# Read-your-writes: a request that writes (any method but GET/HEAD/OPTIONS) runs
+# entirely on the primary and sets a short-lived cookie; reads that carry the
+# cookie stay on the primary for DB_READ_YOUR_WRITES_SECONDS, by which time the
+# replicas have caught up with that client's writes. The cookie keeps this working
+# across uvicorn workers. Responses built from the primary skip the response cache
+# (cache.py) so the writer never gets a page cached from a lagging replica.
+import asyncio
+import itertools
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+import asyncpg
+from databases import Database
+from db_pool import PoolTimeout
+
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# round_robin, or least_loaded: the replica with the fewest busy and waiting connections
+DB_REPLICA_SELECTION = os.getenv("DB_REPLICA_SELECTION", "round_robin")
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+DB_REPLICA_CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "2"))
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+READ_YOUR_WRITES_COOKIE = "db_primary_until"
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# A replica that has replayed everything it received is current however long ago the
+# last transaction was (after a restart the receive position starts behind replay,
+# hence <=); a server that is not in recovery counts as current too, so any second
+# instance with the same data works for local testing.
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+END::float8
+"""
+
+# Errors that mean the replica (not the query) is the problem. A replica whose pool
+# stays exhausted is saturated: reads go to the primary until the next check.
+REPLICA_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.InterfaceError, asyncpg.CannotConnectNowError, PoolTimeout)
+
+logger = logging.getLogger(__name__)
+
+_primary_only: ContextVar[bool] = ContextVar("primary_only", default=False)
+
+
+def reads_from_primary() -> bool:
+    """True while handling a request that must not read from a replica."""
+    return _primary_only.get()
+
+
+class Replica:
+    def __init__(self, database: Database):
+        self.database = database
+        url = database.url
+        self.name = f"{url.hostname}:{url.port or 5432}/{url.database}"
+        self.connected = False
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.reads = 0
+        self.failures = 0
+
+    async def measure_lag(self) -> float:
+        return await self.database.fetch_val(REPLICA_LAG_QUERY)
+
+    def load(self) -> int:
+        stats = self.database.pool_stats()
+        return stats.get("in_use", 0) + stats["waiting"]
+
+    def mark_unhealthy(self, error: BaseException) -> None:
+        if self.healthy:
+            logger.warning("Replica %s taken out of rotation: %s", self.name, error)
+        self.healthy = False
+        self.failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "connected": self.connected,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "last_error": self.last_error,
+            "reads": self.reads,
+            "failures": self.failures,
+            "pool": self.database.pool_stats(),
+        }
+
+
+class ReadRouter:
+    """Runs read-only queries on a healthy replica, or on the primary."""
+
+    def __init__(self, primary: Database, replicas: list):
+        self.primary = primary
+        self.replicas = [Replica(database) for database in replicas]
+        self._round_robin = itertools.count()
+        self._checker = None
+        self.primary_reads = 0
+        self.fallbacks = 0
+
+    async def connect(self) -> None:
+        # A replica that is down at startup must not keep the app from serving
+        for replica in self.replicas:
+            await self._connect(replica)
+        if self.replicas:
+            await self.check_replicas()
+            self._checker = asyncio.create_task(self._check_periodically())
+
+    async def disconnect(self) -> None:
+        if self._checker is not None:
+            self._checker.cancel()
+            await asyncio.gather(self._checker, return_exceptions=True)
+            self._checker = None
+        for replica in self.replicas:
+            if replica.connected:
+                await replica.database.disconnect()
+                replica.connected = False
+
+    async def _connect(self, replica: Replica) -> None:
+        try:
+            await replica.database.connect()
+            replica.connected = True
+        except (*REPLICA_ERRORS, asyncpg.PostgresError) as e:
+            replica.mark_unhealthy(e)
+
+    async def check_replicas(self) -> None:
+        for replica in self.replicas:
+            if not replica.connected:
+                await self._connect(replica)
+                if not replica.connected:
+                    continue
+            try:
+                lag = await asyncio.wait_for(replica.measure_lag(), DB_REPLICA_CHECK_SECONDS)
+            except (*REPLICA_ERRORS, asyncpg.PostgresError) as e:
+                replica.lag = None
+                replica.mark_unhealthy(e)
+                continue
+            replica.lag = lag
+            if lag > DB_REPLICA_MAX_LAG_SECONDS:
+                replica.mark_unhealthy(RuntimeError(f"lagging {lag:.1f}s behind the primary"))
+            elif not replica.healthy:
+                logger.info("Replica %s in rotation (lag %.3fs)", replica.name, lag)
+                replica.healthy = True
+                replica.last_error = None
+
+    async def _check_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(DB_REPLICA_CHECK_SECONDS)
+            try:
+                await self.check_replicas()
+            except Exception:
+                logger.exception("Replica health check failed")
+
+    def choose(self) -> Optional[Replica]:
+        """The replica for the next read, or None to read from the primary."""
+        if reads_from_primary():
+            return None
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        if DB_REPLICA_SELECTION == "least_loaded":
+            return min(healthy, key=Replica.load)
+        return healthy[next(self._round_robin) % len(healthy)]
+
+    async def _read(self, method: str, query, values: Optional[dict], *args):
+        replica = self.choose()
+        if replica is not None:
+            try:
+                result = await getattr(replica.database, method)(query, values, *args)
+                replica.reads += 1
+                return result
+            except REPLICA_ERRORS as e:
+                replica.mark_unhealthy(e)
+                self.fallbacks += 1
+        self.primary_reads += 1
+        return await getattr(self.primary, method)(query, values, *args)
+
+    async def fetch_all(self, query, values: Optional[dict] = None):
+        return await self._read("fetch_all", query, values)
+
+    async def fetch_one(self, query, values: Optional[dict] = None):
+        return await self._read("fetch_one", query, values)
+
+    async def fetch_val(self, query, values: Optional[dict] = None, column=0):
+        return await self._read("fetch_val", query, values, column)
+
+    async def iterate(self, query, values: Optional[dict] = None):
+        replica = self.choose()
+        if replica is not None:
+            started = False
+            try:
+                async for row in replica.database.iterate(query, values):
+                    started = True
+                    yield row
+                replica.reads += 1
+                return
+            except REPLICA_ERRORS as e:
+                replica.mark_unhealthy(e)
+                # Rows already sent cannot be taken back
+                if started:
+                    raise
+                self.fallbacks += 1
+        self.primary_reads += 1
+        async for row in self.primary.iterate(query, values):
+            yield row
+
+    def stats(self) -> dict:
+        return {
+            "selection": DB_REPLICA_SELECTION,
+            "max_lag_seconds": DB_REPLICA_MAX_LAG_SECONDS,
+            "read_your_writes_seconds": DB_READ_YOUR_WRITES_SECONDS,
+            "primary_reads": self.primary_reads,
+            "fallbacks": self.fallbacks,
+            "replicas": [replica.stats() for replica in self.replicas],
+        }
+
+
+class ReadYourWritesMiddleware:
+    """Pins writes, and reads shortly after them, to the primary (see module comment)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Without replicas every read is on the primary already, and pinning would
+        # only make writes (login, sign-up) skip the entity cache for nothing
+        if scope["type"] not in ("http", "websocket") or not DATABASE_REPLICA_URLS:
+            await self.app(scope, receive, send)
+            return
+
+        now = time.time()
+        writes = scope["type"] == "http" and scope["method"] not in READ_METHODS
+        token = _primary_only.set(writes or self._pinned(scope, now))
+        try:
+            if not writes:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_with_cookie(message):
+                if message["type"] == "http.response.start":
+                    until = int(now + DB_READ_YOUR_WRITES_SECONDS) + 1
+                    cookie = (
+                        f"{READ_YOUR_WRITES_COOKIE}={until}; Max-Age={int(DB_READ_YOUR_WRITES_SECONDS) + 1}; "
+                        "Path=/; HttpOnly; SameSite=Lax"
+                    )
+                    message["headers"] = [*message.get("headers", []), (b"set-cookie", cookie.encode("latin-1"))]
+                await send(message)
+
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            _primary_only.reset(token)
+
+    @staticmethod
+    def _pinned(scope, now: float) -> bool:
+        for name, value in scope["headers"]:
+            if name != b"cookie":
+                continue
+            for part in value.decode("latin-1").split(";"):
+                key, _, until = part.strip().partition("=")
+                if key == READ_YOUR_WRITES_COOKIE:
+                    try:
+                        return float(until) > now
+                    except ValueError:
+                        return False
+        return False
@@ -0,0 +1,262 @@
+# feed.py
+# Push channel for newly created reviews.
+#
+# add_review_at_location calls pg_notify(REVIEW_FEED_CHANNEL, review_id) inside the
+# statement that inserts the review, so the notification is sent when it commits.
+# Every uvicorn worker LISTENs on the channel over one dedicated connection
+# (NotifyBridge), loads the new rows once per batch and hands them to its FeedHub,
+# which fans them out to the SSE and WebSocket clients connected to that worker.
+#
+# Each subscriber has a bounded queue. A client that falls FEED_QUEUE_SIZE events
+# behind is dropped rather than buffered without limit: its queue is replaced by a
+# single "overflow" event and the client is expected to refetch and resubscribe.
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, NamedTuple, Optional
+import asyncpg
+from serialization import dumps_str
+
+FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE", "100"))
+FEED_MAX_SUBSCRIBERS = int(os.getenv("FEED_MAX_SUBSCRIBERS", "1000"))
+# Seconds between SSE keepalive comments, which also detect dead clients
+FEED_HEARTBEAT_SECONDS = float(os.getenv("FEED_HEARTBEAT_SECONDS", "15"))
+# An SSE response ends after this long and the client reconnects with Last-Event-ID;
+# it bounds how long a graceful shutdown waits on open streams
+FEED_STREAM_MAX_SECONDS = float(os.getenv("FEED_STREAM_MAX_SECONDS", "300"))
+FEED_RETRY_MS = 1000  # EventSource reconnect delay
+# First LISTEN reconnect delay; doubles up to FEED_RECONNECT_MAX_DELAY
+FEED_RECONNECT_DELAY = float(os.getenv("FEED_RECONNECT_DELAY", "1"))
+FEED_RECONNECT_MAX_DELAY = 30.0
+# Notifications waiting to be loaded; beyond this the feed tells clients to resync
+FEED_PENDING_MAX = 10000
+FEED_BATCH_SIZE = 100
+
+REVIEW_FEED_CHANNEL = "review_feed"
+
+logger = logging.getLogger(__name__)
+
+
+class FeedFull(Exception):
+    """Raised by FeedHub.subscribe when FEED_MAX_SUBSCRIBERS are connected."""
+
+
+class Viewport(NamedTuple):
+    min_lat: float
+    min_lng: float
+    max_lat: float
+    max_lng: float
+
+    def contains(self, latitude: Optional[float], longitude: Optional[float]) -> bool:
+        if latitude is None or longitude is None:
+            return False
+        if not self.min_lat <= latitude <= self.max_lat:
+            return False
+        if self.min_lng <= self.max_lng:
+            return self.min_lng <= longitude <= self.max_lng
+        # The box crosses the antimeridian
+        return longitude >= self.min_lng or longitude <= self.max_lng
+
+
+def parse_viewport(min_lat, min_lng, max_lat, max_lng) -> Optional[Viewport]:
+    """All four bounds or none; raises ValueError otherwise."""
+    bounds = (min_lat, min_lng, max_lat, max_lng)
+    if all(bound is None for bound in bounds):
+        return None
+    if any(bound is None for bound in bounds):
+        raise ValueError("min_lat, min_lng, max_lat and max_lng must be given together")
+    viewport = Viewport(*(float(bound) for bound in bounds))
+    if viewport.min_lat > viewport.max_lat:
+        raise ValueError("min_lat must not be greater than max_lat")
+    return viewport
+
+
+class Subscriber:
+    def __init__(self, viewport: Optional[Viewport]):
+        self.viewport = viewport
+        self.queue = asyncio.Queue(FEED_QUEUE_SIZE)
+        self.dropped = False
+
+    def wants(self, latitude: Optional[float], longitude: Optional[float]) -> bool:
+        return self.viewport is None or self.viewport.contains(latitude, longitude)
+
+    async def next_event(self, timeout: Optional[float] = None) -> Optional[tuple]:
+        """(event, id, data) or None when `timeout` passes without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class FeedHub:
+    """Fans events out to this worker's subscribers without ever blocking the publisher."""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def subscribe(self, viewport: Optional[Viewport] = None) -> Subscriber:
+        if len(self.subscribers) >= FEED_MAX_SUBSCRIBERS:
+            self.rejected += 1
+            raise FeedFull()
+        subscriber = Subscriber(viewport)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: str, payload: dict, event_id=None,
+                latitude: Optional[float] = None, longitude: Optional[float] = None) -> None:
+        """Queue `payload` for every subscriber whose viewport contains the location.
+
+        Events without a location go to everyone. The JSON is encoded once here,
+        not once per client.
+        """
+        self.published += 1
+        message = (event, event_id, dumps_str(payload))
+        located = latitude is not None and longitude is not None
+        for subscriber in list(self.subscribers):
+            if located and not subscriber.wants(latitude, longitude):
+                continue
+            try:
+                subscriber.queue.put_nowait(message)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+    def _drop(self, subscriber: Subscriber) -> None:
+        # A slow consumer loses its backlog and gets one overflow event in its place
+        self.dropped += 1
+        subscriber.dropped = True
+        self.subscribers.discard(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(("overflow", None, dumps_str({"reason": "client too slow"})))
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "max_subscribers": FEED_MAX_SUBSCRIBERS,
+            "queue_size": FEED_QUEUE_SIZE,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+
+class NotifyBridge:
+    """LISTENs on one channel and hands the payloads to `handler` in batches.
+
+    The connection is a dedicated one (not from the pool) because it stays open
+    for the life of the worker. It is re-established with backoff when it drops;
+    notifications sent meanwhile are lost, so `on_gap` is called once listening
+    resumes to let clients know they may have missed events.
+    """
+
+    def __init__(
+        self,
+        channel: str,
+        connect: Callable[[], Awaitable[asyncpg.Connection]],
+        handler: Callable[[list], Awaitable[None]],
+        on_gap: Callable[[], None],
+    ):
+        self.channel = channel
+        self._connect = connect
+        self._handler = handler
+        self._on_gap = on_gap
+        self._pending = asyncio.Queue(FEED_PENDING_MAX)
+        self._tasks = []
+        self.connected = False
+        self.reconnects = 0
+        self.received = 0
+        self.overflows = 0
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._dispatch())]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        self.received += 1
+        try:
+            self._pending.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.overflows += 1
+            self._on_gap()
+
+    async def _listen(self) -> None:
+        delay = FEED_RECONNECT_DELAY
+        listened_before = False
+        while True:
+            try:
+                connection = await self._connect()
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("LISTEN %s: connect failed, retrying in %.0fs: %s", self.channel, delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, FEED_RECONNECT_MAX_DELAY)
+                continue
+
+            lost = asyncio.Event()
+            connection.add_termination_listener(lambda _: lost.set())
+            try:
+                await connection.add_listener(self.channel, self._on_notify)
+                self.connected = True
+                delay = FEED_RECONNECT_DELAY
+                if listened_before:
+                    self.reconnects += 1
+                    logger.info("LISTEN %s: reconnected", self.channel)
+                    self._on_gap()
+                listened_before = True
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), FEED_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        # A silently dead socket only shows up when something is sent
+                        await connection.execute("SELECT 1")
+                logger.warning("LISTEN %s: connection closed", self.channel)
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                logger.warning("LISTEN %s: connection lost: %s", self.channel, e)
+            finally:
+                self.connected = False
+                connection.terminate()
+            await asyncio.sleep(delay)
+
+    async def _dispatch(self) -> None:
+        while True:
+            payloads = [await self._pending.get()]
+            while not self._pending.empty() and len(payloads) < FEED_BATCH_SIZE:
+                payloads.append(self._pending.get_nowait())
+            try:
+                await self._handler(payloads)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Feed handler failed for %d notifications", len(payloads))
+                self._on_gap()
+
+    def stats(self) -> dict:
+        return {
+            "channel": self.channel,
+            "connected": self.connected,
+            "reconnects": self.reconnects,
+            "received": self.received,
+            "pending": self._pending.qsize(),
+            "overflows": self.overflows,
+        }
+
+
+def sse_message(event: str, data: str, event_id=None) -> str:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {data}")
+    return "\n".join(lines) + "\n\n"
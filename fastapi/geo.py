@@ -0,0 +1,105 @@
+# geo.py
+import math
+
+# Base32 alphabet used by geohash (no a, i, l, o)
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Length of the geohash stored on places.geohash (~4.8m x 4.8m cells)
+GEOHASH_PRECISION = 9
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = 111320.0
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # geohash interleaves bits starting with longitude
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lng_lo = mid
+            else:
+                bits <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def cell_size_degrees(precision: int) -> tuple:
+    """Return (lat_degrees, lng_degrees) covered by one geohash cell."""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def precision_for_radius(radius_m: float, latitude: float) -> int:
+    """Longest geohash prefix whose cells are at least radius_m wide and tall.
+
+    With cells that large, the circle around any point is covered by the
+    cell containing the point plus its eight neighbours.
+    """
+    cos_lat = max(math.cos(math.radians(latitude)), 0.01)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_deg, lng_deg = cell_size_degrees(precision)
+        height_m = lat_deg * METERS_PER_DEGREE
+        width_m = lng_deg * METERS_PER_DEGREE * cos_lat
+        if height_m >= radius_m and width_m >= radius_m:
+            return precision
+    return 1
+
+
+def covering_cells(latitude: float, longitude: float, radius_m: float) -> list:
+    """Return the 3x3 block of geohash prefixes around a point (always 9 entries).
+
+    Duplicates are kept near the poles so callers can bind a fixed number of
+    parameters and reuse one prepared statement.
+    """
+    precision = precision_for_radius(radius_m, latitude)
+    lat_deg, lng_deg = cell_size_degrees(precision)
+    cells = []
+    for d_lat in (-1, 0, 1):
+        for d_lng in (-1, 0, 1):
+            lat = min(max(latitude + d_lat * lat_deg, -90.0), 90.0 - 1e-9)
+            lng = (longitude + d_lng * lng_deg + 180.0) % 360.0 - 180.0
+            cells.append(geohash_encode(lat, lng, precision))
+    return cells
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in meters."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = math.radians(lat2 - lat1)
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def precision_for_zoom(zoom: int, cells_per_tile: int = 4) -> int:
+    """Geohash precision giving roughly `cells_per_tile` buckets across one 256px map tile."""
+    target_lng_deg = 360.0 / (2 ** zoom) / cells_per_tile
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        _, lng_deg = cell_size_degrees(precision)
+        if lng_deg >= target_lng_deg:
+            return precision
+    return 1
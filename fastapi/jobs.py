@@ -0,0 +1,250 @@
+# jobs.py
+# Durable background jobs for work that should not hold up a request.
+#
+# Jobs are rows in the jobs table (migration 12), usually inserted by the same
+# statement as the write that needs them (see REVIEW_JOBS in database.py), so they
+# survive a restart and are never queued for a write that rolled back. Each uvicorn
+# worker runs JOB_WORKERS tasks that claim due jobs with FOR UPDATE SKIP LOCKED, so
+# any number of processes share the table without taking the same job twice.
+#
+# A job that raises is retried after an exponential backoff with jitter until
+# max_attempts, then kept with status 'failed' and its last error for inspection.
+# Finished jobs are deleted. A job whose worker died mid-run is requeued once its
+# lease (JOB_LEASE_SECONDS) runs out, which is also the longest a job may take.
+#
+# Idle workers poll every JOB_POLL_SECONDS; wake() starts them right away after a
+# request in this process queued something.
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from database import DERIVATIVES_JOB, database
+from metrics import Histogram, LATENCY_BUCKETS
+from thumbnails import render_derivatives
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# First retry delay in seconds; doubles per attempt up to JOB_RETRY_MAX_SECONDS
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = 3600.0
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+# On shutdown, running jobs get this long to finish before they are put back
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "10"))
+JOB_REAP_INTERVAL_SECONDS = 60.0
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS = {
+    DERIVATIVES_JOB: render_derivatives,
+}
+
+JOB_QUEUE_WAIT = Histogram(
+    "job_queue_wait_seconds", "Time from a job being due to a worker claiming it", ("kind",),
+    buckets=LATENCY_BUCKETS + (30.0, 60.0, 300.0),
+)
+JOB_DURATION = Histogram(
+    "job_duration_seconds", "Time a job's handler ran, by outcome", ("kind", "outcome"),
+    buckets=LATENCY_BUCKETS + (30.0, 60.0, 300.0),
+)
+
+ENQUEUE_JOB = """
+INSERT INTO jobs (kind, payload, max_attempts, run_at)
+VALUES (:kind, CAST(:payload AS jsonb), :max_attempts, NOW() + make_interval(secs => :delay))
+RETURNING job_id
+"""
+
+CLAIM_JOB = """
+UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_at = NOW()
+WHERE job_id = (
+    SELECT job_id FROM jobs
+    WHERE status = 'queued' AND run_at <= NOW()
+    ORDER BY run_at, job_id
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING job_id, kind, payload, attempts, max_attempts,
+          EXTRACT(EPOCH FROM NOW() - run_at)::float8 AS waited
+"""
+
+COMPLETE_JOB = "DELETE FROM jobs WHERE job_id = :job_id"
+
+# Out of attempts means failed for good; otherwise due again after `delay`
+FAIL_JOB = """
+UPDATE jobs SET
+    status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+    run_at = NOW() + make_interval(secs => :delay),
+    locked_at = NULL,
+    last_error = :error
+WHERE job_id = :job_id
+RETURNING status
+"""
+
+# Interrupted by shutdown: due again at once, and the attempt does not count
+RELEASE_JOB = """
+UPDATE jobs SET status = 'queued', attempts = attempts - 1, locked_at = NULL, run_at = NOW()
+WHERE job_id = :job_id
+"""
+
+REQUEUE_EXPIRED_JOBS = """
+WITH expired AS (
+    UPDATE jobs SET
+        status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+        run_at = NOW(),
+        locked_at = NULL,
+        last_error = 'lease expired'
+    WHERE status = 'running' AND locked_at < NOW() - make_interval(secs => :lease)
+    RETURNING 1
+)
+SELECT COUNT(*) FROM expired
+"""
+
+JOB_DEPTH = """
+SELECT kind, status, COUNT(*) AS jobs, GREATEST(EXTRACT(EPOCH FROM NOW() - MIN(run_at)), 0)::float8 AS oldest
+FROM jobs
+GROUP BY kind, status
+"""
+
+
+def retry_delay(attempts: int) -> float:
+    delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS)
+    # Jitter spreads out retries of jobs that failed together, e.g. during an outage
+    return delay * random.uniform(0.5, 1.0)
+
+
+class JobQueue:
+    def __init__(self, handlers: dict, workers: int = JOB_WORKERS):
+        self.handlers = handlers
+        self.workers = workers
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks = []
+        self._reaper = None
+        self.running = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.requeued = 0
+
+    async def enqueue(self, kind: str, payload: dict, delay: float = 0,
+                      max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+        """Queue a job on its own. Prefer inserting it in the writing statement, as REVIEW_JOBS does."""
+        if kind not in self.handlers:
+            raise ValueError(f"No handler for job kind {kind!r}")
+        job_id = await database.fetch_val(ENQUEUE_JOB, {
+            "kind": kind, "payload": json.dumps(payload), "max_attempts": max_attempts, "delay": delay,
+        })
+        self.wake()
+        return job_id
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def start(self) -> None:
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._reaper = asyncio.create_task(self._reap_periodically())
+
+    async def stop(self) -> None:
+        """Stop claiming jobs and let running ones finish; the rest wait in the table."""
+        self._stopping = True
+        self.wake()
+        if self._reaper is not None:
+            self._reaper.cancel()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=JOB_DRAIN_SECONDS)
+            if pending:
+                logger.warning("%d jobs did not finish within %.0fs and are put back", len(pending), JOB_DRAIN_SECONDS)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._reaper is not None:
+            await asyncio.gather(self._reaper, return_exceptions=True)
+        self._tasks = []
+        self._reaper = None
+
+    async def _work(self) -> None:
+        while not self._stopping:
+            try:
+                job = await database.fetch_one(CLAIM_JOB)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Could not claim a job")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job) -> None:
+        job_id, kind = job["job_id"], job["kind"]
+        JOB_QUEUE_WAIT.observe(max(job["waited"], 0.0), kind)
+        handler = self.handlers.get(kind)
+        self.running += 1
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job kind {kind!r}")
+            await asyncio.wait_for(handler(json.loads(job["payload"])), JOB_LEASE_SECONDS)
+        except asyncio.CancelledError:
+            # Shutdown gave up waiting; put the job back for the next worker to start
+            JOB_DURATION.observe(time.perf_counter() - started, kind, "interrupted")
+            await asyncio.shield(database.execute(RELEASE_JOB, {"job_id": job_id}))
+            raise
+        except Exception as e:
+            JOB_DURATION.observe(time.perf_counter() - started, kind, "error")
+            status = await database.fetch_val(FAIL_JOB, {
+                "job_id": job_id, "delay": retry_delay(job["attempts"]), "error": f"{type(e).__name__}: {e}",
+            })
+            if status == "failed":
+                self.failed += 1
+                logger.error("Job %d (%s) failed after %d attempts: %s", job_id, kind, job["attempts"], e)
+            else:
+                self.retried += 1
+                logger.warning("Job %d (%s) attempt %d failed, will retry: %s", job_id, kind, job["attempts"], e)
+        else:
+            JOB_DURATION.observe(time.perf_counter() - started, kind, "ok")
+            await database.execute(COMPLETE_JOB, {"job_id": job_id})
+            self.completed += 1
+        finally:
+            self.running -= 1
+
+    async def _reap_periodically(self) -> None:
+        while True:
+            try:
+                requeued = await database.fetch_val(REQUEUE_EXPIRED_JOBS, {"lease": JOB_LEASE_SECONDS})
+                if requeued:
+                    self.requeued += requeued
+                    logger.warning("Requeued %d jobs whose lease expired", requeued)
+                    self.wake()
+            except Exception:
+                logger.exception("Requeueing expired jobs failed")
+            await asyncio.sleep(JOB_REAP_INTERVAL_SECONDS)
+
+    async def depth(self) -> list:
+        """Jobs in the table by kind and status; oldest_seconds is how overdue the first one is."""
+        rows = await database.fetch_all(JOB_DEPTH)
+        return [
+            {"kind": row["kind"], "status": row["status"], "jobs": row["jobs"], "oldest_seconds": row["oldest"]}
+            for row in rows
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "running": self.running,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "requeued": self.requeued,
+        }
+
+
+job_queue = JobQueue(JOB_HANDLERS)
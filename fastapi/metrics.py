@@ -0,0 +1,262 @@
+# metrics.py
+# In-process metrics served in the Prometheus text format at /metrics.
+#
+# MetricsMiddleware records per-route latency histograms, status counts and
+# in-flight requests, and keeps requests slower than SLOW_REQUEST_MS
+# (profiling.py). InstrumentedDatabase times every query issued through the
+# shared `database` object and counts the rows it returns. Queries are named after
+# the function that issued them (e.g. database.get_user), so their cardinality is
+# bounded by the code, not by the traffic.
+#
+# Each uvicorn worker keeps its own numbers; Prometheus sums them across targets.
+import inspect
+import logging
+import sys
+import time
+from bisect import bisect_left
+from typing import Iterable, Optional
+from db_pool import PooledDatabase
+from profiling import record_query, slow_requests
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        REGISTRY.append(self)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels) -> None:
+        # For mirroring a total that another component already keeps
+        self._values[labels] = value
+
+    def render(self) -> list:
+        lines = self.header()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            # Per-bucket counts (last one is +Inf), sum, count
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list:
+        lines = self.header()
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+REGISTRY = []
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time from request start to the last response byte",
+    ("method", "route"),
+)
+HTTP_RESPONSES = Counter("http_responses_total", "Responses by status code", ("method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled")
+
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Query time including the wait for a pooled connection",
+    ("query", "operation"), buckets=QUERY_BUCKETS,
+)
+DB_QUERY_ROWS = Histogram(
+    "db_query_rows", "Rows returned per query (fetch and iterate only)", ("query",), buckets=ROW_BUCKETS,
+)
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "Queries that raised", ("query", "operation"))
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def route_label(scope: dict) -> str:
+    # The matched route's template keeps label cardinality bounded
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    # Some FastAPI versions route plain starlette routes (e.g. /openapi.json)
+    # and mounts without setting scope["route"]; the endpoint is still recorded
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if not inspect.isfunction(endpoint):
+        # A mounted ASGI app such as StaticFiles; root_path is the mount point
+        return scope.get("root_path", "") + "/{path}"
+    if not scope.get("path_params"):
+        return scope["path"]  # a fixed path, so bounded like a template
+    return endpoint.__qualname__
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streaming responses are timed to their last byte."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        first_byte = None
+        streamed = False
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code, first_byte, streamed
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                first_byte = time.perf_counter() - started
+                streamed = any(name == b"content-type" and value.startswith(b"text/event-stream")
+                               for name, value in message.get("headers", ()))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        timings_token = slow_requests.begin()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - started
+            route = route_label(scope)
+            method = scope["method"]
+            HTTP_REQUEST_DURATION.observe(elapsed, method, route)
+            HTTP_RESPONSES.inc(method, route, status_code)
+            if timings_token is not None:
+                slow_requests.finish(timings_token, scope, route, status_code, elapsed, first_byte, streamed)
+
+
+# Modules that only pass queries through (the replica router)
+PASSTHROUGH_MODULES = ("db_router",)
+
+
+def _caller_name(depth: int = 2) -> str:
+    # Skip private helpers such as database._cached_fetch_one, and pass-through
+    # modules, so the public function that owns the query gets the timing. Stop at
+    # the top of a background task (e.g. jobs.JobQueue._work) rather than walk into asyncio.
+    frame = sys._getframe(depth)
+    while frame.f_back is not None and (
+        frame.f_code.co_name.startswith("_") or frame.f_globals.get("__name__") in PASSTHROUGH_MODULES
+    ) and not frame.f_back.f_globals.get("__name__", "").startswith("asyncio"):
+        frame = frame.f_back
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+
+class InstrumentedDatabase(PooledDatabase):
+    """PooledDatabase that records db_query_* metrics for every call."""
+
+    async def _timed(self, operation: str, name: str, call, count_rows=None):
+        started = time.perf_counter()
+        try:
+            result = await call
+        except BaseException:
+            DB_QUERY_ERRORS.inc(name, operation)
+            record_query(name, time.perf_counter() - started)
+            raise
+        elapsed = time.perf_counter() - started
+        DB_QUERY_DURATION.observe(elapsed, name, operation)
+        record_query(name, elapsed)
+        if count_rows is not None:
+            DB_QUERY_ROWS.observe(count_rows(result), name)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("query %s %s took %.2fms", operation, name, elapsed * 1000)
+        return result
+
+    async def fetch_all(self, query, values: Optional[dict] = None):
+        return await self._timed("fetch_all", _caller_name(), super().fetch_all(query, values), len)
+
+    async def fetch_one(self, query, values: Optional[dict] = None):
+        return await self._timed(
+            "fetch_one", _caller_name(), super().fetch_one(query, values), lambda row: 0 if row is None else 1
+        )
+
+    async def fetch_val(self, query, values: Optional[dict] = None, column=0):
+        return await self._timed("fetch_val", _caller_name(), super().fetch_val(query, values, column))
+
+    async def execute(self, query, values: Optional[dict] = None):
+        return await self._timed("execute", _caller_name(), super().execute(query, values))
+
+    async def execute_many(self, query, values: list):
+        return await self._timed("execute_many", _caller_name(), super().execute_many(query, values))
+
+    async def iterate(self, query, values: Optional[dict] = None):
+        name = _caller_name()
+        started = time.perf_counter()
+        rows = 0
+        try:
+            async for row in super().iterate(query, values):
+                rows += 1
+                yield row
+        except GeneratorExit:
+            # Consumer stopped early, e.g. a client closed the stream
+            raise
+        except BaseException:
+            DB_QUERY_ERRORS.inc(name, "iterate")
+            raise
+        # Includes the time the consumer spent between rows
+        DB_QUERY_DURATION.observe(time.perf_counter() - started, name, "iterate")
+        record_query(name, time.perf_counter() - started)
+        DB_QUERY_ROWS.observe(rows, name)
@@ -0,0 +1,529 @@
+# migrations.py
+# Versioned schema migrations.
+#   python migrations.py           apply pending migrations
+#   python migrations.py status    show applied and pending versions
+#
+# Applied versions are recorded in schema_version. Startup costs one query when
+# the schema is current; otherwise the runner takes a Postgres advisory lock so
+# only one worker migrates while the others wait and then re-check.
+#
+# Rules for new migrations: append, never edit or renumber an applied one.
+# Migrations with transactional=False run statement by statement outside a
+# transaction, which CREATE INDEX CONCURRENTLY requires; keep those idempotent.
+import asyncio
+import logging
+import sys
+from typing import Awaitable, Callable, NamedTuple, Optional
+from database import database
+from geo import geohash_encode
+from logging_config import configure_logging
+from place_stats import PLACE_STATS_AGGREGATE, REBUILD_QUERY as PLACE_STATS_REBUILD
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key shared by every process migrating this database
+MIGRATION_LOCK_KEY = 727_001
+MIGRATION_LOCK_POLL_SECONDS = 0.5
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: tuple = ()
+    # Runs after the statements, on the same connection
+    run: Optional[Callable[[], Awaitable[None]]] = None
+    transactional: bool = True
+
+
+def create_index_concurrently(name: str, definition: str) -> tuple:
+    # A failed CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS would
+    # then skip, so drop such a leftover before retrying
+    return (
+        f"""
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = '{name}' AND NOT i.indisvalid
+            ) THEN
+                EXECUTE 'DROP INDEX {name}';
+            END IF;
+        END $$;
+        """,
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}",
+    )
+
+
+async def backfill_place_geohashes():
+    # Places created before the geohash column existed; computed here since Postgres has no geohash function without PostGIS
+    rows = await database.fetch_all("SELECT place_id, latitude, longitude FROM places WHERE geohash IS NULL")
+    if rows:
+        await database.execute_many(
+            "UPDATE places SET geohash = :geohash WHERE place_id = :place_id",
+            values=[
+                {"place_id": row["place_id"], "geohash": geohash_encode(float(row["latitude"]), float(row["longitude"]))}
+                for row in rows
+            ],
+        )
+        logger.info("Backfilled geohash for %d places", len(rows))
+
+
+# Older databases may hold several places at the same coordinates; those must be
+# merged before the unique constraint can be added.
+MERGE_DUPLICATE_PLACES = """
+WITH dups AS (
+    SELECT place_id, keep_id FROM (
+        SELECT place_id, MIN(place_id) OVER (PARTITION BY latitude, longitude) AS keep_id
+        FROM places
+    ) ranked
+    WHERE place_id <> keep_id
+), moved_reviews AS (
+    UPDATE reviews r SET place_id = d.keep_id FROM dups d WHERE r.place_id = d.place_id
+), moved_photos AS (
+    UPDATE photos ph SET place_id = d.keep_id FROM dups d WHERE ph.place_id = d.place_id
+)
+DELETE FROM places p USING dups d WHERE p.place_id = d.place_id
+"""
+
+ADD_PLACES_UNIQUE_LOCATION = """
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'places_latitude_longitude_key') THEN
+        ALTER TABLE places ADD CONSTRAINT places_latitude_longitude_key UNIQUE (latitude, longitude);
+    END IF;
+END $$;
+"""
+
+
+async def ensure_unique_place_locations():
+    has_duplicates = await database.fetch_one(
+        "SELECT 1 FROM places GROUP BY latitude, longitude HAVING COUNT(*) > 1 LIMIT 1"
+    )
+    if has_duplicates:
+        await database.execute(MERGE_DUPLICATE_PLACES)
+        # Stats of merged places were dropped with them; recompute from reviews
+        await database.execute(PLACE_STATS_REBUILD)
+        logger.info("Merged duplicate places")
+    await database.execute(ADD_PLACES_UNIQUE_LOCATION)
+
+
+# Search document of a review: its title and place name rank highest, then the
+# comment, then the address. 'simple' stems nothing, which suits mixed-language text.
+# The trigger functions are VOLATILE so they see a place inserted earlier in the
+# same statement (add_review_at_location and bulk import do both in one query).
+REVIEW_SEARCH_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION review_search_vector(title TEXT, comment TEXT, place_name TEXT, address TEXT)
+RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('simple', COALESCE(title, '')), 'A')
+        || setweight(to_tsvector('simple', COALESCE(place_name, '')), 'A')
+        || setweight(to_tsvector('simple', COALESCE(comment, '')), 'B')
+        || setweight(to_tsvector('simple', COALESCE(address, '')), 'C')
+$$ LANGUAGE sql IMMUTABLE
+"""
+
+REVIEWS_SEARCH_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION reviews_search_vector_refresh() RETURNS trigger AS $$
+DECLARE
+    place RECORD;
+BEGIN
+    SELECT name, address INTO place FROM places WHERE place_id = NEW.place_id;
+    NEW.search_vector := review_search_vector(NEW.title, NEW.comment, place.name, place.address);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+PLACES_SEARCH_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION places_search_vector_refresh() RETURNS trigger AS $$
+BEGIN
+    UPDATE reviews
+    SET search_vector = review_search_vector(title, comment, NEW.name, NEW.address)
+    WHERE place_id = NEW.place_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+REVIEW_SEARCH_BACKFILL_BATCH = 20000
+
+
+async def backfill_review_search_vectors():
+    # In id ranges, each its own transaction, so a large table is not locked in one go
+    bounds = await database.fetch_one("SELECT MIN(review_id) AS low, MAX(review_id) AS high FROM reviews")
+    if bounds["low"] is None:
+        return
+    updated = 0
+    for start in range(bounds["low"], bounds["high"] + 1, REVIEW_SEARCH_BACKFILL_BATCH):
+        result = await database.fetch_one("""
+        WITH changed AS (
+            UPDATE reviews r
+            SET search_vector = review_search_vector(r.title, r.comment, p.name, p.address)
+            FROM places p
+            WHERE p.place_id = r.place_id
+              AND r.review_id >= :start AND r.review_id < :end
+              AND r.search_vector IS NULL
+            RETURNING 1
+        )
+        SELECT COUNT(*) AS n FROM changed
+        """, values={"start": start, "end": start + REVIEW_SEARCH_BACKFILL_BATCH})
+        updated += result["n"]
+    logger.info("Backfilled search vectors for %d reviews", updated)
+
+
+# Change tracking for sync.py. change_xid is the id of the transaction that last
+# changed a row in a way clients can see; the update triggers only fire on those
+# columns, so e.g. a search_vector refresh leaves it alone. Both columns stay
+# NULL on rows older than this migration, which no sync token can point before
+# anyway.
+TRACK_ROW_CHANGE_FUNCTION = """
+CREATE OR REPLACE FUNCTION track_row_change() RETURNS trigger AS $$
+BEGIN
+    NEW.change_xid := pg_current_xact_id();
+    NEW.updated_at := CURRENT_TIMESTAMP;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# Statement-level, so deleting a user with thousands of reviews (ON DELETE CASCADE)
+# writes their tombstones in one INSERT
+RECORD_DELETIONS_FUNCTIONS = tuple(
+    f"""
+    CREATE OR REPLACE FUNCTION record_{entity}_deletions() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO tombstones (entity, entity_id) SELECT '{entity}', {key} FROM deleted_rows;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """
+    for entity, key in (("review", "review_id"), ("place", "place_id"))
+)
+
+
+def change_tracking_triggers(table: str, columns: tuple, on_insert: bool = True) -> tuple:
+    old = ", ".join(f"OLD.{column}" for column in columns)
+    new = ", ".join(f"NEW.{column}" for column in columns)
+    statements = [
+        f"DROP TRIGGER IF EXISTS {table}_track_update ON {table}",
+        f"""
+        CREATE TRIGGER {table}_track_update
+        BEFORE UPDATE OF {", ".join(columns)} ON {table}
+        FOR EACH ROW
+        WHEN (ROW({old}) IS DISTINCT FROM ROW({new}))
+        EXECUTE FUNCTION track_row_change()
+        """,
+    ]
+    if on_insert:
+        statements += [
+            f"DROP TRIGGER IF EXISTS {table}_track_insert ON {table}",
+            f"""
+            CREATE TRIGGER {table}_track_insert
+            BEFORE INSERT ON {table}
+            FOR EACH ROW EXECUTE FUNCTION track_row_change()
+            """,
+        ]
+    return tuple(statements)
+
+
+def tombstone_trigger(table: str, entity: str) -> tuple:
+    return (
+        f"DROP TRIGGER IF EXISTS {table}_tombstones ON {table}",
+        f"""
+        CREATE TRIGGER {table}_tombstones
+        AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS deleted_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION record_{entity}_deletions()
+        """,
+    )
+
+
+# Versions 1-5 replay what init_db used to run on every boot. They are written to
+# be no-ops on databases that init_db already set up, so those get stamped in place.
+MIGRATIONS = [
+    Migration(1, "baseline", (
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id SERIAL PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            email VARCHAR(100) UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            category_id SERIAL PRIMARY KEY,
+            category_name VARCHAR(50) UNIQUE NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS places (
+            place_id SERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            description TEXT,
+            latitude DECIMAL(9,6) NOT NULL,
+            longitude DECIMAL(9,6) NOT NULL,
+            category_id INT REFERENCES categories(category_id) ON DELETE SET NULL,
+            address TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS reviews (
+            review_id SERIAL PRIMARY KEY,
+            user_id INT REFERENCES users(user_id) ON DELETE CASCADE,
+            place_id INT REFERENCES places(place_id) ON DELETE CASCADE,
+            rating INT CHECK (rating >= 1 AND rating <= 5),
+            title VARCHAR(200),
+            comment TEXT,
+            image_path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS photos (
+            photo_id SERIAL PRIMARY KEY,
+            place_id INT REFERENCES places(place_id) ON DELETE CASCADE,
+            photo_url TEXT NOT NULL,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        INSERT INTO categories (category_name)
+        SELECT name FROM (VALUES
+            ('Restaurant'), ('Cafe'), ('Park'), ('Museum'), ('Shop'),
+            ('Hotel'), ('Bar'), ('Landmark'), ('Beach'), ('Mall')
+        ) AS v(name)
+        WHERE NOT EXISTS (SELECT 1 FROM categories);
+        """,
+    )),
+    Migration(2, "places_geohash", (
+        'ALTER TABLE places ADD COLUMN IF NOT EXISTS geohash VARCHAR(12) COLLATE "C"',
+        "CREATE INDEX IF NOT EXISTS idx_places_geohash ON places (geohash)",
+    ), run=backfill_place_geohashes),
+    Migration(3, "place_stats", (
+        """
+        CREATE TABLE IF NOT EXISTS place_stats (
+            place_id INT PRIMARY KEY REFERENCES places(place_id) ON DELETE CASCADE,
+            review_count INT NOT NULL DEFAULT 0,
+            rating_sum INT NOT NULL DEFAULT 0,
+            rating_1 INT NOT NULL DEFAULT 0,
+            rating_2 INT NOT NULL DEFAULT 0,
+            rating_3 INT NOT NULL DEFAULT 0,
+            rating_4 INT NOT NULL DEFAULT 0,
+            rating_5 INT NOT NULL DEFAULT 0,
+            last_review_at TIMESTAMP
+        );
+        """,
+        # Backfill only when the table is new; existing rows are maintained by the writes
+        """
+        INSERT INTO place_stats (place_id, review_count, rating_sum,
+                                 rating_1, rating_2, rating_3, rating_4, rating_5, last_review_at)
+        SELECT * FROM (""" + PLACE_STATS_AGGREGATE + """) fresh
+        WHERE NOT EXISTS (SELECT 1 FROM place_stats);
+        """,
+    )),
+    Migration(4, "photo_content_hash", (
+        "ALTER TABLE photos ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+        "ALTER TABLE photos ADD COLUMN IF NOT EXISTS ref_count INT NOT NULL DEFAULT 0",
+        "ALTER TABLE reviews ADD COLUMN IF NOT EXISTS image_hash VARCHAR(64)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_photos_content_hash ON photos (content_hash)",
+    )),
+    # Its index also serves lookups and range scans on places(latitude, longitude)
+    Migration(5, "places_unique_location", run=ensure_unique_place_locations),
+    Migration(6, "review_indexes", (
+        # Keyset pagination of the global feed
+        *create_index_concurrently("idx_reviews_created_at_review_id", "reviews (created_at DESC, review_id DESC)"),
+        # Joins from places to their reviews, and place_stats rebuilds
+        *create_index_concurrently("idx_reviews_place_id", "reviews (place_id)"),
+        # delete_user and per-user lookups; also the ON DELETE CASCADE from users
+        *create_index_concurrently("idx_reviews_user_id", "reviews (user_id)"),
+        # ON DELETE CASCADE from places
+        *create_index_concurrently("idx_photos_place_id", "photos (place_id)"),
+    ), transactional=False),
+    Migration(7, "review_search_vector", (
+        "ALTER TABLE reviews ADD COLUMN IF NOT EXISTS search_vector tsvector",
+        REVIEW_SEARCH_FUNCTIONS,
+        REVIEWS_SEARCH_TRIGGER_FUNCTION,
+        PLACES_SEARCH_TRIGGER_FUNCTION,
+        # Postgres 13 has no CREATE OR REPLACE TRIGGER
+        "DROP TRIGGER IF EXISTS reviews_search_vector_refresh ON reviews",
+        """
+        CREATE TRIGGER reviews_search_vector_refresh
+        BEFORE INSERT OR UPDATE OF title, comment, place_id ON reviews
+        FOR EACH ROW EXECUTE FUNCTION reviews_search_vector_refresh()
+        """,
+        "DROP TRIGGER IF EXISTS places_search_vector_refresh ON places",
+        """
+        CREATE TRIGGER places_search_vector_refresh
+        AFTER UPDATE OF name, address ON places
+        FOR EACH ROW
+        WHEN (OLD.name IS DISTINCT FROM NEW.name OR OLD.address IS DISTINCT FROM NEW.address)
+        EXECUTE FUNCTION places_search_vector_refresh()
+        """,
+    )),
+    # Rows written from here on get their vector from the trigger
+    Migration(8, "review_search_backfill", run=backfill_review_search_vectors, transactional=False),
+    Migration(9, "review_search_index", (
+        *create_index_concurrently("idx_reviews_search_vector", "reviews USING GIN (search_vector)"),
+    ), transactional=False),
+    Migration(10, "change_tracking", (
+        *(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP, "
+            "ADD COLUMN IF NOT EXISTS change_xid xid8"
+            for table in ("reviews", "places", "users")
+        ),
+        """
+        CREATE TABLE IF NOT EXISTS tombstones (
+            entity VARCHAR(20) NOT NULL,
+            entity_id INT NOT NULL,
+            change_xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+            deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_tombstones_entity_change ON tombstones (entity, change_xid, entity_id)",
+        "CREATE INDEX IF NOT EXISTS idx_tombstones_deleted_at ON tombstones (deleted_at)",
+        TRACK_ROW_CHANGE_FUNCTION,
+        *RECORD_DELETIONS_FUNCTIONS,
+        *change_tracking_triggers(
+            "reviews", ("user_id", "place_id", "rating", "title", "comment", "image_path", "image_hash"),
+        ),
+        *change_tracking_triggers("places", ("name", "category_id", "address", "latitude", "longitude")),
+        # Only renames matter to clients, who see usernames on reviews
+        *change_tracking_triggers("users", ("username",), on_insert=False),
+        *tombstone_trigger("reviews", "review"),
+        *tombstone_trigger("places", "place"),
+    )),
+    Migration(11, "change_tracking_indexes", (
+        *create_index_concurrently("idx_reviews_change_xid", "reviews (change_xid, review_id)"),
+        *create_index_concurrently("idx_places_change_xid", "places (change_xid, place_id)"),
+        *create_index_concurrently("idx_users_change_xid", "users (change_xid, user_id)"),
+    ), transactional=False),
+    Migration(12, "jobs", (
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id BIGSERIAL PRIMARY KEY,
+            kind VARCHAR(50) NOT NULL,
+            payload JSONB NOT NULL DEFAULT '{}',
+            status VARCHAR(10) NOT NULL DEFAULT 'queued'
+                CHECK (status IN ('queued', 'running', 'failed')),
+            attempts INT NOT NULL DEFAULT 0,
+            max_attempts INT NOT NULL DEFAULT 5,
+            run_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_at TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Workers claim from the head of this one; finished jobs are deleted, so it stays small
+        "CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (run_at, job_id) WHERE status = 'queued'",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs (locked_at) WHERE status = 'running'",
+    )),
+    # Shared token buckets for ADMISSION_BACKEND=postgres (admission.py). UNLOGGED:
+    # losing them in a crash only resets everyone's limits.
+    Migration(13, "rate_limit_buckets", (
+        """
+        CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+            key TEXT PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL
+        )
+        """,
+    )),
+    # Admin-only endpoints check this flag; set it with admins.py
+    Migration(14, "users_is_admin", (
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_admin BOOLEAN NOT NULL DEFAULT FALSE",
+    )),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+CREATE_SCHEMA_VERSION = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INT PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+async def current_version() -> int:
+    # Checked separately: a query naming a missing table fails when planned
+    exists = await database.fetch_one("SELECT to_regclass('schema_version') IS NOT NULL AS exists")
+    if not exists["exists"]:
+        return 0
+    row = await database.fetch_one("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version")
+    return row["version"]
+
+
+async def acquire_migration_lock() -> None:
+    # Poll with pg_try_advisory_lock instead of blocking in pg_advisory_lock: a
+    # session stuck in a query holds a snapshot, and CREATE INDEX CONCURRENTLY on
+    # the lock holder would wait for it forever
+    while True:
+        row = await database.fetch_one("SELECT pg_try_advisory_lock(:key) AS locked", values={"key": MIGRATION_LOCK_KEY})
+        if row["locked"]:
+            return
+        await asyncio.sleep(MIGRATION_LOCK_POLL_SECONDS)
+
+
+async def apply_migration(migration: Migration) -> None:
+    record = "INSERT INTO schema_version (version, name) VALUES (:version, :name)"
+    values = {"version": migration.version, "name": migration.name}
+    if migration.transactional:
+        async with database.transaction():
+            for sql in migration.statements:
+                await database.execute(sql)
+            if migration.run is not None:
+                await migration.run()
+            await database.execute(record, values=values)
+    else:
+        for sql in migration.statements:
+            await database.execute(sql)
+        if migration.run is not None:
+            await migration.run()
+        await database.execute(record, values=values)
+    logger.info("Applied migration %d (%s)", migration.version, migration.name)
+
+
+async def migrate() -> int:
+    """Apply pending migrations and return the number applied. Expects a connected database."""
+    if await current_version() >= LATEST_VERSION:
+        return 0
+
+    # Hold one connection throughout: the advisory lock belongs to the session
+    async with database.connection():
+        await acquire_migration_lock()
+        try:
+            await database.execute(CREATE_SCHEMA_VERSION)
+            # Another worker may have finished while we waited for the lock
+            version = await current_version()
+            pending = [m for m in MIGRATIONS if m.version > version]
+            for migration in pending:
+                await apply_migration(migration)
+            return len(pending)
+        finally:
+            await database.execute("SELECT pg_advisory_unlock(:key)", values={"key": MIGRATION_LOCK_KEY})
+
+
+async def main(command: Optional[str]) -> None:
+    await database.connect()
+    try:
+        if command == "status":
+            version = await current_version()
+            for migration in MIGRATIONS:
+                state = "applied" if migration.version <= version else "pending"
+                print(f"{migration.version:4d} {migration.name:<28} {state}")
+            return
+        applied = await migrate()
+        print(f"✅ Schema at version {LATEST_VERSION} ({applied} migrations applied)")
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] not in ([], ["status"]):
+        print("usage: python migrations.py [status]")
+        sys.exit(2)
+    configure_logging()
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else None))
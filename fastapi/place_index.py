@@ -0,0 +1,246 @@
+# place_index.py
+# In-process spatial index over places and their ratings, for /api/places/nearby.
+#
+# Places live in a fixed grid of PLACE_INDEX_CELL_DEGREES cells. A k-nearest query
+# visits rings of cells outward from the query point and stops once the next ring
+# cannot hold anything closer than the k-th place found so far; a top-rated query
+# visits every ring within the radius and scores each place by its rating, pulled
+# towards RATING_PRIOR_MEAN while it has few reviews, halved every half_distance_m.
+# Neither touches Postgres, so typical city queries take well under a millisecond.
+#
+# Each worker loads the whole index at startup and reloads it every
+# PLACE_INDEX_RECONCILE_SECONDS (or sooner after request_reload()) to pick up
+# anything the incremental updates missed, e.g. deletions. Updates carry absolute
+# values (a place's current review count and average), so applying one twice, or
+# replaying those that arrived while a reload was reading, is harmless.
+import asyncio
+import heapq
+import logging
+import math
+import os
+import time
+from typing import Awaitable, Callable, Iterable, NamedTuple, Optional
+from geo import EARTH_RADIUS_M, METERS_PER_DEGREE
+
+# ~1.1km of latitude; a 1km search around a point visits about 9-25 cells
+PLACE_INDEX_CELL_DEGREES = float(os.getenv("PLACE_INDEX_CELL_DEGREES", "0.01"))
+PLACE_INDEX_RECONCILE_SECONDS = float(os.getenv("PLACE_INDEX_RECONCILE_SECONDS", "300"))
+# A place's rating counts as this many reviews of RATING_PRIOR_MEAN stars on top of its own
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_WEIGHT = 5
+
+logger = logging.getLogger(__name__)
+
+
+class IndexedPlace(NamedTuple):
+    place_id: int
+    name: str
+    latitude: float
+    longitude: float
+    review_count: int
+    avg_rating: Optional[float]
+
+    @classmethod
+    def from_row(cls, row) -> "IndexedPlace":
+        return cls(
+            row["place_id"], row["name"], float(row["latitude"]), float(row["longitude"]),
+            row["review_count"] or 0, row["avg_rating"],
+        )
+
+    def weighted_rating(self) -> float:
+        rated = self.avg_rating * self.review_count if self.avg_rating is not None else 0.0
+        count = self.review_count if self.avg_rating is not None else 0
+        return (rated + RATING_PRIOR_MEAN * RATING_PRIOR_WEIGHT) / (count + RATING_PRIOR_WEIGHT)
+
+
+class PlaceIndex:
+    def __init__(self, load: Callable[[], Awaitable[Iterable]], cell_degrees: float = PLACE_INDEX_CELL_DEGREES):
+        self._load = load
+        self.cell_degrees = cell_degrees
+        self.rows = math.ceil(180.0 / cell_degrees)
+        self.columns = math.ceil(360.0 / cell_degrees)
+        self._places = {}  # place_id -> IndexedPlace
+        self._cells = {}  # (row, column) -> {place_id: (latitude rad, longitude rad, cos latitude, place)}
+        self._pending = None  # updates that arrive while a reload is reading
+        self._reload_requested = asyncio.Event()
+        self._task = None
+        self.loaded_at: Optional[float] = None
+        self.reloads = 0
+        self.updates = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def _cell(self, latitude: float, longitude: float) -> tuple:
+        row = min(int((latitude + 90.0) / self.cell_degrees), self.rows - 1)
+        column = int((longitude + 180.0) / self.cell_degrees) % self.columns
+        return row, column
+
+    @staticmethod
+    def _put(places: dict, cells: dict, cell_of, place: IndexedPlace) -> None:
+        previous = places.get(place.place_id)
+        if previous is not None:
+            old_cell = cell_of(previous.latitude, previous.longitude)
+            del cells[old_cell][place.place_id]
+            if not cells[old_cell]:
+                del cells[old_cell]
+        places[place.place_id] = place
+        # Cells keep what the distance check needs precomputed; see _within
+        phi = math.radians(place.latitude)
+        entry = (phi, math.radians(place.longitude), math.cos(phi), place)
+        cells.setdefault(cell_of(place.latitude, place.longitude), {})[place.place_id] = entry
+
+    def upsert(self, place: IndexedPlace) -> None:
+        self.updates += 1
+        self._put(self._places, self._cells, self._cell, place)
+        if self._pending is not None:
+            self._pending.append(place)
+
+    def upsert_rows(self, rows: Iterable) -> None:
+        for row in rows:
+            self.upsert(IndexedPlace.from_row(row))
+
+    async def reload(self) -> None:
+        """Rebuild from the database and swap the new index in."""
+        self._pending = []
+        try:
+            rows = await self._load()
+            started = time.perf_counter()
+            places, cells = {}, {}
+            for row in rows:
+                self._put(places, cells, self._cell, IndexedPlace.from_row(row))
+            for place in self._pending:
+                self._put(places, cells, self._cell, place)
+        finally:
+            self._pending = None
+        self._places, self._cells = places, cells
+        self.loaded_at = time.time()
+        self.reloads += 1
+        logger.info("Place index loaded %d places in %.0fms", len(places), (time.perf_counter() - started) * 1000)
+
+    def request_reload(self) -> None:
+        self._reload_requested.set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._reconcile_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _reconcile_periodically(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._reload_requested.wait(), PLACE_INDEX_RECONCILE_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._reload_requested.clear()
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception("Place index reload failed; keeping the current one")
+
+    def _ring(self, row0: int, column0: int, ring: int, max_rows: int, max_columns: int):
+        """Cells whose grid distance from (row0, column0) is exactly `ring`, at most
+        max_rows rows north or south and max_columns columns east or west of it."""
+        if ring == 0:
+            cells = [(row0, column0)]
+        else:
+            span = min(ring, max_columns)
+            cells = [(row, column) for row in (row0 - ring, row0 + ring) if ring <= max_rows
+                     for column in range(column0 - span, column0 + span + 1)]
+            if ring <= max_columns:
+                cells += [(row, column) for row in range(max(row0 - ring + 1, row0 - max_rows),
+                                                        min(row0 + ring, row0 + max_rows + 1))
+                          for column in (column0 - ring, column0 + ring)]
+        for row, column in cells:
+            if 0 <= row < self.rows:
+                entries = self._cells.get((row, column % self.columns))
+                if entries:
+                    yield entries.values()
+
+    def _ring_min_distance(self, ring: int, poleward: float) -> float:
+        # Anything in ring r is at least r-1 whole cells away along one axis; east-west
+        # cells are narrowest at the most poleward latitude the search reaches.
+        if ring <= 1:
+            return 0.0
+        return (ring - 1) * self.cell_degrees * METERS_PER_DEGREE * math.cos(math.radians(poleward))
+
+    def _within(self, latitude: float, longitude: float, radius_m: float, min_reviews: int, stop=None):
+        """Yield (distance_m, place) ring by ring; `stop(ring_min_distance)` ends the walk early."""
+        row0, column0 = self._cell(latitude, longitude)
+        # The search box: rows within the radius north or south, and the columns the
+        # radius spans at the box's poleward edge (capped at half the globe)
+        max_rows = math.ceil(radius_m / (self.cell_degrees * METERS_PER_DEGREE)) + 1
+        poleward = min(abs(latitude) + max_rows * self.cell_degrees, 90.0)
+        column_m = self.cell_degrees * METERS_PER_DEGREE * math.cos(math.radians(poleward))
+        max_columns = self.columns // 2 - 1
+        if column_m * max_columns > radius_m:
+            max_columns = math.ceil(radius_m / column_m) + 1
+        rings = max(max_rows, max_columns) + 1
+
+        # Haversine (geo.haversine_m) unrolled against the precomputed cell entries
+        phi1, lambda1 = math.radians(latitude), math.radians(longitude)
+        cos_phi1 = math.cos(phi1)
+        sin, asin, sqrt = math.sin, math.asin, math.sqrt
+        diameter = 2 * EARTH_RADIUS_M
+
+        # A box with more cells than there are occupied ones (large radii, near the
+        # poles) is cheaper to answer by going through the occupied cells, unordered
+        if (2 * max_rows + 1) * (2 * max_columns + 1) > len(self._cells):
+            groups = [entries.values() for (row, _), entries in self._cells.items() if abs(row - row0) <= max_rows]
+            rings, stop = 1, None
+        else:
+            groups = None
+
+        for ring in range(rings):
+            if groups is None:
+                lower_bound = self._ring_min_distance(ring, poleward)
+                if lower_bound > radius_m or (stop is not None and stop(lower_bound)):
+                    return
+            for entries in groups or self._ring(row0, column0, ring, max_rows, max_columns):
+                for phi2, lambda2, cos_phi2, place in entries:
+                    if place.review_count < min_reviews:
+                        continue
+                    a = sin((phi2 - phi1) / 2) ** 2 + cos_phi1 * cos_phi2 * sin((lambda2 - lambda1) / 2) ** 2
+                    distance = diameter * asin(sqrt(a))
+                    if distance <= radius_m:
+                        yield distance, place
+
+    def nearest(self, latitude: float, longitude: float, k: int, radius_m: float, min_reviews: int = 0) -> list:
+        """Up to k (distance_m, place) within radius_m, closest first."""
+        heap = []  # max-heap on distance via negation: the k closest so far
+
+        def done(lower_bound: float) -> bool:
+            return len(heap) == k and lower_bound > -heap[0][0]
+
+        for distance, place in self._within(latitude, longitude, radius_m, min_reviews, done):
+            entry = (-distance, place.place_id, place)
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif distance < -heap[0][0]:
+                heapq.heapreplace(heap, entry)
+        return sorted(((-negative, place) for negative, _, place in heap), key=lambda pair: pair[0])
+
+    def top_rated(self, latitude: float, longitude: float, k: int, radius_m: float,
+                  half_distance_m: float, min_reviews: int = 0) -> list:
+        """Up to k (score, distance_m, place) within radius_m, best score first."""
+        scored = (
+            (place.weighted_rating() * 0.5 ** (distance / half_distance_m), distance, place)
+            for distance, place in self._within(latitude, longitude, radius_m, min_reviews)
+        )
+        return heapq.nlargest(k, scored, key=lambda entry: (entry[0], -entry[1]))
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "places": len(self._places),
+            "cells": len(self._cells),
+            "cell_degrees": self.cell_degrees,
+            "age_seconds": round(time.time() - self.loaded_at, 1) if self.loaded else None,
+            "reloads": self.reloads,
+            "updates": self.updates,
+        }
@@ -0,0 +1,93 @@
+# place_stats.py
+# Backfill and consistency check for the place_stats aggregate table.
+#   python place_stats.py rebuild   recompute every row from reviews
+#   python place_stats.py check     list places whose stats disagree with reviews
+import asyncio
+import sys
+from database import database
+
+# Per-place aggregates recomputed from scratch
+PLACE_STATS_AGGREGATE = """
+SELECT place_id,
+       COUNT(*) AS review_count,
+       COALESCE(SUM(rating), 0) AS rating_sum,
+       COUNT(*) FILTER (WHERE rating = 1) AS rating_1,
+       COUNT(*) FILTER (WHERE rating = 2) AS rating_2,
+       COUNT(*) FILTER (WHERE rating = 3) AS rating_3,
+       COUNT(*) FILTER (WHERE rating = 4) AS rating_4,
+       COUNT(*) FILTER (WHERE rating = 5) AS rating_5,
+       MAX(created_at) AS last_review_at
+FROM reviews
+GROUP BY place_id
+"""
+
+REBUILD_QUERY = """
+INSERT INTO place_stats (place_id, review_count, rating_sum,
+                         rating_1, rating_2, rating_3, rating_4, rating_5, last_review_at)
+""" + PLACE_STATS_AGGREGATE + """
+ON CONFLICT (place_id) DO UPDATE SET
+    review_count = EXCLUDED.review_count,
+    rating_sum = EXCLUDED.rating_sum,
+    rating_1 = EXCLUDED.rating_1,
+    rating_2 = EXCLUDED.rating_2,
+    rating_3 = EXCLUDED.rating_3,
+    rating_4 = EXCLUDED.rating_4,
+    rating_5 = EXCLUDED.rating_5,
+    last_review_at = EXCLUDED.last_review_at
+"""
+
+# Places whose stored stats differ from a fresh aggregate; missing rows count as zeros
+CHECK_QUERY = """
+WITH fresh AS (""" + PLACE_STATS_AGGREGATE + """)
+SELECT COALESCE(f.place_id, s.place_id) AS place_id,
+       s.review_count AS stored_count, f.review_count AS actual_count,
+       s.rating_sum AS stored_sum, f.rating_sum AS actual_sum
+FROM fresh f
+FULL OUTER JOIN place_stats s ON s.place_id = f.place_id
+WHERE (COALESCE(s.review_count, 0), COALESCE(s.rating_sum, 0), COALESCE(s.rating_1, 0), COALESCE(s.rating_2, 0),
+       COALESCE(s.rating_3, 0), COALESCE(s.rating_4, 0), COALESCE(s.rating_5, 0))
+      IS DISTINCT FROM
+      (COALESCE(f.review_count, 0), COALESCE(f.rating_sum, 0), COALESCE(f.rating_1, 0), COALESCE(f.rating_2, 0),
+       COALESCE(f.rating_3, 0), COALESCE(f.rating_4, 0), COALESCE(f.rating_5, 0))
+ORDER BY 1
+"""
+
+
+async def rebuild_place_stats() -> None:
+    async with database.transaction():
+        await database.execute(REBUILD_QUERY)
+        # Places that no longer have any reviews
+        await database.execute("""
+        DELETE FROM place_stats s
+        WHERE NOT EXISTS (SELECT 1 FROM reviews r WHERE r.place_id = s.place_id)
+        """)
+
+
+async def check_place_stats() -> list:
+    return await database.fetch_all(CHECK_QUERY)
+
+
+async def main(command: str) -> int:
+    await database.connect()
+    try:
+        if command == "rebuild":
+            await rebuild_place_stats()
+            print("✅ place_stats rebuilt")
+            return 0
+        mismatches = await check_place_stats()
+        for row in mismatches:
+            print(
+                f"place {row['place_id']}: stored count={row['stored_count']} sum={row['stored_sum']}, "
+                f"actual count={row['actual_count']} sum={row['actual_sum']}"
+            )
+        print(f"{'✅' if not mismatches else '❌'} {len(mismatches)} inconsistent places")
+        return 1 if mismatches else 0
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("rebuild", "check"):
+        print("usage: python place_stats.py rebuild|check")
+        sys.exit(2)
+    sys.exit(asyncio.run(main(sys.argv[1])))
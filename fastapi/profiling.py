@@ -0,0 +1,197 @@
+# profiling.py
+# Where request time goes: an on-demand sampling profiler and a log of slow requests.
+#
+# Sampling profiler: for a window of a few seconds, a background thread reads every
+# other thread's Python stack (sys._current_frames) each interval and counts
+# identical stacks. The result is in collapsed-stack format, one
+# "thread;outer;...;inner count" line per stack, which flamegraph.pl, speedscope and
+# inferno read directly. Stacks of the event loop thread include the awaiting
+# coroutines, so time spent encoding JSON in a handler shows under that handler;
+# bcrypt and other executor work shows under its own thread. Threads parked waiting
+# for work, and the event loop waiting for I/O, are left out unless asked for (with
+# uvloop, time in the loop's own C code cannot be told apart from waiting and is
+# left out too). Nothing runs outside a profiling window.
+#
+# Slow requests: while SLOW_REQUEST_MS is set, MetricsMiddleware gives each request
+# a RequestTimings that the database wrapper, pool, JSON encoder, compressor,
+# password hashing and upload storage add their time to (a context variable lookup
+# per call). Requests that take at least SLOW_REQUEST_MS are kept with that
+# breakdown in a ring buffer of the last SLOW_REQUEST_BUFFER. Phases can overlap
+# when work runs concurrently (asyncio.gather), and encoding done by FastAPI's own
+# JSONResponse is not broken out: it stays in "other".
+#
+# Both are per worker process; the responses say which pid they describe.
+import collections
+import os
+import re
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))  # 0 turns capture off
+SLOW_REQUEST_BUFFER = int(os.getenv("SLOW_REQUEST_BUFFER", "200"))
+# Queries listed per slow request; the phase totals still count every one
+SLOW_REQUEST_MAX_QUERIES = 50
+PROFILE_MAX_SECONDS = 60.0
+PROFILE_MAX_DEPTH = 128
+
+# Phases recorded by the instrumented code; "other" is what they leave of the total
+PHASES = ("db_wait", "db", "serialize", "compress", "password_hash", "file_io")
+
+# (module, function) at the top of a stack that is waiting rather than working
+IDLE_FRAMES = {
+    ("selectors", "select"),
+    ("asyncio.runners", "run"),  # uvloop waits for I/O in C, below this frame
+    ("threading", "wait"),
+    ("queue", "get"),
+    ("concurrent.futures.thread", "_worker"),
+}
+
+_current_timings: ContextVar[Optional["RequestTimings"]] = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    __slots__ = ("phases", "queries")
+
+    def __init__(self):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = []  # (name, seconds)
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] += seconds
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """The timings of the request being handled, or None when capture is off."""
+    return _current_timings.get()
+
+
+def record_phase(phase: str, seconds: float) -> None:
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+def record_query(name: str, seconds: float) -> None:
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add("db", seconds)
+        if len(timings.queries) < SLOW_REQUEST_MAX_QUERIES:
+            timings.queries.append((name, seconds))
+
+
+class SlowRequestLog:
+    def __init__(self, threshold_ms: float = SLOW_REQUEST_MS, size: int = SLOW_REQUEST_BUFFER):
+        self.threshold = threshold_ms / 1000
+        self._entries = collections.deque(maxlen=size)
+        self.captured = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def begin(self):
+        """Start timing a request; returns the context token for finish()."""
+        if not self.enabled:
+            return None
+        return _current_timings.set(RequestTimings())
+
+    def finish(self, token, scope: dict, route: str, status: int, elapsed: float,
+               first_byte: Optional[float], streamed: bool) -> None:
+        timings = _current_timings.get()
+        _current_timings.reset(token)
+        # Event streams stay open by design; their duration says nothing about speed
+        if elapsed < self.threshold or streamed or timings is None:
+            return
+        phases = dict(timings.phases)
+        # Query time includes waiting for the connection; report the two apart
+        phases["db"] = max(phases["db"] - phases["db_wait"], 0.0)
+        phases["other"] = max(elapsed - sum(phases.values()), 0.0)
+        self.captured += 1
+        self._entries.append({
+            "at": time.time(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query_string": scope.get("query_string", b"").decode("latin-1"),
+            "route": route,
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 2),
+            "first_byte_ms": round(first_byte * 1000, 2) if first_byte is not None else None,
+            "phases_ms": {phase: round(seconds * 1000, 2) for phase, seconds in phases.items()},
+            "queries": [{"name": name, "ms": round(seconds * 1000, 2)} for name, seconds in timings.queries],
+        })
+
+    def recent(self, limit: int) -> list:
+        """Newest first."""
+        return list(reversed(self._entries))[:limit]
+
+    def stats(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "threshold_ms": self.threshold * 1000,
+            "buffer_size": self._entries.maxlen,
+            "captured": self.captured,
+        }
+
+
+def _frame_label(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+def _thread_label(name: str) -> str:
+    # Pool threads (bcrypt_0, bcrypt_1, ...) share one root so their work adds up
+    return re.sub(r"_\d+$", "", name)
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def sample(self, seconds: float, interval: float, include_idle: bool = False) -> tuple:
+        """Sample all other threads for `seconds`; returns (collapsed stack counts, samples taken).
+
+        Blocks for the whole window, so call it off the event loop. Raises
+        RuntimeError while another window is running in this process.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running in this worker")
+        try:
+            return self._sample(min(seconds, PROFILE_MAX_SECONDS), interval, include_idle)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float, include_idle: bool) -> tuple:
+        me = threading.get_ident()
+        names = {}
+        stacks = collections.Counter()
+        samples = 0
+        next_tick = time.perf_counter()
+        deadline = next_tick + seconds
+        while next_tick < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if not include_idle and (frame.f_globals.get("__name__"), frame.f_code.co_name) in IDLE_FRAMES:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: _thread_label(thread.name) for thread in threading.enumerate()}
+                labels = []
+                while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            next_tick += interval
+            time.sleep(max(next_tick - time.perf_counter(), 0.0))
+        return stacks, samples
+
+
+def collapsed(stacks: collections.Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+profiler = SamplingProfiler()
+slow_requests = SlowRequestLog()
@@ -0,0 +1,29 @@
+# routes/images.py
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+from thumbnails import DERIVATIVE_SIZES, DERIVATIVE_MEDIA_TYPE, ensure_derivative
+import re
+
+router = APIRouter(prefix="/api/images", tags=["Images"])
+
+CONTENT_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Derivative URLs are content addressed, so a response never changes
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get("/{content_hash}/{size}")
+async def get_image_derivative(content_hash: str, size: str):
+    if size not in DERIVATIVE_SIZES or not CONTENT_HASH_PATTERN.match(content_hash):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    path = await ensure_derivative(content_hash, size)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    # FileResponse answers Range requests and sets ETag/Last-Modified
+    return FileResponse(
+        path,
+        media_type=DERIVATIVE_MEDIA_TYPE,
+        headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL},
+    )
@@ -0,0 +1,21 @@
+# routes/imports.py
+from fastapi import APIRouter, Depends, Form, HTTPException, UploadFile
+from auth import require_admin
+from bulk_import import import_file
+
+router = APIRouter(prefix="/api/import", tags=["Import"])
+
+
+@router.post("/")
+async def bulk_import(
+    file: UploadFile,
+    format: str = Form(None),
+    current_user=Depends(require_admin),
+):
+    fmt = format or ("csv" if (file.filename or "").lower().endswith(".csv") else "ndjson")
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    try:
+        return await import_file(file.file, fmt)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded")
@@ -0,0 +1,101 @@
+# routes/metrics.py
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from metrics import Counter, Gauge, render_metrics
+from database import database, place_index, read_database
+from cache import response_cache, get_entity_cache
+from auth import hashing_stats, require_admin
+from routes.reviews import review_feed, review_feed_bridge
+from jobs import JOB_HANDLERS, job_queue
+from profiling import slow_requests
+
+# Admin only, like /system; Prometheus sends an admin token (admins.py token)
+router = APIRouter(tags=["System"], dependencies=[Depends(require_admin)])
+
+# Sampled from the components' own counters at scrape time
+DB_POOL_CONNECTIONS = Gauge("db_pool_connections", "Pooled connections by state", ("state",))
+DB_POOL_WAITING = Gauge("db_pool_waiting", "Requests waiting for a pooled connection")
+DB_POOL_ACQUIRE_TIMEOUTS = Counter("db_pool_acquire_timeouts_total", "Pool acquires that timed out")
+DB_POOL_OLDEST_WAIT = Gauge("db_pool_oldest_wait_seconds", "How long the longest-waiting pool acquire has waited so far")
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by result", ("cache", "result"))
+CACHE_ENTRIES = Gauge("cache_entries", "Entries currently cached", ("cache",))
+PASSWORD_HASH_IN_FLIGHT = Gauge("password_hash_in_flight", "bcrypt jobs running or queued")
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected_total", "bcrypt jobs rejected with a 503")
+FEED_SUBSCRIBERS = Gauge("feed_subscribers", "Live feed clients connected to this worker")
+FEED_EVENTS = Counter("feed_events_total", "Live feed events published, and copies queued for clients", ("stage",))
+FEED_CLIENTS_REFUSED = Counter("feed_clients_refused_total", "Feed clients cut off as too slow or turned away as over the limit", ("reason",))
+FEED_LISTENER_CONNECTED = Gauge("feed_listener_connected", "1 while the LISTEN connection is up")
+FEED_LISTENER_RECONNECTS = Counter("feed_listener_reconnects_total", "LISTEN connections re-established")
+DB_READS = Counter("db_reads_total", "Routed reads by target; fallback counts replica reads retried on the primary", ("target",))
+DB_REPLICA_HEALTHY = Gauge("db_replica_healthy", "1 while the replica is in read rotation", ("replica",))
+DB_REPLICA_LAG = Gauge("db_replica_lag_seconds", "Replay lag at the last health check", ("replica",))
+PLACE_INDEX_PLACES = Gauge("place_index_places", "Places in this worker's in-memory spatial index")
+PLACE_INDEX_AGE = Gauge("place_index_age_seconds", "Time since the spatial index was last rebuilt from the database")
+JOBS = Gauge("jobs", "Jobs in the jobs table by status (shared by all workers)", ("kind", "status"))
+JOB_OLDEST = Gauge("job_oldest_seconds", "How long the longest-due job has been due, by status", ("kind", "status"))
+JOBS_RUNNING = Gauge("jobs_running", "Jobs running in this worker")
+JOB_OUTCOMES = Counter("job_outcomes_total", "Job runs in this worker by outcome", ("outcome",))
+SLOW_REQUESTS = Counter("slow_requests_captured_total", "Requests slower than SLOW_REQUEST_MS kept for /system/slow-requests")
+
+
+def sample_component_stats() -> None:
+    pool = database.pool_stats()
+    if pool["connected"]:
+        DB_POOL_CONNECTIONS.set(pool["in_use"], "in_use")
+        DB_POOL_CONNECTIONS.set(pool["idle"], "idle")
+    DB_POOL_WAITING.set(pool["waiting"])
+    DB_POOL_ACQUIRE_TIMEOUTS.set(pool["timeouts"])
+    DB_POOL_OLDEST_WAIT.set(pool["oldest_waiter_ms"] / 1000)
+    for name, stats in (("response", response_cache.stats()), ("entity", get_entity_cache().stats())):
+        if "hits" in stats:
+            CACHE_LOOKUPS.set(stats["hits"], name, "hit")
+            CACHE_LOOKUPS.set(stats["misses"], name, "miss")
+        if "entries" in stats:
+            CACHE_ENTRIES.set(stats["entries"], name)
+    hashing = hashing_stats()
+    PASSWORD_HASH_IN_FLIGHT.set(hashing["in_flight"])
+    PASSWORD_HASH_REJECTED.set(hashing["rejected"])
+    feed = review_feed.stats()
+    FEED_SUBSCRIBERS.set(feed["subscribers"])
+    FEED_EVENTS.set(feed["published"], "published")
+    FEED_EVENTS.set(feed["delivered"], "delivered")
+    FEED_CLIENTS_REFUSED.set(feed["dropped"], "slow")
+    FEED_CLIENTS_REFUSED.set(feed["rejected"], "full")
+    listener = review_feed_bridge.stats()
+    FEED_LISTENER_CONNECTED.set(int(listener["connected"]))
+    FEED_LISTENER_RECONNECTS.set(listener["reconnects"])
+    reads = read_database.stats()
+    DB_READS.set(reads["primary_reads"], "primary")
+    DB_READS.set(reads["fallbacks"], "fallback")
+    for replica in reads["replicas"]:
+        DB_READS.set(replica["reads"], replica["name"])
+        DB_REPLICA_HEALTHY.set(int(replica["healthy"]), replica["name"])
+        if replica["lag_seconds"] is not None:
+            DB_REPLICA_LAG.set(replica["lag_seconds"], replica["name"])
+    index = place_index.stats()
+    PLACE_INDEX_PLACES.set(index["places"])
+    if index["age_seconds"] is not None:
+        PLACE_INDEX_AGE.set(index["age_seconds"])
+    jobs = job_queue.stats()
+    JOBS_RUNNING.set(jobs["running"])
+    for outcome in ("completed", "retried", "failed", "requeued"):
+        JOB_OUTCOMES.set(jobs[outcome], outcome)
+    SLOW_REQUESTS.set(slow_requests.captured)
+
+
+async def sample_job_depth() -> None:
+    # Zero first, so a kind whose queue emptied reports 0 rather than its last count
+    for kind in JOB_HANDLERS:
+        for status in ("queued", "running", "failed"):
+            JOBS.set(0, kind, status)
+            JOB_OLDEST.set(0, kind, status)
+    for row in await job_queue.depth():
+        JOBS.set(row["jobs"], row["kind"], row["status"])
+        JOB_OLDEST.set(row["oldest_seconds"], row["kind"], row["status"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    sample_component_stats()
+    await sample_job_depth()
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,70 @@
+# routes/places.py
+from fastapi import APIRouter, HTTPException, Query
+from database import *
+
+router = APIRouter(prefix="/api/places", tags=["Places"])
+
+DEFAULT_NEARBY_LIMIT = 20
+MAX_NEARBY_LIMIT = 100
+DEFAULT_NEARBY_RADIUS_M = 5000
+MAX_NEARBY_RADIUS_M = 50000
+DEFAULT_HALF_DISTANCE_M = 1000
+
+
+# Declared before /{place_id} so "nearby" is not taken for an id
+@router.get("/nearby")
+async def nearby_places(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    limit: int = Query(DEFAULT_NEARBY_LIMIT, ge=1, le=MAX_NEARBY_LIMIT),
+    radius_m: float = Query(DEFAULT_NEARBY_RADIUS_M, gt=0, le=MAX_NEARBY_RADIUS_M),
+    sort: str = Query("distance", pattern="^(distance|rating)$"),
+    min_reviews: int = Query(0, ge=0),
+    half_distance_m: float = Query(DEFAULT_HALF_DISTANCE_M, gt=0),
+):
+    """Places around a point from the in-memory place_index; no database query.
+
+    sort=distance returns the nearest places. sort=rating ranks by rating, weighted
+    towards the average for places with few reviews, and halved for every
+    half_distance_m of distance, so a great place nearby beats a slightly better
+    one across town.
+    """
+    if not place_index.loaded:
+        raise HTTPException(status_code=503, detail="Place index is still loading", headers={"Retry-After": "1"})
+
+    if sort == "rating":
+        results = place_index.top_rated(latitude, longitude, limit, radius_m, half_distance_m, min_reviews)
+    else:
+        results = [(None, distance, place) for distance, place in
+                   place_index.nearest(latitude, longitude, limit, radius_m, min_reviews)]
+
+    places = []
+    for score, distance, place in results:
+        entry = {**place._asdict(), "distance_m": round(distance, 1)}
+        if score is not None:
+            entry["score"] = round(score, 4)
+        places.append(entry)
+    return {"places": places, "count": len(places)}
+
+
+@router.get("/{place_id}")
+async def read_place(place_id: int):
+    place = await get_place(place_id)
+    if place is None:
+        raise HTTPException(status_code=404, detail="Place not found")
+    return {
+        "place_id": place["place_id"],
+        "name": place["name"],
+        "description": place["description"],
+        "category_id": place["category_id"],
+        "address": place["address"],
+        "latitude": place["latitude"],
+        "longitude": place["longitude"],
+        "created_at": place["created_at"],
+        "stats": {
+            "review_count": place["review_count"],
+            "avg_rating": place["avg_rating"],
+            "histogram": {str(star): place[f"rating_{star}"] for star in range(1, 6)},
+            "last_review_at": place["last_review_at"],
+        },
+    }
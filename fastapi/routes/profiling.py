@@ -0,0 +1,34 @@
+# routes/profiling.py
+# Admin-only views of the profiler and slow request log (profiling.py). Both
+# describe the worker process that answers, named by its pid.
+import asyncio
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from auth import require_admin
+from profiling import PROFILE_MAX_SECONDS, collapsed, profiler, slow_requests
+
+router = APIRouter(prefix="/system", tags=["System"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def sample_profile(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    idle: bool = Query(False, description="Include threads and the event loop while they wait"),
+):
+    """Sample this worker's stacks for `seconds` and return them as collapsed stacks
+    (e.g. `flamegraph.pl profile.txt > profile.svg`)."""
+    try:
+        stacks, samples = await asyncio.to_thread(profiler.sample, seconds, interval_ms / 1000, idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(collapsed(stacks), headers={
+        "X-Profile-Samples": str(samples),
+        "X-Worker-Pid": str(os.getpid()),
+    })
+
+
+@router.get("/slow-requests")
+async def slow_request_log(limit: int = Query(50, ge=1, le=1000)):
+    return {**slow_requests.stats(), "requests": slow_requests.recent(limit)}
@@ -1,48 +1,718 @@
 # routes/reviews.py
-from fastapi import APIRouter, UploadFile, Form, HTTPException
+from fastapi import APIRouter, UploadFile, Form, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from datetime import datetime
+from typing import Optional
 from database import *
-import shutil
-import os
+from geo import covering_cells, precision_for_zoom
+from cache import cached_json_response
+from serialization import FastJSONResponse, dumps_str
+from sync import CHANGE_KINDS, decode_sync_token, encode_sync_token, fetch_change_keys, settled_xid, token_expired
+from feed import (
+    FEED_HEARTBEAT_SECONDS, FEED_QUEUE_SIZE, FEED_RETRY_MS, FEED_STREAM_MAX_SECONDS, REVIEW_FEED_CHANNEL,
+    FeedFull, FeedHub, NotifyBridge, Viewport, parse_viewport, sse_message,
+)
+from storage import referencing_image, save_upload
+from thumbnails import derivative_urls
+from jobs import job_queue
+import asyncio
+import base64
+import json
 import time
+from contextlib import nullcontext
 
 router = APIRouter(prefix="/api/reviews", tags=["Reviews"])
 
+# Columns of a review in listings. Spelled out rather than r.* so internal
+# columns such as search_vector are not sent to the client.
+REVIEW_COLUMNS = """
+r.review_id, r.user_id, r.place_id, r.rating, r.title, r.comment, r.image_path, r.image_hash, r.created_at, r.updated_at,
+u.username as user_name, p.name as place_name, p.address,
+p.latitude::float8 AS latitude, p.longitude::float8 AS longitude,
+ps.review_count AS place_review_count,
+ps.rating_sum::float8 / NULLIF(ps.rating_1 + ps.rating_2 + ps.rating_3 + ps.rating_4 + ps.rating_5, 0) AS place_avg_rating
+"""
+
+# Shared SELECT for review listings; callers append WHERE / ORDER BY / LIMIT.
+REVIEW_SELECT = "SELECT " + REVIEW_COLUMNS + """
+FROM reviews r
+JOIN users u ON r.user_id = u.user_id
+JOIN places p ON r.place_id = p.place_id
+LEFT JOIN place_stats ps ON ps.place_id = r.place_id
+"""
+
+# Places near (:latitude, :longitude) with their distance; filter on distance_m <= :radius_m.
+# Candidates come from nine geohash prefix ranges (index scan on places.geohash);
+# the exact great-circle distance is then computed for those rows only.
+NEARBY_PLACES = """
+nearby AS (
+    SELECT p.place_id,
+           2 * 6371008.8 * ASIN(SQRT(
+               POWER(SIN(RADIANS(p.latitude::float8 - :latitude) / 2), 2)
+               + COS(RADIANS(:latitude)) * COS(RADIANS(p.latitude::float8))
+                 * POWER(SIN(RADIANS(p.longitude::float8 - :longitude) / 2), 2)
+           )) AS distance_m
+    FROM places p
+    WHERE """ + " OR ".join(
+        f"(p.geohash >= :cell{i} AND p.geohash < :cell{i}_end)" for i in range(9)
+    ) + """
+)
+"""
+
+# Review listing restricted to places within :radius_m, nearest first
+NEARBY_REVIEW_SELECT = "WITH " + NEARBY_PLACES + "SELECT " + REVIEW_COLUMNS + """, n.distance_m
+FROM nearby n
+JOIN places p ON p.place_id = n.place_id
+JOIN reviews r ON r.place_id = n.place_id
+JOIN users u ON r.user_id = u.user_id
+LEFT JOIN place_stats ps ON ps.place_id = n.place_id
+WHERE n.distance_m <= :radius_m
+"""
+
+# Compact map-marker format: just what places and colours a pin. Served as one
+# array per column (see rows_to_columns) with the listing's order and cursors.
+MARKER_COLUMNS = """
+r.review_id, r.place_id, p.latitude::float8 AS latitude, p.longitude::float8 AS longitude, r.rating,
+r.created_at, EXTRACT(EPOCH FROM r.created_at)::int8 AS created_ts
+"""
+
+MARKER_SELECT = "SELECT " + MARKER_COLUMNS + """
+FROM reviews r
+JOIN places p ON r.place_id = p.place_id
+"""
+
+NEARBY_MARKER_SELECT = "WITH " + NEARBY_PLACES + "SELECT " + MARKER_COLUMNS + """, n.distance_m
+FROM nearby n
+JOIN places p ON p.place_id = n.place_id
+JOIN reviews r ON r.place_id = n.place_id
+WHERE n.distance_m <= :radius_m
+"""
+
+MARKER_MEDIA_TYPE = "application/vnd.reviews.markers+json"
+MARKER_FIELDS = ("review_id", "place_id", "latitude", "longitude", "rating")
+
+# Full listing rows for known ids (live feed and delta sync)
+REVIEWS_BY_ID = REVIEW_SELECT + "WHERE r.review_id = ANY(:review_ids)\nORDER BY r.review_id"
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+STREAM_BATCH_SIZE = 100
+DEFAULT_RADIUS_M = 1000
+MAX_RADIUS_M = 50000
+
+
+def nearby_values(latitude: float, longitude: float, radius_m: float) -> dict:
+    """Bind values for NEARBY_PLACES."""
+    values = {"latitude": latitude, "longitude": longitude, "radius_m": radius_m}
+    for i, cell in enumerate(covering_cells(latitude, longitude, radius_m)):
+        # Every geohash character sorts below "~", so [cell, cell + "~") is the prefix range
+        values[f"cell{i}"] = cell
+        values[f"cell{i}_end"] = cell + "~"
+    return values
+
+
+def encode_cursor(sort_key, review_id: int) -> str:
+    """Pack a (sort_key, review_id) keyset position into an opaque token."""
+    if isinstance(sort_key, datetime):
+        sort_key = sort_key.isoformat()
+    raw = json.dumps([sort_key, review_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_key, review_id = json.loads(base64.urlsafe_b64decode(padded))
+        return sort_key, int(review_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def build_reviews_query(
+    latitude: Optional[float],
+    longitude: Optional[float],
+    radius_m: float,
+    cursor: Optional[str],
+    markers: bool = False,
+):
+    """Return (query, values, sort_column) for a review listing.
+
+    Location queries are ordered by distance, everything else by newest first.
+    Both row formats share the ordering, so a cursor from one works in the other.
+    """
+    if latitude is not None and longitude is not None:
+        query = NEARBY_MARKER_SELECT if markers else NEARBY_REVIEW_SELECT
+        values = nearby_values(latitude, longitude, radius_m)
+        if cursor:
+            cursor_distance, cursor_review_id = decode_cursor(cursor)
+            try:
+                cursor_distance = float(cursor_distance)
+            except (ValueError, TypeError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            query += "AND (n.distance_m, r.review_id) > (:cursor_distance, :cursor_review_id)\n"
+            values.update({"cursor_distance": cursor_distance, "cursor_review_id": cursor_review_id})
+        query += "ORDER BY n.distance_m, r.review_id\nLIMIT :limit"
+        return query, values, "distance_m"
+
+    query = MARKER_SELECT if markers else REVIEW_SELECT
+    values = {}
+    if cursor:
+        cursor_created_at, cursor_review_id = decode_cursor(cursor)
+        try:
+            cursor_created_at = datetime.fromisoformat(cursor_created_at)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query += "WHERE (r.created_at, r.review_id) < (:cursor_created_at, :cursor_review_id)\n"
+        values.update({"cursor_created_at": cursor_created_at, "cursor_review_id": cursor_review_id})
+    # LIMIT NULL means "no limit" in Postgres, which the streaming mode relies on
+    query += "ORDER BY r.created_at DESC, r.review_id DESC\nLIMIT :limit"
+    return query, values, "created_at"
+
+
+def row_to_dict(row) -> dict:
+    # Values stay as asyncpg decoded them; serialization.dumps writes them directly
+    review = dict(row._mapping)
+    review.update(derivative_urls(review.get("image_hash")))
+    return review
+
+
+def rows_to_columns(rows) -> dict:
+    """Marker rows as one array per field; created_at in Unix seconds (UTC)."""
+    records = [row._mapping for row in rows]
+    columns = {field: [record[field] for record in records] for field in MARKER_FIELDS}
+    columns["created_at"] = [record["created_ts"] for record in records]
+    return columns
+
+
+def wants_markers(request: Request, format: Optional[str]) -> bool:
+    # An explicit ?format= wins over the Accept header
+    if format is not None:
+        return format == "markers"
+    return MARKER_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that closes its generator when the client goes away.
+
+    Otherwise a generator suspended at `yield` keeps its database cursor, and the
+    pooled connection under it, until garbage collection gets around to it.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+
+async def stream_reviews(query: str, values: dict):
+    # read_database.iterate() walks a server-side cursor, so only one batch is held in memory
+    batch = []
+    async for row in read_database.iterate(query=query, values=values):
+        batch.append(dumps_str(row_to_dict(row)))
+        if len(batch) >= STREAM_BATCH_SIZE:
+            yield "\n".join(batch) + "\n"
+            batch = []
+    if batch:
+        yield "\n".join(batch) + "\n"
+
+
 @router.get("/")
-async def get_reviews(latitude: float = None, longitude: float = None):
-    if latitude and longitude:
-        # Get reviews for a specific location
-        query = """
-        SELECT r.*, u.username as user_name, p.name as place_name, p.address,
-               p.latitude, p.longitude, r.image_path, r.created_at
-        FROM reviews r
-        JOIN users u ON r.user_id = u.user_id
-        JOIN places p ON r.place_id = p.place_id
-        WHERE p.latitude BETWEEN :lat_min AND :lat_max 
-          AND p.longitude BETWEEN :lng_min AND :lng_max
-        ORDER BY r.created_at DESC
-        """
-        # Search within ~1km radius
-        lat_range = 0.009  # ~1km
-        lng_range = 0.009  # ~1km
-        values = {
-            "lat_min": latitude - lat_range,
-            "lat_max": latitude + lat_range,
-            "lng_min": longitude - lng_range,
-            "lng_max": longitude + lng_range
-        }
+async def get_reviews(
+    request: Request,
+    latitude: float = None,
+    longitude: float = None,
+    radius_m: float = Query(DEFAULT_RADIUS_M, gt=0, le=MAX_RADIUS_M),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    format: Optional[str] = Query(None, pattern="^(rows|markers)$"),
+):
+    """Reviews, newest first or nearest first around latitude/longitude.
+
+    format=markers (or Accept: application/vnd.reviews.markers+json) returns the
+    compact marker format: {"columns": {"review_id": [...], "place_id": [...],
+    "latitude": [...], "longitude": [...], "rating": [...], "created_at": [...]},
+    "count", "next_cursor"}, with created_at in Unix seconds.
+    """
+    markers = wants_markers(request, format)
+    if markers and stream:
+        raise HTTPException(status_code=400, detail="The markers format is not available with stream=true")
+    query, values, sort_column = build_reviews_query(latitude, longitude, radius_m, cursor, markers)
+
+    if stream:
+        # NDJSON: every review after the cursor (or up to `limit`), one object per line
+        values["limit"] = limit
+        return ClosingStreamingResponse(stream_reviews(query, values), media_type="application/x-ndjson")
+
+    page_size = limit or DEFAULT_PAGE_SIZE
+
+    async def build_page():
+        # Fetch one extra row to learn whether another page exists
+        values["limit"] = page_size + 1
+        rows = await read_database.fetch_all(query=query, values=values)
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            next_cursor = encode_cursor(last[sort_column], last["review_id"])
+
+        if markers:
+            return {"columns": rows_to_columns(rows), "count": len(rows), "next_cursor": next_cursor}
+        return {"reviews": [row_to_dict(row) for row in rows], "next_cursor": next_cursor}
+
+    has_location = latitude is not None and longitude is not None
+    cache_key = (
+        "reviews",
+        latitude if has_location else None,
+        longitude if has_location else None,
+        radius_m if has_location else None,
+        page_size,
+        cursor,
+        markers,
+    )
+    return await cached_json_response(
+        request, cache_key, build_page,
+        media_type=MARKER_MEDIA_TYPE if markers else "application/json",
+        # The format can be chosen by Accept, so caches must key on it
+        vary="Accept",
+    )
+
+
+# Full-text search over reviews.search_vector (review title/comment and place
+# name/address, maintained by triggers; see migrations.py). The GIN index finds
+# the matches; only the newest :max_candidates of them are ranked, so a query
+# for a very common word costs a bounded top-N instead of ranking every review.
+SEARCH_QUERY = """
+WITH {nearby}search AS (
+    SELECT websearch_to_tsquery('simple', :q) AS query
+), matches AS (
+    SELECT r.review_id, ts_rank_cd(r.search_vector, s.query) AS rank
+    FROM reviews r, search s
+    WHERE r.search_vector @@ s.query{location_filter}
+    ORDER BY r.review_id DESC
+    LIMIT :max_candidates
+)
+SELECT """ + REVIEW_COLUMNS + """, m.rank
+FROM matches m
+JOIN reviews r ON r.review_id = m.review_id
+JOIN users u ON r.user_id = u.user_id
+JOIN places p ON r.place_id = p.place_id
+LEFT JOIN place_stats ps ON ps.place_id = r.place_id
+{cursor_filter}ORDER BY m.rank DESC, m.review_id DESC
+LIMIT :limit
+"""
+
+SEARCH_MAX_CANDIDATES = 10000
+
+
+@router.get("/search")
+async def search_reviews(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    latitude: float = None,
+    longitude: float = None,
+    radius_m: float = Query(DEFAULT_RADIUS_M, gt=0, le=MAX_RADIUS_M),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """Reviews matching `q` (web-search syntax: words, "phrases", -excluded, or), best first."""
+    has_location = latitude is not None and longitude is not None
+    values = {"q": q, "max_candidates": SEARCH_MAX_CANDIDATES, "limit": limit + 1}
+    nearby = location_filter = cursor_filter = ""
+    if has_location:
+        nearby = NEARBY_PLACES.lstrip() + ", "
+        location_filter = "\n      AND r.place_id IN (SELECT place_id FROM nearby WHERE distance_m <= :radius_m)"
+        values.update(nearby_values(latitude, longitude, radius_m))
+    if cursor:
+        cursor_rank, cursor_review_id = decode_cursor(cursor)
+        try:
+            cursor_rank = float(cursor_rank)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # rank is a float4; compare in that type so the row at the cursor is excluded exactly
+        cursor_filter = "WHERE (m.rank, m.review_id) < (CAST(:cursor_rank AS real), :cursor_review_id)\n"
+        values.update({"cursor_rank": cursor_rank, "cursor_review_id": cursor_review_id})
+    query = SEARCH_QUERY.format(nearby=nearby, location_filter=location_filter, cursor_filter=cursor_filter)
+
+    async def build_page():
+        rows = await read_database.fetch_all(query=query, values=values)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["rank"], rows[-1]["review_id"])
+        return {"reviews": [row_to_dict(row) for row in rows], "next_cursor": next_cursor}
+
+    cache_key = (
+        "search",
+        q,
+        latitude if has_location else None,
+        longitude if has_location else None,
+        radius_m if has_location else None,
+        limit,
+        cursor,
+    )
+    return await cached_json_response(request, cache_key, build_page)
+
+# ---------------- DELTA SYNC ---------------- #
+# Clients that were away catch up through /changes instead of reloading every
+# review; sync.py explains the token.
+
+CHANGED_PLACES = """
+SELECT p.place_id, p.name, p.category_id, p.address,
+       p.latitude::float8 AS latitude, p.longitude::float8 AS longitude, p.updated_at,
+       ps.review_count,
+       ps.rating_sum::float8 / NULLIF(ps.rating_1 + ps.rating_2 + ps.rating_3 + ps.rating_4 + ps.rating_5, 0) AS avg_rating
+FROM places p
+LEFT JOIN place_stats ps ON ps.place_id = p.place_id
+WHERE p.place_id = ANY(:place_ids)
+ORDER BY p.place_id
+"""
+
+CHANGED_USERS = "SELECT user_id, username FROM users WHERE user_id = ANY(:user_ids) ORDER BY user_id"
+
+DEFAULT_CHANGES_LIMIT = 1000
+MAX_CHANGES_LIMIT = 5000
+
+
+@router.get("/changes")
+async def get_review_changes(
+    since: Optional[str] = None,
+    limit: int = Query(DEFAULT_CHANGES_LIMIT, ge=1, le=MAX_CHANGES_LIMIT),
+):
+    """Reviews, places and usernames changed after the `since` token, and deleted ids.
+
+    Without `since` only a token for the current state is returned: get one before
+    loading the full listing, then poll with it. Upsert the returned rows by id,
+    remove the deleted ids, and keep next_token (call again at once while has_more).
+    Rows changed more than once come back once, as they are now. 410 means the
+    token is too old to catch up from; reload the listing and start over.
+    """
+    settled = await settled_xid()
+    changes = {"reviews": [], "places": [], "users": [], "deleted": {"reviews": [], "places": []}}
+    if since is None:
+        return FastJSONResponse({**changes, "next_token": encode_sync_token(settled), "has_more": False})
+
+    try:
+        xid, kind, entity_id, issued_at = decode_sync_token(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    if token_expired(issued_at):
+        raise HTTPException(status_code=410, detail="Sync token expired; reload all reviews")
+
+    keys = await fetch_change_keys(xid, kind, entity_id, settled, limit + 1)
+    has_more = len(keys) > limit
+    keys = keys[:limit]
+
+    ids = {name: [] for name, _ in CHANGE_KINDS.values()}
+    for key_kind, key_id, _ in keys:
+        ids[CHANGE_KINDS[key_kind][0]].append(key_id)
+    # A row deleted after its change was listed is simply missing here; its
+    # tombstone comes in a later batch
+    if ids["review"]:
+        rows = await database.fetch_all(query=REVIEWS_BY_ID, values={"review_ids": ids["review"]})
+        changes["reviews"] = [row_to_dict(row) for row in rows]
+    if ids["place"]:
+        rows = await database.fetch_all(query=CHANGED_PLACES, values={"place_ids": ids["place"]})
+        changes["places"] = [dict(row._mapping) for row in rows]
+    if ids["user"]:
+        rows = await database.fetch_all(query=CHANGED_USERS, values={"user_ids": ids["user"]})
+        changes["users"] = [dict(row._mapping) for row in rows]
+    changes["deleted"] = {"reviews": ids["review_deleted"], "places": ids["place_deleted"]}
+
+    if has_more:
+        last_kind, last_id, last_xid = keys[-1]
+        next_token = encode_sync_token(last_xid, last_kind, last_id, issued_at)
+    else:
+        # Everything below `settled` has been seen
+        next_token = encode_sync_token(max(settled, xid))
+    return FastJSONResponse({**changes, "next_token": next_token, "has_more": has_more})
+
+
+# Places in the viewport, bucketed by geohash prefix. Each cell reports its centroid,
+# review totals and the most-reviewed place; sparse cells also carry their places.
+CLUSTER_QUERY = """
+WITH place_rows AS (
+    SELECT p.place_id, p.name, p.latitude, p.longitude,
+           SUBSTR(p.geohash, 1, :precision) AS cell,
+           COALESCE(ps.review_count, 0) AS review_count,
+           COALESCE(ps.rating_sum, 0) AS rating_sum,
+           COALESCE(ps.rating_1 + ps.rating_2 + ps.rating_3 + ps.rating_4 + ps.rating_5, 0) AS rated_count
+    FROM places p
+    LEFT JOIN place_stats ps ON ps.place_id = p.place_id
+    WHERE p.latitude BETWEEN :min_lat AND :max_lat
+      AND {longitude_filter}
+)
+SELECT cell,
+       COUNT(*) AS place_count,
+       SUM(review_count) AS review_count,
+       AVG(latitude) AS latitude,
+       AVG(longitude) AS longitude,
+       SUM(rating_sum)::float8 / NULLIF(SUM(rated_count), 0) AS avg_rating,
+       (ARRAY_AGG(place_id ORDER BY review_count DESC, place_id))[1] AS place_id,
+       CASE WHEN COUNT(*) <= :sparse_max THEN
+           JSON_AGG(JSON_BUILD_OBJECT(
+               'place_id', place_id,
+               'name', name,
+               'latitude', latitude,
+               'longitude', longitude,
+               'review_count', review_count,
+               'avg_rating', rating_sum::float8 / NULLIF(rated_count, 0)
+           ))
+       END AS points
+FROM place_rows
+GROUP BY cell
+"""
+
+# A cell with this many places or fewer is returned as individual points
+SPARSE_CELL_MAX_POINTS = 3
+
+
+@router.get("/clusters")
+async def get_review_clusters(
+    request: Request,
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lng: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lng: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(..., ge=0, le=22),
+):
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat must not exceed max_lat")
+
+    if min_lng <= max_lng:
+        longitude_filter = "p.longitude BETWEEN :min_lng AND :max_lng"
     else:
-        # Get all reviews
-        query = """
-        SELECT r.*, u.username as user_name, p.name as place_name, p.address,
-               p.latitude, p.longitude, r.image_path, r.created_at
-        FROM reviews r
-        JOIN users u ON r.user_id = u.user_id
-        JOIN places p ON r.place_id = p.place_id
-        ORDER BY r.created_at DESC
-        """
-        values = {}
-    
-    return await database.fetch_all(query=query, values=values)
+        # Viewport crosses the antimeridian
+        longitude_filter = "(p.longitude >= :min_lng OR p.longitude <= :max_lng)"
+
+    precision = precision_for_zoom(zoom)
+    values = {
+        "precision": precision,
+        "min_lat": min_lat,
+        "max_lat": max_lat,
+        "min_lng": min_lng,
+        "max_lng": max_lng,
+        "sparse_max": SPARSE_CELL_MAX_POINTS,
+    }
+
+    async def build_clusters():
+        rows = await read_database.fetch_all(
+            query=CLUSTER_QUERY.format(longitude_filter=longitude_filter), values=values
+        )
+
+        clusters = []
+        points = []
+        for row in rows:
+            if row["points"] is not None:
+                points.extend(json.loads(row["points"]))
+                continue
+            clusters.append({
+                "cell": row["cell"],
+                "count": row["place_count"],
+                "review_count": row["review_count"],
+                "latitude": float(row["latitude"]),
+                "longitude": float(row["longitude"]),
+                "avg_rating": row["avg_rating"],
+                "place_id": row["place_id"],
+            })
+
+        return {"zoom": zoom, "precision": precision, "clusters": clusters, "points": points}
+
+    cache_key = ("clusters", min_lat, min_lng, max_lat, max_lng, zoom)
+    return await cached_json_response(request, cache_key, build_clusters)
+
+
+# ---------------- LIVE FEED ---------------- #
+# New reviews are pushed to /stream (Server-Sent Events) and /ws (WebSocket)
+# subscribers on this worker; feed.py has the hub and the LISTEN/NOTIFY bridge.
+
+REVIEWS_AFTER = REVIEW_SELECT + "WHERE r.review_id > :after_id\nORDER BY r.review_id\nLIMIT :limit"
+
+review_feed = FeedHub()
+
+
+async def publish_new_reviews(payloads: list) -> None:
+    """NotifyBridge handler: update place_index, load the notified reviews once and fan them out."""
+    review_ids = [int(p) for p in payloads]
+    # Every worker hears every review, so this keeps all their indexes and caches current
+    place_ids = await refresh_indexed_places_for_reviews(review_ids)
+    await drop_cached([("place", place_id) for place_id in place_ids])
+    if not review_feed.subscribers:
+        return  # nobody on this worker to tell, so skip the query
+    rows = await database.fetch_all(query=REVIEWS_BY_ID, values={"review_ids": review_ids})
+    for row in rows:
+        review = row_to_dict(row)
+        review_feed.publish("review", review, review["review_id"], review["latitude"], review["longitude"])
+
+
+def announce_resync() -> None:
+    # Notifications may have been lost; clients should refetch what they show
+    review_feed.publish("resync", {"reason": "feed interrupted"})
+    place_index.request_reload()
+    asyncio.get_running_loop().create_task(drop_cached([], clear=True))
+
+
+review_feed_bridge = NotifyBridge(REVIEW_FEED_CHANNEL, database.connect_dedicated, publish_new_reviews, announce_resync)
+
+
+def feed_viewport(min_lat, min_lng, max_lat, max_lng) -> Optional[Viewport]:
+    try:
+        return parse_viewport(min_lat, min_lng, max_lat, max_lng)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def missed_reviews(after_id: int, viewport: Optional[Viewport]) -> tuple:
+    """(reviews after `after_id` in the viewport, highest id seen); None for the
+    reviews when more than a queue's worth were missed."""
+    rows = await database.fetch_all(query=REVIEWS_AFTER, values={"after_id": after_id, "limit": FEED_QUEUE_SIZE + 1})
+    if len(rows) > FEED_QUEUE_SIZE:
+        return None, 0
+    reviews = [row_to_dict(row) for row in rows]
+    last_id = reviews[-1]["review_id"] if reviews else after_id
+    if viewport is not None:
+        reviews = [review for review in reviews if viewport.contains(review["latitude"], review["longitude"])]
+    return reviews, last_id
+
+
+async def review_events(subscriber, after_id: Optional[int], max_seconds: Optional[float] = None):
+    """Yield (event, id, data) for a subscriber, or None after a quiet heartbeat interval.
+
+    With `after_id` (a reconnecting client's last seen review) the reviews it missed
+    are replayed first. Ends after an overflow event or `max_seconds`.
+    """
+    replayed_up_to = 0
+    if after_id is not None:
+        missed, replayed_up_to = await missed_reviews(after_id, subscriber.viewport)
+        if missed is None:
+            yield "resync", None, dumps_str({"reason": "too many missed events"})
+        else:
+            for review in missed:
+                yield "review", review["review_id"], dumps_str(review)
+
+    deadline = None if max_seconds is None else time.monotonic() + max_seconds
+    while deadline is None or time.monotonic() < deadline:
+        timeout = FEED_HEARTBEAT_SECONDS
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        message = await subscriber.next_event(timeout)
+        if message is not None and message[0] == "review" and message[1] <= replayed_up_to:
+            continue  # already sent by the replay
+        yield message
+        if message is not None and message[0] == "overflow":
+            return
+
+
+async def review_event_stream(subscriber, after_id: Optional[int]):
+    try:
+        yield f"retry: {FEED_RETRY_MS}\n\n"
+        async for message in review_events(subscriber, after_id, FEED_STREAM_MAX_SECONDS):
+            if message is None:
+                yield ": keepalive\n\n"
+            else:
+                event, event_id, data = message
+                yield sse_message(event, data, event_id)
+    finally:
+        review_feed.unsubscribe(subscriber)
+
+
+@router.get("/stream")
+async def stream_review_feed(
+    request: Request,
+    min_lat: Optional[float] = Query(None, ge=-90, le=90),
+    min_lng: Optional[float] = Query(None, ge=-180, le=180),
+    max_lat: Optional[float] = Query(None, ge=-90, le=90),
+    max_lng: Optional[float] = Query(None, ge=-180, le=180),
+):
+    """Server-Sent Events for new reviews, limited to the viewport when one is given.
+
+    Events: `review` (id is the review_id), `resync` when events may have been
+    missed, and `overflow` right before a client that fell too far behind is cut
+    off. EventSource sends Last-Event-ID when it reconnects, and the reviews
+    created in between are replayed. Streams end after FEED_STREAM_MAX_SECONDS
+    so a restarting worker is not held up by them; clients reconnect seamlessly.
+    """
+    viewport = feed_viewport(min_lat, min_lng, max_lat, max_lng)
+    last_event_id = request.headers.get("last-event-id")
+    after_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    try:
+        subscriber = review_feed.subscribe(viewport)
+    except FeedFull:
+        raise HTTPException(status_code=503, detail="Too many live feed clients", headers={"Retry-After": "5"})
+    return ClosingStreamingResponse(
+        review_event_stream(subscriber, after_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def send_review_events(websocket: WebSocket, subscriber, after_id: Optional[int]) -> None:
+    async for message in review_events(subscriber, after_id):
+        if message is None:
+            continue  # uvicorn pings the socket itself
+        event, event_id, data = message
+        await websocket.send_text(f'{{"event": {json.dumps(event)}, "id": {json.dumps(event_id)}, "data": {data}}}')
+        if event == "overflow":
+            await websocket.close(code=1013)
+
+
+async def receive_viewports(websocket: WebSocket, subscriber) -> None:
+    # Returns when the client disconnects
+    while True:
+        try:
+            message = await websocket.receive_json()
+        except WebSocketDisconnect:
+            return
+        except ValueError:
+            continue
+        if not isinstance(message, dict) or "viewport" not in message:
+            continue
+        bounds = message["viewport"] or (None,) * 4
+        try:
+            if not isinstance(bounds, (list, tuple)) or len(bounds) != 4:
+                raise ValueError("viewport must be [min_lat, min_lng, max_lat, max_lng] or null")
+            subscriber.viewport = parse_viewport(*bounds)
+        except (TypeError, ValueError) as e:
+            await websocket.send_json({"event": "error", "id": None, "data": {"detail": str(e)}})
+
+
+@router.websocket("/ws")
+async def review_feed_socket(
+    websocket: WebSocket,
+    min_lat: Optional[float] = None,
+    min_lng: Optional[float] = None,
+    max_lat: Optional[float] = None,
+    max_lng: Optional[float] = None,
+    after_id: Optional[int] = None,
+):
+    """The /stream events as JSON messages {"event", "id", "data"}.
+
+    The client can move its viewport without reconnecting by sending
+    {"viewport": [min_lat, min_lng, max_lat, max_lng]}, or {"viewport": null}
+    for everything; `after_id` replays what it missed since that review.
+    """
+    try:
+        viewport = parse_viewport(min_lat, min_lng, max_lat, max_lng)
+        subscriber = review_feed.subscribe(viewport)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    except FeedFull:
+        await websocket.close(code=1013)
+        return
+    try:
+        await websocket.accept()
+        sender = asyncio.create_task(send_review_events(websocket, subscriber, after_id))
+        try:
+            await receive_viewports(websocket, subscriber)
+        finally:
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+    finally:
+        review_feed.unsubscribe(subscriber)
+
 
 @router.post("/")
 async def add_review(
@@ -56,46 +726,30 @@ async def add_review(
     image: UploadFile = None,
 ):
     try:
-        # First, find or create a place
-        place = await get_place_by_location(latitude, longitude)
-        if not place:
-            # Create a new place (using category_id=1 as default, you might want to make this dynamic)
-            place = await insert_place(
-                name=title,  # Using title as place name, you might want to separate this
-                category_id=1,
+        # Store the image first so a rejected upload doesn't leave a new place behind
+        stored = await save_upload(image) if image and image.filename else None
+        image_path = stored.path if stored else None
+        image_hash = stored.content_hash if stored else None
+
+        # Get-or-create the place and insert the review in one atomic statement
+        # (place_stats, photo references and the thumbnail job come with the same statement);
+        # a stored image is kept from gc until its photo reference commits
+        async with referencing_image(stored) if stored else nullcontext():
+            review = await add_review_at_location(
+                user_id=user_id,
+                rating=rating,
+                comment=comment,
+                place_name=title,  # Using title as place name, you might want to separate this
                 address=address,
                 latitude=latitude,
-                longitude=longitude
+                longitude=longitude,
+                image_path=image_path,
+                image_hash=image_hash,
             )
-        
-        # Handle image upload
-        image_path = None
-        if image and image.filename:
-            os.makedirs("uploads", exist_ok=True)
-            # Create unique filename to avoid conflicts
-            file_extension = os.path.splitext(image.filename)[1]
-            unique_filename = f"{user_id}_{int(time.time())}{file_extension}"
-            image_path = f"uploads/{unique_filename}"
-            
-            with open(image_path, "wb") as buffer:
-                shutil.copyfileobj(image.file, buffer)
-
-        # Create the review
-        query = """
-        INSERT INTO reviews (user_id, place_id, rating, comment, image_path, created_at)
-        VALUES (:user_id, :place_id, :rating, :comment, :image_path, NOW())
-        RETURNING review_id, user_id, place_id, rating, comment, image_path, created_at
-        """
-        values = {
-            "user_id": user_id,
-            "place_id": place["place_id"],
-            "rating": rating,
-            "comment": comment,
-            "image_path": image_path,
-        }
-        
-        review = await database.fetch_one(query=query, values=values)
-        
+        if image_hash:
+            # Thumbnails are rendered by a job worker once the response is on its way
+            job_queue.wake()
+
         return {
             "message": "Review added successfully", 
             "review_id": review["review_id"],
@@ -106,8 +760,11 @@ async def add_review(
             "latitude": latitude,
             "longitude": longitude,
             "image_path": image_path,
+            **derivative_urls(image_hash),
             "created_at": review["created_at"]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding review: {str(e)}")
\ No newline at end of file
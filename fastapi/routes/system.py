@@ -0,0 +1,54 @@
+# routes/system.py
+from fastapi import APIRouter, Depends
+from cache import response_cache, data_version, get_entity_cache
+from auth import hashing_stats, require_admin
+from database import database, place_index, read_database
+from routes.reviews import review_feed, review_feed_bridge
+from jobs import job_queue
+from admission import admission
+
+# Replica hosts, queue contents and admission internals are for operators only
+router = APIRouter(prefix="/system", tags=["System"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/cache")
+async def cache_stats():
+    return {
+        "response_cache": {**response_cache.stats(), "data_version": data_version()},
+        "entity_cache": get_entity_cache().stats(),
+    }
+
+
+@router.get("/hashing")
+async def password_hashing_stats():
+    return hashing_stats()
+
+
+@router.get("/pool")
+async def database_pool_stats():
+    return database.pool_stats()
+
+
+@router.get("/replicas")
+async def replica_stats():
+    return read_database.stats()
+
+
+@router.get("/feed")
+async def live_feed_stats():
+    return {"hub": review_feed.stats(), "listener": review_feed_bridge.stats()}
+
+
+@router.get("/jobs")
+async def job_queue_stats():
+    return {"worker": job_queue.stats(), "queue": await job_queue.depth()}
+
+
+@router.get("/place-index")
+async def place_index_stats():
+    return place_index.stats()
+
+
+@router.get("/admission")
+async def admission_stats():
+    return admission.stats()
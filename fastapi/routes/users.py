@@ -1,12 +1,20 @@
+import logging
 from fastapi import APIRouter, FastAPI, HTTPException, Request, Response, Depends, status
 from pydantic import BaseModel, field_validator
 from typing import Optional
 from datetime import datetime
 from database import *  # Ensure your database functions are imported
-from auth import get_password_hash_str, verify_password_str, create_access_token, get_current_user
+from auth import (
+    get_password_hash_str_async,
+    verify_password_str_async,
+    password_needs_rehash,
+    create_access_token,
+    get_current_user,
+)
 
 
 router = APIRouter(prefix="/users", tags=["Users"])
+logger = logging.getLogger(__name__)
 
 
 # Pydantic model for user creation
@@ -72,7 +80,7 @@ async def create_user(user: UserCreate):
 
         # Hash the password (already truncated by validator)
 
-        hashed = get_password_hash_str(user.password)
+        hashed = await get_password_hash_str_async(user.password)
         
         # Insert user into database
         result = await insert_user(user.username, hashed, user.email)
@@ -93,7 +101,7 @@ async def create_user(user: UserCreate):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error creating user: {e}")
+        logger.exception("Error creating user")
         raise HTTPException(status_code=500, detail=f"Error creating user: {str(e)}")
 
 
@@ -142,9 +150,18 @@ async def login_user(user: UserLogin, response: Response):
     password_bytes = user.password.encode('utf-8')[:72]
     # password_truncated = password_bytes.decode('utf-8', errors='ignore')
     
-    if not verify_password_str(password_bytes, db_user["password_hash"]):
+    if not await verify_password_str_async(password_bytes, db_user["password_hash"]):
         raise HTTPException(status_code=401, detail="Incorrect password")
 
+    # Upgrade hashes made with a different bcrypt cost while we have the plaintext
+    # (only when it was not truncated above, so the new hash verifies the same bytes)
+    if password_needs_rehash(db_user["password_hash"]) and len(user.password.encode('utf-8')) <= 72:
+        try:
+            new_hash = await get_password_hash_str_async(user.password)
+            await update_user_password_hash(db_user["user_id"], new_hash)
+        except HTTPException:
+            pass  # hashing pool is saturated; try again on the next login
+
     token = create_access_token({"id": db_user["user_id"], "email": db_user["email"]}, remember_me)
 
     # Set JWT in HttpOnly cookie
@@ -0,0 +1,42 @@
+# serialization.py
+# JSON encoding for API responses.
+#
+# orjson writes dicts, lists, datetimes and floats in C, several times faster than
+# json.dumps(jsonable_encoder(...)), which first copies every value in Python.
+# Rows can be passed as they come from asyncpg (row._mapping) once turned into a
+# dict, or read column by column for the compact formats. Anything orjson does not
+# know, such as Decimal or a Pydantic model, falls back to jsonable_encoder.
+import time
+from decimal import Decimal
+from typing import Any
+import orjson
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from profiling import current_timings
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    return jsonable_encoder(value)
+
+
+def dumps(payload: Any) -> bytes:
+    timings = current_timings()
+    if timings is None:
+        return orjson.dumps(payload, default=_default)
+    started = time.perf_counter()
+    body = orjson.dumps(payload, default=_default)
+    timings.add("serialize", time.perf_counter() - started)
+    return body
+
+
+def dumps_str(payload: Any) -> str:
+    return dumps(payload).decode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,261 @@
+# serve.py
+# Production entry point: a supervisor that pre-forks uvicorn workers.
+#   python serve.py --workers 4 --port 8000
+#   kill -HUP <pid>     replace the workers one by one without dropping requests
+#   kill -TERM <pid>    stop: workers finish in-flight requests, then exit
+#
+# The supervisor applies pending migrations once, imports the app (so workers share
+# its memory copy-on-write and start without re-importing), binds the listening
+# socket and forks --workers processes (WEB_CONCURRENCY, default one per core) that
+# all accept from it. Everything else in app.startup runs in each worker: the
+# connection pool, the place index, the live feed listener and the job workers are
+# per process. A worker counts as up only once that startup has finished and it is
+# accepting, which is what a rolling restart waits for before it retires the
+# worker being replaced.
+#
+# A worker that exits on its own is replaced; one that fails during startup stops
+# the supervisor, since its siblings would fail the same way. Stopping a worker
+# sends it SIGTERM: uvicorn stops accepting, lets open requests finish for up to
+# SERVE_GRACEFUL_TIMEOUT seconds, then runs the shutdown hooks. Long-lived feed
+# streams are cut at that point and their clients reconnect to another worker.
+#
+# Workers are forked from the supervisor's already imported code, so SIGHUP
+# recycles processes but does not load new code; restart the supervisor for that.
+# `uvicorn app:app --reload` (docker-compose) remains the development server.
+import argparse
+import asyncio
+import logging
+import os
+import select
+import signal
+import sys
+import time
+import uvicorn
+from database import connect_db, disconnect_db
+from init_db import init_db
+from logging_config import configure_logging
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+SERVE_GRACEFUL_TIMEOUT = float(os.getenv("SERVE_GRACEFUL_TIMEOUT", "30"))
+# connect_db alone may retry for ~20s while the database comes up
+SERVE_BOOT_TIMEOUT = float(os.getenv("SERVE_BOOT_TIMEOUT", "120"))
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerServer(uvicorn.Server):
+    """A uvicorn server that tells the supervisor when it is accepting connections."""
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None) -> None:
+        # A failed startup exits without writing, which the supervisor reads as EOF
+        try:
+            await super().startup(sockets=sockets)
+            if self.started and not self.should_exit:
+                os.write(self.ready_fd, b"1")
+        finally:
+            os.close(self.ready_fd)
+
+
+def run_worker(config: uvicorn.Config, sockets: list, ready_fd: int) -> int:
+    # Undo the supervisor's handlers; uvicorn installs SIGINT/SIGTERM ones while serving.
+    # A terminal hangup reaches the whole process group and is the supervisor's to handle.
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    server = WorkerServer(config, ready_fd)
+    asyncio.run(server.serve(sockets=sockets))
+    return 0 if server.started else 1
+
+
+class Supervisor:
+    def __init__(self, config: uvicorn.Config, workers: int):
+        self.config = config
+        self.size = workers
+        self.sockets = [config.bind_socket()]
+        self.workers = {}  # pid -> readiness pipe, until the worker reports in
+        self.ready = set()
+        self._signals = []
+        # Signal handlers write here to wake the main loop's select()
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        os.set_blocking(self._wakeup_write, False)
+
+    def spawn(self) -> int:
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            code = 1
+            try:
+                code = run_worker(self.config, self.sockets, ready_write)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                logger.exception("Worker crashed")
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        os.close(ready_write)
+        self.workers[pid] = ready_read
+        logger.info("Started worker %d", pid)
+        return pid
+
+    def wait_ready(self, pids: list) -> bool:
+        """Wait for the workers to finish startup; False if any of them exits or times out first."""
+        deadline = time.monotonic() + SERVE_BOOT_TIMEOUT
+        pending = {self.workers[pid]: pid for pid in pids}
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping():
+                break
+            readable, _, _ = select.select(list(pending), [], [], min(remaining, 1.0))
+            for fd in readable:
+                pid = pending.pop(fd)
+                reported = os.read(fd, 1)
+                os.close(fd)
+                self.workers[pid] = None
+                if not reported:
+                    logger.error("Worker %d exited during startup", pid)
+                    return False
+                self.ready.add(pid)
+        if pending:
+            logger.error("Workers %s did not start within %.0fs", sorted(pending.values()), SERVE_BOOT_TIMEOUT)
+            return False
+        return True
+
+    def stop_workers(self, pids: list) -> None:
+        """SIGTERM the workers and wait for them to drain, killing any that take too long."""
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + SERVE_GRACEFUL_TIMEOUT + 5
+        remaining = set(pids)
+        while remaining:
+            for pid in list(remaining):
+                if self._reap(pid):
+                    remaining.discard(pid)
+            if remaining and time.monotonic() > deadline:
+                for pid in remaining:
+                    logger.warning("Worker %d did not drain in time; killing it", pid)
+                    os.kill(pid, signal.SIGKILL)
+                deadline = float("inf")
+            if remaining:
+                time.sleep(0.05)
+
+    def _reap(self, pid: int) -> bool:
+        try:
+            reaped, _ = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            reaped = pid
+        if reaped:
+            self._forget(pid)
+        return bool(reaped)
+
+    def _forget(self, pid: int) -> None:
+        fd = self.workers.pop(pid, None)
+        if fd is not None:
+            os.close(fd)
+        self.ready.discard(pid)
+
+    def _on_signal(self, signum, frame) -> None:
+        self._signals.append(signum)
+        try:
+            os.write(self._wakeup_write, b"s")
+        except BlockingIOError:
+            pass
+
+    def _stopping(self) -> bool:
+        return any(signum in (signal.SIGINT, signal.SIGTERM) for signum in self._signals)
+
+    def rolling_restart(self) -> None:
+        logger.info("Replacing %d workers", len(self.ready))
+        for old in sorted(self.ready):
+            new = self.spawn()
+            if not self.wait_ready([new]):
+                logger.error("Replacement worker failed to start; keeping the remaining workers")
+                self.stop_workers([new])
+                return
+            self.stop_workers([old])
+            if self._stopping():
+                return
+
+    def run(self) -> int:
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+        started = [self.spawn() for _ in range(self.size)]
+        if not self.wait_ready(started):
+            self.stop_workers(list(self.workers))
+            return 1
+        logger.info("Serving on %s:%d with %d workers (pid %d)",
+                    self.config.host, self.config.port, len(self.ready), os.getpid())
+
+        code = 0
+        while not self._stopping():
+            select.select([self._wakeup_read], [], [], 1.0)
+            try:
+                while os.read(self._wakeup_read, 512):
+                    pass
+            except BlockingIOError:
+                pass
+            if self._stopping():
+                break
+            restart = signal.SIGHUP in self._signals
+            self._signals.clear()
+            if not self._replace_exited():
+                code = 1
+                break
+            if restart:
+                self.rolling_restart()
+
+        logger.info("Stopping %d workers", len(self.workers))
+        self.stop_workers(list(self.workers))
+        return code
+
+    def _replace_exited(self) -> bool:
+        for pid in list(self.workers):
+            if self._reap(pid):
+                logger.warning("Worker %d exited; starting a replacement", pid)
+                if not self.wait_ready([self.spawn()]):
+                    return False
+        return True
+
+
+async def migrate() -> None:
+    await connect_db()
+    try:
+        await init_db()
+    finally:
+        await disconnect_db()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the API with pre-forked uvicorn workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument("--access-log", action="store_true",
+                        help="log every request (the metrics middleware already counts them)")
+    args = parser.parse_args()
+    configure_logging()
+
+    asyncio.run(migrate())
+    # Workers skip the migration check in app.startup; read when the app is imported below
+    os.environ["MIGRATE_ON_STARTUP"] = "0"
+    config = uvicorn.Config(
+        "app:app", host=args.host, port=args.port,
+        # Logging is configured by logging_config, not uvicorn
+        log_config=None, access_log=args.access_log,
+        timeout_graceful_shutdown=SERVE_GRACEFUL_TIMEOUT,
+    )
+    config.load()
+    return Supervisor(config, args.workers).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
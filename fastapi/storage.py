@@ -0,0 +1,273 @@
+# storage.py
+# Content-addressed storage for review images.
+# Uploads are streamed to a temp file in chunks (off the event loop via aiofiles),
+# hashed on the way, then moved to uploads/<h[0:2]>/<h[2:4]>/<sha256>.<ext>.
+# Identical images therefore share one file; photos.ref_count tracks the reviews using it.
+#   python storage.py gc   delete files (and their derivatives) whose ref_count dropped to zero
+#
+# Starlette spools a multipart body to disk before the endpoint runs, so
+# UploadLimitMiddleware caps the request bodies of UPLOAD_ROUTES as they arrive;
+# save_upload's own check only guards the image part.
+#
+# A file found already in place may be one gc is about to delete. referencing_image
+# moves the upload into place and runs the statement that references it in one
+# transaction holding the image's advisory lock shared; gc deletes a file only
+# under the same lock held exclusively, after re-checking its ref_count.
+import asyncio
+import hashlib
+import os
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import NamedTuple
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+from database import database
+from profiling import record_phase
+
+UPLOAD_DIR = "uploads"
+UPLOAD_TMP_DIR = os.path.join(UPLOAD_DIR, "tmp")
+# WebP derivatives rendered by thumbnails.py; longest edge in pixels for each size
+DERIVATIVE_SIZES = {"thumb": 160, "medium": 800}
+DERIVATIVE_DIR = os.path.join(UPLOAD_DIR, "derived")
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(5 * 1024 * 1024)))
+# Room for the other form fields and multipart framing around the image
+MAX_FORM_FIELDS_BYTES = int(os.getenv("MAX_FORM_FIELDS_BYTES", str(256 * 1024)))
+# (method, path without trailing slash) of the routes that take an image upload
+UPLOAD_ROUTES = {("POST", "/api/reviews")}
+
+# Leading bytes of the image formats the frontend accepts
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".png", ".gif", ".webp")
+
+
+class StoredImage(NamedTuple):
+    content_hash: str
+    path: str
+    size: int
+    tmp_path: str  # where the bytes wait until referencing_image moves them to `path`
+
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, limit: int):
+        super().__init__(status_code=413, detail=f"Request body is larger than {limit} bytes")
+
+
+class UploadLimitMiddleware:
+    """Rejects request bodies over MAX_UPLOAD_BYTES + MAX_FORM_FIELDS_BYTES on UPLOAD_ROUTES.
+
+    A declared Content-Length over the limit is refused before any of the body is
+    read; otherwise the body is counted as it is received and reading stops at the limit.
+    """
+
+    def __init__(self, app, limit: int = MAX_UPLOAD_BYTES + MAX_FORM_FIELDS_BYTES):
+        self.app = app
+        self.limit = limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"].rstrip("/")) not in UPLOAD_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.limit:
+                await JSONResponse({"detail": UploadTooLarge(self.limit).detail}, status_code=413)(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    # Raised inside the form parser, so it is answered like any HTTPException
+                    raise UploadTooLarge(self.limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def sniff_image_extension(head: bytes):
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def content_path(content_hash: str, extension: str) -> str:
+    return os.path.join(UPLOAD_DIR, content_hash[:2], content_hash[2:4], content_hash + extension)
+
+
+def derivative_path(content_hash: str, size: str) -> str:
+    return os.path.join(DERIVATIVE_DIR, size, content_hash[:2], content_hash[2:4], content_hash + ".webp")
+
+
+async def save_upload(upload: UploadFile) -> StoredImage:
+    """Stream an upload to a temp file and hash it, enforcing MAX_UPLOAD_BYTES.
+
+    The file is moved into content-addressed storage by referencing_image;
+    discard_upload removes it when the upload is not used after all.
+    """
+    started = time.perf_counter()
+    try:
+        return await _store_upload(upload)
+    finally:
+        record_phase("file_io", time.perf_counter() - started)
+
+
+async def _store_upload(upload: UploadFile) -> StoredImage:
+    await aiofiles.os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    tmp_path = os.path.join(UPLOAD_TMP_DIR, f"{uuid.uuid4().hex}.part")
+    hasher = hashlib.sha256()
+    size = 0
+    extension = None
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if extension is None:
+                    extension = sniff_image_extension(chunk[:16])
+                    if extension is None:
+                        raise HTTPException(status_code=400, detail="Unsupported image type")
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Image is larger than {MAX_UPLOAD_BYTES} bytes",
+                    )
+                hasher.update(chunk)
+                await out.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty image upload")
+
+        content_hash = hasher.hexdigest()
+        path = content_path(content_hash, extension)
+        return StoredImage(content_hash=content_hash, path=path, size=size, tmp_path=tmp_path)
+    except BaseException:
+        if await aiofiles.os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
+        raise
+
+
+async def discard_upload(stored: StoredImage) -> None:
+    if await aiofiles.os.path.exists(stored.tmp_path):
+        await aiofiles.os.remove(stored.tmp_path)
+
+
+def image_lock_key(content_hash: str) -> int:
+    # 60 bits of the hash fit Postgres' bigint advisory lock keys
+    return int(content_hash[:15], 16)
+
+
+@asynccontextmanager
+async def referencing_image(stored: StoredImage):
+    """Move an upload into storage; the body must add the reference (ref_count) to it.
+
+    Both happen in one transaction holding the image's lock shared, so gc cannot
+    delete the file between it being found here and the reference committing.
+    If the body fails, a file this call moved into place is removed again unless
+    another upload of the same bytes has referenced it or is about to.
+    """
+    key = image_lock_key(stored.content_hash)
+    created = False
+    try:
+        async with database.transaction():
+            await database.execute("SELECT pg_advisory_xact_lock_shared(:key)", values={"key": key})
+            started = time.perf_counter()
+            if await aiofiles.os.path.exists(stored.path):
+                # Same bytes already stored
+                await aiofiles.os.remove(stored.tmp_path)
+            else:
+                await aiofiles.os.makedirs(os.path.dirname(stored.path), exist_ok=True)
+                await aiofiles.os.replace(stored.tmp_path, stored.path)
+                created = True
+            record_phase("file_io", time.perf_counter() - started)
+            try:
+                # A savepoint, so the transaction (and the lock) stays usable if the body fails
+                async with database.transaction():
+                    yield
+            except BaseException:
+                if created and await _unreferenced_after_failure(key, stored.content_hash):
+                    await aiofiles.os.remove(stored.path)
+                raise
+    finally:
+        await discard_upload(stored)
+
+
+async def _unreferenced_after_failure(key: int, content_hash: str) -> bool:
+    # Taking the lock exclusively on top of our shared hold succeeds only if no other
+    # upload holds it, i.e. none found this file and is still adding its reference
+    locked = await database.fetch_val("SELECT pg_try_advisory_xact_lock(:key)", values={"key": key})
+    if not locked:
+        return False
+    referenced = await database.fetch_val(
+        "SELECT EXISTS (SELECT 1 FROM photos WHERE content_hash = :content_hash)",
+        values={"content_hash": content_hash},
+    )
+    return not referenced
+
+
+# Re-checked under the lock: a reference may have been added since the candidates were listed
+DELETE_UNREFERENCED_PHOTO = """
+DELETE FROM photos
+WHERE content_hash = :content_hash AND ref_count <= 0
+RETURNING photo_url
+"""
+
+
+async def collect_garbage() -> int:
+    """Delete photos no review references any more, their files and derivatives."""
+    candidates = await database.fetch_all(
+        "SELECT content_hash FROM photos WHERE content_hash IS NOT NULL AND ref_count <= 0"
+    )
+    removed = 0
+    for candidate in candidates:
+        content_hash = candidate["content_hash"]
+        async with database.transaction():
+            locked = await database.fetch_val(
+                "SELECT pg_try_advisory_xact_lock(:key)", values={"key": image_lock_key(content_hash)},
+            )
+            if not locked:
+                continue  # a review is taking it up right now
+            row = await database.fetch_one(DELETE_UNREFERENCED_PHOTO, values={"content_hash": content_hash})
+            if row is None:
+                continue
+            # Before commit: an upload waiting for the lock must find the files gone
+            paths = [row["photo_url"]] + [derivative_path(content_hash, size) for size in DERIVATIVE_SIZES]
+            for path in paths:
+                if await aiofiles.os.path.exists(path):
+                    await aiofiles.os.remove(path)
+            removed += 1
+    return removed
+
+
+async def main() -> None:
+    await database.connect()
+    try:
+        removed = await collect_garbage()
+        print(f"✅ Removed {removed} unreferenced images")
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["gc"]:
+        print("usage: python storage.py gc")
+        sys.exit(2)
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+# sync.py
+# Change tracking for GET /api/reviews/changes.
+#
+# Triggers (migrations 10 and 11) stamp reviews, places and users with the id of
+# the transaction that last changed what clients see (change_xid, an xid8), and
+# deletions of reviews and places leave a row in tombstones. A sync token is a
+# position (change_xid, kind, id) in that stream of changes.
+#
+# Transactions commit out of xid order, so a token never moves past the oldest
+# transaction still running (the snapshot xmin): every change below it has
+# committed and is visible, and later ones are picked up by the next call. Change
+# times (updated_at) are only informational for the same reason.
+#
+# Tombstones are kept for SYNC_RETENTION_DAYS; tokens older than that are refused
+# and the client starts over with a full listing.
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+from database import database
+
+SYNC_RETENTION_DAYS = float(os.getenv("SYNC_RETENTION_DAYS", "30"))
+# A token is refused this long before its tombstones could be pruned, so changes
+# made by transactions that were already running when it was issued are still there
+SYNC_TOKEN_SAFETY_SECONDS = 86400
+SYNC_PRUNE_INTERVAL_SECONDS = float(os.getenv("SYNC_PRUNE_INTERVAL_SECONDS", "3600"))
+
+logger = logging.getLogger(__name__)
+
+# Entities in the change stream; the number orders kinds within one transaction
+CHANGE_KINDS = {
+    1: ("review", "SELECT review_id AS id, change_xid FROM reviews"),
+    2: ("place", "SELECT place_id AS id, change_xid FROM places"),
+    3: ("user", "SELECT user_id AS id, change_xid FROM users"),
+    4: ("review_deleted", "SELECT entity_id AS id, change_xid FROM tombstones WHERE entity = 'review'"),
+    5: ("place_deleted", "SELECT entity_id AS id, change_xid FROM tombstones WHERE entity = 'place'"),
+}
+
+
+def _branch(kind: int, select: str) -> str:
+    # Each branch walks its (change_xid, id) index from the token; see change_key_values
+    # for how one token turns into a per-kind starting point
+    return f"""(
+    SELECT {kind} AS kind, id, change_xid FROM ({select}) s
+    WHERE (change_xid, id) > (CAST(CAST(:xid AS text) AS xid8), :after_{kind})
+      AND change_xid < CAST(CAST(:settled AS text) AS xid8)
+    ORDER BY change_xid, id
+    LIMIT :limit
+)"""
+
+
+CHANGE_KEYS_QUERY = (
+    "SELECT kind, id, change_xid::text AS change_xid FROM (\n"
+    + "\nUNION ALL\n".join(_branch(kind, select) for kind, (_, select) in CHANGE_KINDS.items())
+    + "\n) c\nORDER BY c.change_xid, c.kind, c.id\nLIMIT :limit"
+)
+
+# Every transaction below this xid has finished
+SETTLED_XID_QUERY = "SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS xid"
+
+PRUNE_TOMBSTONES = """
+WITH pruned AS (
+    DELETE FROM tombstones WHERE deleted_at < NOW() - make_interval(secs => :seconds) RETURNING 1
+)
+SELECT COUNT(*) FROM pruned
+"""
+
+_pruner = None
+
+
+def encode_sync_token(xid: int, kind: int = 0, entity_id: int = 0, issued_at: float = None) -> str:
+    # issued_at is carried over while paging so an old position cannot be refreshed
+    issued_at = int(time.time() if issued_at is None else issued_at)
+    raw = json.dumps([xid, kind, entity_id, issued_at]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_sync_token(token: str) -> tuple:
+    """(xid, kind, id, issued_at); ValueError if malformed."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        xid, kind, entity_id, issued_at = json.loads(base64.urlsafe_b64decode(padded))
+        return int(xid), int(kind), int(entity_id), float(issued_at)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid sync token") from e
+
+
+def token_expired(issued_at: float) -> bool:
+    return time.time() - issued_at > SYNC_RETENTION_DAYS * 86400 - SYNC_TOKEN_SAFETY_SECONDS
+
+
+def change_key_values(xid: int, kind: int, entity_id: int) -> dict:
+    # The stream is ordered by (change_xid, kind, id). For one kind that is
+    # (change_xid, id) > (xid, after): `after` is the token's id for the token's
+    # kind, -1 for later kinds (all of xid still to come) and "infinity" for
+    # earlier ones (xid already done).
+    values = {"xid": str(xid)}
+    for k in CHANGE_KINDS:
+        values[f"after_{k}"] = entity_id if k == kind else (-1 if k > kind else 2**31 - 1)
+    return values
+
+
+async def settled_xid() -> int:
+    return int(await database.fetch_val(SETTLED_XID_QUERY))
+
+
+async def fetch_change_keys(xid: int, kind: int, entity_id: int, settled: int, limit: int) -> list:
+    """Up to `limit` (kind, id, change_xid) after the token position and below `settled`."""
+    values = {**change_key_values(xid, kind, entity_id), "settled": str(settled), "limit": limit}
+    rows = await database.fetch_all(CHANGE_KEYS_QUERY, values)
+    return [(row["kind"], row["id"], int(row["change_xid"])) for row in rows]
+
+
+async def prune_tombstones() -> int:
+    return await database.fetch_val(PRUNE_TOMBSTONES, {"seconds": SYNC_RETENTION_DAYS * 86400})
+
+
+async def _prune_periodically() -> None:
+    while True:
+        try:
+            pruned = await prune_tombstones()
+            if pruned:
+                logger.info("Pruned %d tombstones older than %g days", pruned, SYNC_RETENTION_DAYS)
+        except Exception:
+            logger.exception("Tombstone pruning failed")
+        await asyncio.sleep(SYNC_PRUNE_INTERVAL_SECONDS)
+
+
+def start_tombstone_pruner() -> None:
+    global _pruner
+    _pruner = asyncio.create_task(_prune_periodically())
+
+
+async def stop_tombstone_pruner() -> None:
+    if _pruner is not None:
+        _pruner.cancel()
+        await asyncio.gather(_pruner, return_exceptions=True)
@@ -0,0 +1,23 @@
+import asyncio
+import pytest
+from database import database
+from migrations import migrate
+
+
+@pytest.fixture
+def with_database():
+    """Run a coroutine function against the Postgres in DATABASE_URL / POSTGRES_*,
+    migrated; the test is skipped when it is not reachable."""
+    def run(scenario):
+        async def main():
+            try:
+                await asyncio.wait_for(database.connect(), 5)
+            except (OSError, asyncio.TimeoutError) as e:
+                pytest.skip(f"Postgres not reachable: {e}")
+            try:
+                await migrate()
+                return await scenario()
+            finally:
+                await database.disconnect()
+        return asyncio.run(main())
+    return run
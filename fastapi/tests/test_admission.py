@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+import admission
+from admission import FULL_REFILL_SECONDS, MemoryRateLimitBackend, PostgresRateLimitBackend, RateLimit
+
+
+class Clock:
+    def __init__(self):
+        self.now = 500.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def take(backend, key, limit):
+    return asyncio.run(backend.take(key, limit))
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("10/60", RateLimit(10, 10 / 60)),
+    ("5/1", RateLimit(5, 5.0)),
+    ("30", RateLimit(30, 30.0)),
+    ("3/0.5", RateLimit(3, 6.0)),
+    ("", None),
+    ("   ", None),
+])
+def test_rate_limit_parse(text, expected):
+    assert RateLimit.parse(text) == expected
+
+
+@pytest.mark.parametrize("text", ["many/60", "10/soon", "1.5/60"])
+def test_rate_limit_parse_rejects_garbage(text):
+    with pytest.raises(ValueError):
+        RateLimit.parse(text)
+
+
+def test_burst_then_wait_for_refill(clock):
+    backend = MemoryRateLimitBackend()
+    limit = RateLimit.parse("3/6")  # 3 at once, then one every 2 seconds
+    assert [take(backend, "client", limit) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert take(backend, "client", limit) == pytest.approx(2.0)
+    clock.now += 1.0
+    assert take(backend, "client", limit) == pytest.approx(1.0)
+    clock.now += 1.0
+    assert take(backend, "client", limit) == 0.0
+    assert take(backend, "client", limit) == pytest.approx(2.0)
+
+
+def test_refill_is_capped_at_the_burst(clock):
+    backend = MemoryRateLimitBackend()
+    limit = RateLimit(2, 1.0)
+    take(backend, "client", limit)
+    clock.now += 3600
+    assert [take(backend, "client", limit) for _ in range(3)] == [0.0, 0.0, pytest.approx(1.0)]
+
+
+def test_buckets_are_per_key(clock):
+    backend = MemoryRateLimitBackend()
+    limit = RateLimit(1, 0.1)
+    assert take(backend, "a", limit) == 0.0
+    assert take(backend, "a", limit) == pytest.approx(10.0)
+    assert take(backend, "b", limit) == 0.0
+
+
+def test_idle_buckets_are_pruned(clock):
+    backend = MemoryRateLimitBackend()
+    backend.PRUNE_EVERY = 3
+    limit = RateLimit(5, 1.0)
+    take(backend, "idle", limit)
+    clock.now += FULL_REFILL_SECONDS + 1
+    take(backend, "busy", limit)
+    assert backend.stats()["buckets"] == 2
+    take(backend, "busy", limit)
+    assert backend.stats()["buckets"] == 1
+
+
+def test_postgres_backend_lets_traffic_through_when_the_table_fails(monkeypatch):
+    async def fetch_one(query, values=None):
+        raise OSError("connection refused")
+
+    monkeypatch.setattr(admission.database, "fetch_one", fetch_one)
+    backend = PostgresRateLimitBackend()
+    assert take(backend, "client", RateLimit(1, 1.0)) == 0.0
+    assert take(backend, "client", RateLimit(1, 1.0)) == 0.0
+    assert backend.failing and backend.errors == 2
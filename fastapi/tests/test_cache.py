@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+import cache
+from cache import MemoryCacheBackend, TTLCache, etag_matches, load_cache_backend, make_etag
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def test_least_recently_used_entry_is_evicted_first(clock):
+    entries = TTLCache(max_entries=3, ttl_seconds=60)
+    for key in "abc":
+        entries.set(key, key.upper())
+    assert entries.get("a") == "A"  # "b" is now the oldest
+    entries.set("d", "D")
+    assert entries.get("b") is None
+    assert [entries.get(key) for key in "acd"] == ["A", "C", "D"]
+    assert len(entries) == 3
+    assert entries.stats()["evictions"] == 1
+
+
+def test_setting_an_existing_key_refreshes_it(clock):
+    entries = TTLCache(max_entries=2, ttl_seconds=60)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    entries.set("a", 3)
+    entries.set("c", 4)
+    assert entries.get("a") == 3
+    assert entries.get("b") is None
+
+
+def test_entries_expire_after_their_ttl(clock):
+    entries = TTLCache(max_entries=10, ttl_seconds=30)
+    entries.set("a", 1)
+    clock.now += 30
+    assert entries.get("a") == 1
+    clock.now += 0.001
+    assert entries.get("a") is None
+    assert len(entries) == 0
+    stats = entries.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"]) == (1, 1, 1)
+    assert stats["hit_ratio"] == 0.5
+
+
+def test_delete_and_clear(clock):
+    entries = TTLCache(max_entries=10, ttl_seconds=30)
+    entries.set(("place", 1), {"name": "x"})
+    entries.set(("place", 2), {"name": "y"})
+    entries.delete(("place", 1))
+    entries.delete(("place", 3))
+    assert entries.get(("place", 1)) is None
+    assert entries.get(("place", 2)) == {"name": "y"}
+    entries.clear()
+    assert len(entries) == 0
+    assert entries.stats()["hit_ratio"] == 0.5
+
+
+def test_empty_stats_have_no_hit_ratio():
+    assert TTLCache(max_entries=1, ttl_seconds=1).stats()["hit_ratio"] is None
+
+
+def test_etag_matches():
+    etag = make_etag(b'{"reviews": []}')
+    assert etag == make_etag(b'{"reviews": []}') != make_etag(b'{"reviews": [1]}')
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("", etag)
+
+
+def test_bump_data_version():
+    before = cache.data_version()
+    cache.bump_data_version()
+    assert cache.data_version() == before + 1
+
+
+def test_memory_backend_get_set_delete_clear():
+    async def scenario():
+        backend = MemoryCacheBackend(max_entries=10, ttl_seconds=60)
+        await backend.set(("user", 1), {"user_id": 1})
+        await backend.set(("user_email", "a@example.com"), {"user_id": 1})
+        await backend.set(("place", 5), {"place_id": 5})
+        assert await backend.get(("user", 1)) == {"user_id": 1}
+        await backend.delete(("user", 1), ("user_email", "a@example.com"), ("user", 2))
+        assert await backend.get(("user", 1)) is None
+        assert await backend.get(("user_email", "a@example.com")) is None
+        assert await backend.get(("place", 5)) == {"place_id": 5}
+        await backend.clear()
+        assert await backend.get(("place", 5)) is None
+        return backend.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["backend"] == "memory"
+    assert (stats["hits"], stats["misses"]) == (2, 3)
+
+
+def test_load_cache_backend():
+    assert isinstance(load_cache_backend("memory"), MemoryCacheBackend)
+    assert isinstance(load_cache_backend("cache:MemoryCacheBackend"), MemoryCacheBackend)
+    with pytest.raises(ModuleNotFoundError):
+        load_cache_backend("no_such_module:Backend")
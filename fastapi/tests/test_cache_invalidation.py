@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+import cache
+import database
+from cache import MemoryCacheBackend
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    """Two workers' entity caches and the NOTIFY payloads sent between them."""
+    sender, receiver = MemoryCacheBackend(), MemoryCacheBackend()
+    sent = []
+
+    async def execute(query, values=None):
+        assert values["channel"] == database.CACHE_INVALIDATION_CHANNEL
+        sent.append(values["payload"])
+
+    monkeypatch.setattr(database.database, "execute", execute)
+    monkeypatch.setattr(cache, "entity_cache", sender)
+    return sender, receiver, sent
+
+
+async def fill(backend, keys):
+    for key in keys:
+        await backend.set(key, {"cached": True})
+
+
+KEYS = [
+    ("user", 7),
+    ("user_email", "name@example.com"),
+    ("place", 3),
+    database._place_location_key(13.7563, 100.5018),
+    database._place_location_key("-0.5", 179.999999),
+]
+
+
+def test_invalidated_keys_reach_other_workers(workers, monkeypatch):
+    sender, receiver, sent = workers
+
+    async def scenario():
+        await fill(sender, KEYS + [("place", 4)])
+        await fill(receiver, KEYS + [("place", 4)])
+        version = cache.data_version()
+        await database.invalidate_cache(*KEYS)
+        assert [await sender.get(key) for key in KEYS] == [None] * len(KEYS)
+        assert cache.data_version() == version + 1
+
+        monkeypatch.setattr(cache, "entity_cache", receiver)
+        await database._apply_invalidations(sent)
+        assert [await receiver.get(key) for key in KEYS] == [None] * len(KEYS)
+        assert await receiver.get(("place", 4)) == {"cached": True}
+        assert cache.data_version() == version + 2
+
+    asyncio.run(scenario())
+    assert len(sent) == 1
+
+
+def test_large_or_clear_invalidations_clear_everything(workers, monkeypatch):
+    sender, receiver, sent = workers
+    many = [("user_email", f"user{index}@example.com") for index in range(1000)]
+
+    async def scenario():
+        await database.invalidate_cache(*many)
+        await database.invalidate_cache(clear=True)
+        await fill(receiver, KEYS)
+        monkeypatch.setattr(cache, "entity_cache", receiver)
+        for payload in sent:
+            assert len(payload) <= database.CACHE_INVALIDATION_MAX_PAYLOAD
+            await fill(receiver, KEYS)
+            await database._apply_invalidations([payload])
+            assert [await receiver.get(key) for key in KEYS] == [None] * len(KEYS)
+
+    asyncio.run(scenario())
+    assert len(sent) == 2
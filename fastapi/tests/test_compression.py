@@ -0,0 +1,33 @@
+import gzip
+import brotli
+import pytest
+from compression import choose_encoding, compress
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, None),
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("br", "br"),
+    ("gzip, deflate, br", "br"),
+    ("GZIP, BR", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("br;q=1.0, gzip;q=0.8", "br"),
+    ("br;q=0, gzip;q=0", None),
+    ("br;q=0", None),
+    ("*", "br"),
+    ("*;q=0.5, gzip", "gzip"),
+    ("gzip;q=0, *", "br"),
+    ("br;q=nonsense, gzip", "gzip"),
+    ("deflate", None),
+])
+def test_choose_encoding(accept_encoding, expected):
+    assert choose_encoding(accept_encoding) == expected
+
+
+def test_compress_round_trip():
+    body = b'{"reviews": [' + b'{"rating": 5, "text": "great"},' * 200 + b"{}]}"
+    assert gzip.decompress(compress(body, "gzip")) == body
+    assert brotli.decompress(compress(body, "br")) == body
+    assert len(compress(body, "br")) < len(body) // 10
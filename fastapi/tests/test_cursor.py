@@ -0,0 +1,30 @@
+from datetime import datetime, timezone
+import pytest
+from fastapi import HTTPException
+from routes.reviews import decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize("sort_key", ["2024-05-01T12:30:00.123456+00:00", 4.5, 1200.75, 0, None])
+def test_cursor_round_trip(sort_key):
+    assert decode_cursor(encode_cursor(sort_key, 42)) == (sort_key, 42)
+
+
+def test_datetime_sort_key_is_encoded_as_isoformat():
+    created_at = datetime(2024, 5, 1, 12, 30, 0, 123456, tzinfo=timezone.utc)
+    assert decode_cursor(encode_cursor(created_at, 7)) == (created_at.isoformat(), 7)
+
+
+def test_cursor_is_url_safe_and_unpadded():
+    # Lengths 1-3 mod 4 all need padding restored on decode
+    for review_id in (1, 12, 123, 1234, 2**31 - 1):
+        cursor = encode_cursor("é/+?" * 3, review_id)
+        assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+        assert decode_cursor(cursor) == ("é/+?" * 3, review_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", "W10", "WzEsMiwzXQ", "eyJhIjogMX0", "WyJ4IiwgInkiXQ"])
+def test_invalid_cursor_is_rejected(cursor):
+    # "", garbage, [], [1, 2, 3], {"a": 1}, ["x", "y"]
+    with pytest.raises(HTTPException) as raised:
+        decode_cursor(cursor)
+    assert raised.value.status_code == 400
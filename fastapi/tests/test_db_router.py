@@ -0,0 +1,172 @@
+import asyncio
+import pytest
+from databases import DatabaseURL
+import db_router
+from db_pool import PoolTimeout
+from db_router import READ_YOUR_WRITES_COOKIE, ReadRouter, ReadYourWritesMiddleware, reads_from_primary
+
+
+class FakeDatabase:
+    """Answers every read with its own name, or raises `error` (after `rows_before_error` rows when iterating)."""
+
+    def __init__(self, name: str, error: BaseException = None, rows_before_error: int = 0):
+        self.name = name
+        self.url = DatabaseURL(f"postgresql://user@{name}:5432/app")
+        self.error = error
+        self.rows_before_error = rows_before_error
+        self.reads = 0
+
+    async def _answer(self, *args):
+        self.reads += 1
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+    fetch_one = fetch_all = fetch_val = _answer
+
+    async def iterate(self, query, values=None):
+        self.reads += 1
+        for index in range(3):
+            if self.error is not None and index == self.rows_before_error:
+                raise self.error
+            yield (self.name, index)
+
+    def pool_stats(self) -> dict:
+        return {"in_use": 0, "waiting": 0}
+
+
+def router(*replicas: FakeDatabase) -> ReadRouter:
+    router = ReadRouter(FakeDatabase("primary"), list(replicas))
+    for replica in router.replicas:
+        replica.connected = replica.healthy = True
+    return router
+
+
+def collect(rows) -> list:
+    async def scenario():
+        return [row async for row in rows]
+    return asyncio.run(scenario())
+
+
+def test_choose_round_robins_over_healthy_replicas():
+    reads = router(FakeDatabase("a"), FakeDatabase("b"), FakeDatabase("c"))
+    reads.replicas[1].healthy = False
+    assert [reads.choose().name for _ in range(4)] == ["a:5432/app", "c:5432/app"] * 2
+
+
+def test_choose_falls_back_to_the_primary():
+    assert router().choose() is None
+    reads = router(FakeDatabase("a"))
+    reads.replicas[0].healthy = False
+    assert reads.choose() is None
+    reads.replicas[0].healthy = True
+    token = db_router._primary_only.set(True)
+    try:
+        assert reads.choose() is None
+    finally:
+        db_router._primary_only.reset(token)
+
+
+@pytest.mark.parametrize("error", [OSError("reset"), asyncio.TimeoutError(), PoolTimeout()])
+def test_replica_errors_fall_back_to_the_primary(error):
+    reads = router(FakeDatabase("a", error))
+    assert asyncio.run(reads.fetch_one("SELECT 1")) == "primary"
+    replica = reads.replicas[0]
+    assert not replica.healthy and replica.failures == 1
+    assert replica.last_error.startswith(type(error).__name__)
+    assert (reads.fallbacks, reads.primary_reads) == (1, 1)
+    # Out of rotation until a check passes
+    assert asyncio.run(reads.fetch_val("SELECT 1")) == "primary"
+    assert reads.fallbacks == 1
+
+
+def test_query_errors_are_not_retried_on_the_primary():
+    reads = router(FakeDatabase("a", ValueError("bad query")))
+    with pytest.raises(ValueError):
+        asyncio.run(reads.fetch_all("SELECT nonsense"))
+    assert reads.replicas[0].healthy and reads.primary_reads == 0
+
+
+def test_healthy_replica_serves_reads():
+    reads = router(FakeDatabase("a"))
+    assert asyncio.run(reads.fetch_all("SELECT 1")) == "a"
+    assert reads.replicas[0].reads == 1 and reads.primary_reads == 0
+
+
+def test_iterate_falls_back_before_any_row_is_sent():
+    reads = router(FakeDatabase("a", OSError("reset"), rows_before_error=0))
+    assert collect(reads.iterate("SELECT 1")) == [("primary", 0), ("primary", 1), ("primary", 2)]
+    assert not reads.replicas[0].healthy and reads.fallbacks == 1
+
+
+def test_iterate_reraises_once_rows_were_sent():
+    reads = router(FakeDatabase("a", OSError("reset"), rows_before_error=2))
+    seen = []
+
+    async def scenario():
+        async for row in reads.iterate("SELECT 1"):
+            seen.append(row)
+
+    with pytest.raises(OSError):
+        asyncio.run(scenario())
+    assert seen == [("a", 0), ("a", 1)]
+    assert not reads.replicas[0].healthy
+    assert (reads.fallbacks, reads.primary_reads) == (0, 0)
+
+
+def scope_with(*cookies: bytes) -> dict:
+    return {"type": "http", "method": "GET", "headers": [(b"cookie", cookie) for cookie in cookies]}
+
+
+@pytest.mark.parametrize("cookies, pinned", [
+    ((), False),
+    ((b"session=abc",), False),
+    ((f"{READ_YOUR_WRITES_COOKIE}=1005".encode(),), True),
+    ((f"{READ_YOUR_WRITES_COOKIE}=1000".encode(),), False),
+    ((f"{READ_YOUR_WRITES_COOKIE}=999.5".encode(),), False),
+    ((f"access_token=x; {READ_YOUR_WRITES_COOKIE}=1005; theme=dark".encode(),), True),
+    ((b"theme=dark", f"{READ_YOUR_WRITES_COOKIE}=1005".encode()), True),
+    ((f"x{READ_YOUR_WRITES_COOKIE}=1005".encode(),), False),
+    ((f"{READ_YOUR_WRITES_COOKIE}=soon".encode(),), False),
+    ((f"{READ_YOUR_WRITES_COOKIE}=".encode(),), False),
+    ((f"{READ_YOUR_WRITES_COOKIE}".encode(),), False),
+])
+def test_pinned_cookie_parsing(cookies, pinned):
+    assert ReadYourWritesMiddleware._pinned(scope_with(*cookies), now=1000.0) is pinned
+
+
+def test_pinned_ignores_other_headers():
+    scope = {"headers": [(b"x-cookie", f"{READ_YOUR_WRITES_COOKIE}=2000".encode())]}
+    assert ReadYourWritesMiddleware._pinned(scope, now=1000.0) is False
+
+
+def run_middleware(method: str, cookie: bytes = None) -> tuple:
+    seen = {}
+
+    async def app(scope, receive, send):
+        seen["primary"] = reads_from_primary()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "headers": [(b"cookie", cookie)] if cookie else []}
+    asyncio.run(ReadYourWritesMiddleware(app)(scope, None, send))
+    cookies = [value for name, value in sent[0]["headers"] if name == b"set-cookie"]
+    return seen["primary"], cookies
+
+
+def test_writes_pin_reads_and_set_the_cookie(monkeypatch):
+    monkeypatch.setattr(db_router, "DATABASE_REPLICA_URLS", ["postgresql://replica/app"])
+    primary, cookies = run_middleware("POST")
+    assert primary and len(cookies) == 1 and cookies[0].startswith(READ_YOUR_WRITES_COOKIE.encode() + b"=")
+    assert run_middleware("GET") == (False, [])
+    assert run_middleware("GET", cookies[0].split(b";")[0]) == (True, [])
+    assert not reads_from_primary()
+
+
+def test_nothing_is_pinned_without_replicas(monkeypatch):
+    monkeypatch.setattr(db_router, "DATABASE_REPLICA_URLS", [])
+    assert run_middleware("POST") == (False, [])
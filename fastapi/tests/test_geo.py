@@ -0,0 +1,100 @@
+import math
+import random
+import pytest
+from geo import (
+    EARTH_RADIUS_M, cell_size_degrees, covering_cells, geohash_encode, haversine_m, precision_for_radius,
+    precision_for_zoom,
+)
+
+
+def destination(latitude: float, longitude: float, bearing: float, distance_m: float) -> tuple:
+    """The point distance_m from (latitude, longitude) along `bearing` radians."""
+    phi1, lambda1 = math.radians(latitude), math.radians(longitude)
+    delta = distance_m / EARTH_RADIUS_M
+    phi2 = math.asin(math.sin(phi1) * math.cos(delta) + math.cos(phi1) * math.sin(delta) * math.cos(bearing))
+    lambda2 = lambda1 + math.atan2(math.sin(bearing) * math.sin(delta) * math.cos(phi1),
+                                   math.cos(delta) - math.sin(phi1) * math.sin(phi2))
+    return math.degrees(phi2), (math.degrees(lambda2) + 540.0) % 360.0 - 180.0
+
+
+def test_geohash_known_values():
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geohash_encode(42.6, -5.6, 5) == "ezs42"
+    assert geohash_encode(0.0, 0.0, 1) == "s"
+
+
+def test_geohash_prefixes_nest():
+    full = geohash_encode(-33.8688, 151.2093)
+    for precision in range(1, len(full)):
+        assert geohash_encode(-33.8688, 151.2093, precision) == full[:precision]
+
+
+def test_cell_size_halves_alternately():
+    assert cell_size_degrees(1) == (45.0, 45.0)
+    assert cell_size_degrees(2) == (45.0 / 8, 45.0 / 4)
+    lat_deg, lng_deg = cell_size_degrees(9)
+    assert lat_deg == pytest.approx(180.0 / 2**22) and lng_deg == pytest.approx(360.0 / 2**23)
+
+
+def test_haversine_known_distances():
+    assert haversine_m(51.5074, -0.1278, 48.8566, 2.3522) == pytest.approx(343_560, rel=1e-3)  # London-Paris
+    assert haversine_m(0.0, 0.0, 0.0, 180.0) == pytest.approx(math.pi * EARTH_RADIUS_M)
+    assert haversine_m(90.0, 0.0, -90.0, 0.0) == pytest.approx(math.pi * EARTH_RADIUS_M)
+    assert haversine_m(13.75, 100.5, 13.75, 100.5) == 0.0
+
+
+def test_haversine_is_symmetric_and_wraps_the_antimeridian():
+    assert haversine_m(10.0, 179.9, 10.0, -179.9) == haversine_m(10.0, -179.9, 10.0, 179.9)
+    assert haversine_m(10.0, 179.9, 10.0, -179.9) == pytest.approx(haversine_m(10.0, -0.1, 10.0, 0.1))
+
+
+@pytest.mark.parametrize("latitude", [0.0, 13.75, -45.0, 70.0])
+def test_precision_for_radius_cells_are_large_enough(latitude):
+    cos_lat = math.cos(math.radians(latitude))
+    for radius_m in (10, 100, 1_000, 5_000, 50_000):
+        precision = precision_for_radius(radius_m, latitude)
+        lat_deg, lng_deg = cell_size_degrees(precision)
+        if precision > 1:
+            assert lat_deg * 111320.0 >= radius_m
+            assert lng_deg * 111320.0 * cos_lat >= radius_m
+        if precision < 9:
+            # The next precision would be too small in one direction
+            lat_deg, lng_deg = cell_size_degrees(precision + 1)
+            assert min(lat_deg * 111320.0, lng_deg * 111320.0 * cos_lat) < radius_m
+
+
+@pytest.mark.parametrize("latitude, longitude", [
+    (13.7563, 100.5018), (0.0, 0.0), (-33.8688, 151.2093), (64.1466, -21.9426), (10.0, 179.999), (-10.0, -179.999),
+])
+def test_covering_cells_contain_every_point_in_the_circle(latitude, longitude):
+    rng = random.Random(f"{latitude},{longitude}")
+    for radius_m in (50, 500, 2_000, 20_000):
+        cells = covering_cells(latitude, longitude, radius_m)
+        assert len(cells) == 9
+        precision = len(cells[0])
+        for _ in range(300):
+            point = destination(latitude, longitude, rng.uniform(0, 2 * math.pi), rng.uniform(0, radius_m))
+            assert haversine_m(latitude, longitude, *point) <= radius_m + 1e-6
+            assert geohash_encode(*point, precision) in cells
+
+
+def test_covering_cells_near_a_pole_keep_nine_entries():
+    cells = covering_cells(89.9999, 45.0, 1_000)
+    assert len(cells) == 9
+    assert geohash_encode(89.9999, 45.0, len(cells[0])) in cells
+
+
+def test_precision_for_zoom_gives_at_least_the_requested_cells_per_tile():
+    previous = 1
+    for zoom in range(0, 21):
+        precision = precision_for_zoom(zoom)
+        assert precision >= previous  # deeper zooms never get coarser cells
+        previous = precision
+        tile_lng_deg = 360.0 / 2**zoom
+        _, lng_deg = cell_size_degrees(precision)
+        if precision > 1:  # precision 1 is the floor even when its cells are narrower
+            assert lng_deg >= tile_lng_deg / 4
+        if precision < 9:
+            assert cell_size_degrees(precision + 1)[1] < tile_lng_deg / 4
+    assert precision_for_zoom(0) == 1
+    assert precision_for_zoom(16) == 7  # 1.4e-3 degree cells, a quarter of a zoom 16 tile
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import pytest
+import jobs
+from jobs import COMPLETE_JOB, FAIL_JOB, JOB_RETRY_BASE_SECONDS, JOB_RETRY_MAX_SECONDS, RELEASE_JOB, JobQueue, retry_delay
+
+
+class FakeDatabase:
+    def __init__(self, fail_status="queued"):
+        self.fail_status = fail_status
+        self.calls = []
+
+    async def execute(self, query, values=None):
+        self.calls.append((query, values))
+
+    async def fetch_val(self, query, values=None):
+        self.calls.append((query, values))
+        return self.fail_status
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(jobs, "database", db)
+    return db
+
+
+def job(kind="work", attempts=1, payload=None):
+    return {"job_id": 17, "kind": kind, "payload": json.dumps(payload or {"n": 1}),
+            "attempts": attempts, "max_attempts": 5, "waited": 0.25}
+
+
+def test_retry_delay_doubles_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(jobs.random, "uniform", lambda low, high: high)
+    assert [retry_delay(attempts) for attempts in (1, 2, 3)] == [
+        JOB_RETRY_BASE_SECONDS, 2 * JOB_RETRY_BASE_SECONDS, 4 * JOB_RETRY_BASE_SECONDS,
+    ]
+    assert retry_delay(40) == JOB_RETRY_MAX_SECONDS
+    monkeypatch.setattr(jobs.random, "uniform", lambda low, high: low)
+    assert retry_delay(40) == JOB_RETRY_MAX_SECONDS / 2
+
+
+def test_retry_delay_jitter_stays_in_range():
+    for attempts in range(1, 20):
+        ceiling = min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS)
+        for _ in range(50):
+            assert ceiling / 2 <= retry_delay(attempts) <= ceiling
+
+
+def test_successful_job_is_completed(db):
+    seen = []
+
+    async def handler(payload):
+        seen.append(payload)
+
+    queue = JobQueue({"work": handler})
+    asyncio.run(queue._run(job()))
+    assert seen == [{"n": 1}]
+    assert db.calls == [(COMPLETE_JOB, {"job_id": 17})]
+    assert (queue.completed, queue.retried, queue.failed, queue.running) == (1, 0, 0, 0)
+
+
+def test_failing_job_is_scheduled_for_retry(db, monkeypatch):
+    monkeypatch.setattr(jobs, "retry_delay", lambda attempts: attempts * 100.0)
+
+    async def handler(payload):
+        raise OSError("disk full")
+
+    queue = JobQueue({"work": handler})
+    asyncio.run(queue._run(job(attempts=2)))
+    assert db.calls == [(FAIL_JOB, {"job_id": 17, "delay": 200.0, "error": "OSError: disk full"})]
+    assert (queue.completed, queue.retried, queue.failed, queue.running) == (0, 1, 0, 0)
+
+
+def test_job_out_of_attempts_counts_as_failed(db):
+    db.fail_status = "failed"
+
+    async def handler(payload):
+        raise ValueError("bad payload")
+
+    queue = JobQueue({"work": handler})
+    asyncio.run(queue._run(job(attempts=5)))
+    assert [query for query, _ in db.calls] == [FAIL_JOB]
+    assert (queue.retried, queue.failed) == (0, 1)
+
+
+def test_unknown_kind_goes_down_the_failure_path(db):
+    queue = JobQueue({})
+    asyncio.run(queue._run(job(kind="mystery")))
+    [(query, values)] = db.calls
+    assert query == FAIL_JOB
+    assert values["error"] == "LookupError: No handler for job kind 'mystery'"
+    assert queue.retried == 1 and queue.running == 0
+
+
+def test_cancelled_job_is_released(db):
+    async def scenario():
+        running = asyncio.Event()
+
+        async def handler(payload):
+            running.set()
+            await asyncio.Event().wait()
+
+        queue = JobQueue({"work": handler})
+        task = asyncio.create_task(queue._run(job()))
+        await running.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert db.calls == [(RELEASE_JOB, {"job_id": 17})]
+    assert (queue.completed, queue.retried, queue.failed, queue.running) == (0, 0, 0, 0)
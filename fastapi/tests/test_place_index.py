@@ -0,0 +1,115 @@
+import asyncio
+import random
+import pytest
+from geo import haversine_m
+from place_index import IndexedPlace, PlaceIndex
+
+CENTERS = [(13.7563, 100.5018), (0.0, 0.0), (-33.87, 151.21), (64.15, -21.94), (5.0, 179.995), (89.97, 10.0)]
+
+
+def random_places(rng: random.Random, count: int) -> list:
+    places = []
+    for place_id in range(1, count + 1):
+        latitude, longitude = rng.choice(CENTERS)
+        latitude = max(min(latitude + rng.uniform(-0.2, 0.2), 90.0), -90.0)
+        longitude = (longitude + rng.uniform(-0.2, 0.2) + 180.0) % 360.0 - 180.0
+        review_count = rng.randrange(0, 40)
+        avg_rating = round(rng.uniform(1, 5), 2) if review_count else None
+        places.append(IndexedPlace(place_id, f"place {place_id}", latitude, longitude, review_count, avg_rating))
+    return places
+
+
+def build(places: list, cell_degrees: float = 0.01) -> PlaceIndex:
+    index = PlaceIndex(lambda: None, cell_degrees)
+    for place in places:
+        index.upsert(place)
+    return index
+
+
+def brute_force(places, latitude, longitude, radius_m, min_reviews):
+    found = []
+    for place in places:
+        distance = haversine_m(latitude, longitude, place.latitude, place.longitude)
+        if distance <= radius_m and place.review_count >= min_reviews:
+            found.append((distance, place))
+    return found
+
+
+@pytest.fixture(scope="module")
+def places():
+    return random_places(random.Random(22), 3000)
+
+
+@pytest.mark.parametrize("cell_degrees", [0.01, 0.05])
+def test_nearest_matches_brute_force(places, cell_degrees):
+    index = build(places, cell_degrees)
+    rng = random.Random(1)
+    for _ in range(200):
+        latitude, longitude = rng.choice(CENTERS)
+        latitude = min(latitude + rng.uniform(-0.1, 0.1), 90.0)
+        longitude = (longitude + rng.uniform(-0.1, 0.1) + 180.0) % 360.0 - 180.0
+        k = rng.choice([1, 5, 20])
+        radius_m = rng.choice([200, 2_000, 10_000, 100_000])
+        min_reviews = rng.choice([0, 0, 10])
+        expected = sorted(brute_force(places, latitude, longitude, radius_m, min_reviews),
+                          key=lambda pair: pair[0])[:k]
+        found = index.nearest(latitude, longitude, k, radius_m, min_reviews)
+        assert [place.place_id for _, place in found] == [place.place_id for _, place in expected]
+        assert [distance for distance, _ in found] == pytest.approx([distance for distance, _ in expected])
+
+
+def test_top_rated_matches_brute_force(places):
+    index = build(places)
+    rng = random.Random(2)
+    for _ in range(100):
+        latitude, longitude = rng.choice(CENTERS)
+        radius_m = rng.choice([1_000, 10_000, 30_000])
+        half_distance_m = rng.choice([500.0, 5_000.0])
+        expected = sorted(
+            ((place.weighted_rating() * 0.5 ** (distance / half_distance_m), distance, place)
+             for distance, place in brute_force(places, latitude, longitude, radius_m, 0)),
+            key=lambda entry: (-entry[0], entry[1]),
+        )[:10]
+        found = index.top_rated(latitude, longitude, 10, radius_m, half_distance_m)
+        assert [place.place_id for _, _, place in found] == [place.place_id for _, _, place in expected]
+
+
+def test_upsert_moves_and_updates_places():
+    index = build([IndexedPlace(1, "cafe", 13.75, 100.50, 2, 4.0)])
+    index.upsert(IndexedPlace(1, "cafe", 13.80, 100.60, 3, 4.5))
+    assert index.nearest(13.75, 100.50, 5, 1_000) == []
+    [(distance, place)] = index.nearest(13.80, 100.60, 5, 1_000)
+    assert distance == pytest.approx(0.0, abs=1e-6)
+    assert (place.review_count, place.avg_rating) == (3, 4.5)
+    assert index.stats()["places"] == 1 and index.stats()["cells"] == 1
+
+
+def test_weighted_rating_is_pulled_towards_the_prior():
+    assert IndexedPlace(1, "new", 0, 0, 0, None).weighted_rating() == 3.0
+    assert IndexedPlace(1, "one", 0, 0, 1, 5.0).weighted_rating() == pytest.approx((5 + 15) / 6)
+    many = IndexedPlace(1, "many", 0, 0, 1000, 5.0).weighted_rating()
+    assert 4.95 < many < 5.0
+
+
+def test_reload_keeps_updates_that_arrive_while_loading():
+    rows = [{"place_id": 1, "name": "a", "latitude": "13.750000", "longitude": "100.500000",
+             "review_count": 1, "avg_rating": 3.0}]
+
+    async def scenario():
+        index = None
+
+        async def load():
+            # An update applied while the rows are being read must survive the swap
+            index.upsert(IndexedPlace(1, "a", 13.75, 100.5, 2, 4.0))
+            index.upsert(IndexedPlace(2, "b", 13.76, 100.5, 1, 5.0))
+            return rows
+
+        index = PlaceIndex(load)
+        await index.reload()
+        return index
+
+    index = asyncio.run(scenario())
+    assert index.loaded
+    found = {place.place_id: place for _, place in index.nearest(13.75, 100.5, 10, 5_000)}
+    assert sorted(found) == [1, 2]
+    assert found[1].review_count == 2
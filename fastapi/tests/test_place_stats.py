@@ -0,0 +1,59 @@
+import random
+import uuid
+from database import add_review_at_location, database as db, delete_user, get_place, insert_user
+from place_stats import CHECK_QUERY
+
+
+async def mismatches(place_ids: list) -> list:
+    rows = await db.fetch_all(f"SELECT * FROM ({CHECK_QUERY}) c WHERE place_id = ANY(:place_ids)",
+                              values={"place_ids": place_ids})
+    return [dict(row._mapping) for row in rows]
+
+
+async def stats(place_id: int) -> tuple:
+    place = await get_place(place_id)
+    return place["review_count"], place["rating_sum"], place["avg_rating"], place["rating_5"]
+
+
+def test_stats_follow_review_inserts_and_user_deletion(with_database):
+    async def scenario():
+        suffix = uuid.uuid4().hex[:12]
+        users, place_ids = [], set()
+        # Far from seeded data and from other runs
+        latitude, longitude = random.uniform(-60, -50), random.uniform(-170, -160)
+        try:
+            for name in ("stats_a", "stats_b"):
+                user = await insert_user(f"{name}_{suffix}", "x", f"{name}_{suffix}@example.com")
+                users.append(user["user_id"])
+            first, second = users
+
+            async def review(user_id: int, rating: int, offset: float) -> int:
+                row = await add_review_at_location(
+                    user_id=user_id, rating=rating, comment="stats test", place_name="Stats test",
+                    address="nowhere", latitude=latitude + offset, longitude=longitude,
+                )
+                place_ids.add(row["place_id"])
+                return row["place_id"]
+
+            shared = await review(first, 5, 0.0)
+            await review(first, 3, 0.0)
+            await review(second, 1, 0.0)
+            only_first = await review(first, 4, 0.001)
+
+            assert await stats(shared) == (3, 9, 3.0, 1)
+            assert await stats(only_first) == (1, 4, 4.0, 0)
+            assert await mismatches(list(place_ids)) == []
+
+            assert (await delete_user(first))["user_id"] == first
+            users.remove(first)
+            assert await stats(shared) == (1, 1, 1.0, 0)
+            assert await stats(only_first) == (0, 0, None, 0)
+            assert await mismatches(list(place_ids)) == []
+        finally:
+            for user_id in users:
+                await delete_user(user_id)
+            if place_ids:
+                await db.execute("DELETE FROM places WHERE place_id = ANY(:place_ids)",
+                                 values={"place_ids": list(place_ids)})
+
+    with_database(scenario)
@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+import cache
+import database
+from cache import MemoryCacheBackend
+
+
+class FakeDatabase:
+    """Answers fetch_one from a list of rows (None: the place was not visible) and records NOTIFYs."""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.queries = []
+        self.notified = []
+
+    async def fetch_one(self, query, values=None):
+        self.queries.append((query, values))
+        return self.rows.pop(0)
+
+    async def execute(self, query, values=None):
+        self.notified.append(values)
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    def install(*rows):
+        fake = FakeDatabase(rows)
+        monkeypatch.setattr(database.database, "fetch_one", fake.fetch_one)
+        monkeypatch.setattr(database.database, "execute", fake.execute)
+        return fake
+    monkeypatch.setattr(cache, "entity_cache", MemoryCacheBackend())
+    return install
+
+
+def place_row(place_created: bool) -> dict:
+    return {"place_id": 9, "name": "cafe", "latitude": 13.75, "longitude": 100.5, "place_created": place_created}
+
+
+def review_row(place_created: bool) -> dict:
+    return {"review_id": 1, "place_id": 9, "user_id": 3, "place_created": place_created}
+
+
+def get_or_create():
+    return asyncio.run(database.get_or_create_place("cafe", "street", 13.7563, 100.5018))
+
+
+def add_review():
+    return asyncio.run(database.add_review_at_location(
+        user_id=3, rating=5, comment="good", place_name="cafe", address="street", latitude=13.7563, longitude=100.5018,
+    ))
+
+
+def test_existing_place_is_read_in_one_statement_without_invalidation(fake):
+    db = fake(place_row(False))
+    assert get_or_create()["place_id"] == 9
+    assert len(db.queries) == 1
+    query, values = db.queries[0]
+    assert "ON CONFLICT (latitude, longitude) DO NOTHING" in query and "DO UPDATE" not in query
+    assert values["geohash"] == database.geohash_encode(13.7563, 100.5018)
+    assert db.notified == []
+
+
+def test_created_place_is_invalidated_in_every_worker(fake):
+    db = fake(place_row(True))
+    version = cache.data_version()
+    assert get_or_create()["place_created"]
+    assert [values["channel"] for values in db.notified] == [database.CACHE_INVALIDATION_CHANNEL]
+    assert cache.data_version() == version + 1
+
+
+def test_place_missed_by_the_snapshot_is_retried(fake):
+    # The first statement loses the insert race and cannot see the winner's row yet
+    db = fake(None, place_row(False))
+    assert get_or_create()["place_id"] == 9
+    assert len(db.queries) == database.PLACE_UPSERT_ATTEMPTS == 2
+    assert db.queries[0] == db.queries[1]
+
+
+def test_place_missed_by_every_attempt_raises(fake):
+    db = fake(*[None] * database.PLACE_UPSERT_ATTEMPTS)
+    with pytest.raises(RuntimeError, match="No place at"):
+        get_or_create()
+    assert len(db.queries) == database.PLACE_UPSERT_ATTEMPTS
+    assert db.notified == []
+
+
+def test_review_insert_is_retried_and_drops_the_cached_place(fake):
+    db = fake(None, review_row(True))
+    asyncio.run(cache.entity_cache.set(("place", 9), {"place_id": 9, "review_count": 0}))
+    version = cache.data_version()
+    assert add_review()["review_id"] == 1
+    assert len(db.queries) == 2
+    assert asyncio.run(cache.entity_cache.get(("place", 9))) is None
+    assert cache.data_version() == version + 1
+
+
+def test_review_insert_missing_its_place_every_attempt_raises(fake):
+    db = fake(*[None] * database.PLACE_UPSERT_ATTEMPTS)
+    version = cache.data_version()
+    with pytest.raises(RuntimeError, match="No place at"):
+        add_review()
+    assert len(db.queries) == database.PLACE_UPSERT_ATTEMPTS
+    assert cache.data_version() == version
@@ -0,0 +1,136 @@
+import asyncio
+import random
+import uuid
+import pytest
+from fastapi import HTTPException
+import routes.reviews as reviews
+from database import add_review_at_location, database, delete_user, insert_user
+from routes.reviews import SEARCH_MAX_CANDIDATES, decode_cursor, encode_cursor
+
+
+class FakeReads:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    async def fetch_all(self, query, values=None):
+        self.calls.append((query, values))
+        return self.rows
+
+
+@pytest.fixture(autouse=True)
+def uncached(monkeypatch):
+    async def cached_json_response(request, key, build, **kwargs):
+        return await build()
+    monkeypatch.setattr(reviews, "cached_json_response", cached_json_response)
+
+
+def search(q="coffee", latitude=None, longitude=None, radius_m=1000.0, limit=2, cursor=None):
+    return asyncio.run(reviews.search_reviews(
+        None, q=q, latitude=latitude, longitude=longitude, radius_m=radius_m, limit=limit, cursor=cursor,
+    ))
+
+
+def fake_reads(monkeypatch, rows=()):
+    reads = FakeReads(list(rows))
+    monkeypatch.setattr(reviews, "read_database", reads)
+    monkeypatch.setattr(reviews, "row_to_dict", dict)
+    return reads
+
+
+@pytest.mark.parametrize("rank", [0.1, 0.10000000149011612, 1e-20, 0.0, 3.0])
+def test_rank_cursor_round_trip(rank):
+    # float4 ranks come back as doubles like 0.10000000149011612 and must survive exactly
+    assert decode_cursor(encode_cursor(rank, 99)) == (rank, 99)
+
+
+def test_search_without_location_or_cursor(monkeypatch):
+    reads = fake_reads(monkeypatch)
+    assert search() == {"reviews": [], "next_cursor": None}
+    [(query, values)] = reads.calls
+    assert values == {"q": "coffee", "max_candidates": SEARCH_MAX_CANDIDATES, "limit": 3}
+    assert "nearby" not in query and "{" not in query
+    assert "LIMIT :max_candidates" in query
+    assert "ORDER BY m.rank DESC, m.review_id DESC" in query
+    assert "(m.rank, m.review_id) <" not in query
+
+
+def test_search_with_location_filters_candidates_to_nearby_places(monkeypatch):
+    reads = fake_reads(monkeypatch)
+    search(latitude=13.75, longitude=100.5, radius_m=500.0)
+    [(query, values)] = reads.calls
+    assert query.startswith("\nWITH nearby AS (")
+    # Filtered inside the candidate window, before LIMIT :max_candidates
+    location = query.index("AND r.place_id IN (SELECT place_id FROM nearby WHERE distance_m <= :radius_m)")
+    assert location < query.index("LIMIT :max_candidates")
+    assert values["radius_m"] == 500.0 and values["latitude"] == 13.75
+    assert [values[f"cell{i}"] + "~" for i in range(9)] == [values[f"cell{i}_end"] for i in range(9)]
+
+
+def test_full_page_returns_a_cursor_at_its_last_row(monkeypatch):
+    rows = [{"review_id": 30, "rank": 0.5}, {"review_id": 20, "rank": 0.10000000149011612},
+            {"review_id": 10, "rank": 0.1}]
+    fake_reads(monkeypatch, rows)
+    page = search(limit=2)
+    assert [row["review_id"] for row in page["reviews"]] == [30, 20]
+    assert decode_cursor(page["next_cursor"]) == (0.10000000149011612, 20)
+
+
+def test_cursor_filter_is_bound_from_the_cursor(monkeypatch):
+    reads = fake_reads(monkeypatch)
+    search(cursor=encode_cursor(0.25, 41))
+    [(query, values)] = reads.calls
+    assert "WHERE (m.rank, m.review_id) < (CAST(:cursor_rank AS real), :cursor_review_id)" in query
+    assert (values["cursor_rank"], values["cursor_review_id"]) == (0.25, 41)
+
+
+@pytest.mark.parametrize("cursor", ["garbage", encode_cursor("2024-01-01T00:00:00", 3), encode_cursor(None, 3)])
+def test_cursor_without_a_numeric_rank_is_rejected(monkeypatch, cursor):
+    reads = fake_reads(monkeypatch)
+    with pytest.raises(HTTPException) as raised:
+        search(cursor=cursor)
+    assert raised.value.status_code == 400
+    assert reads.calls == []
+
+
+def test_search_pages_through_the_newest_candidates(with_database, monkeypatch):
+    # Equal comments rank equally, so paging relies on the float4 cursor comparison
+    monkeypatch.setattr(reviews, "SEARCH_MAX_CANDIDATES", 4)
+    word = "zq" + uuid.uuid4().hex[:10]
+    latitude, longitude = random.uniform(50, 60), random.uniform(160, 170)
+
+    async def scenario():
+        user = await insert_user(f"search_{word}", "x", f"search_{word}@example.com")
+        place_ids = set()
+        try:
+            review_ids = []
+            for index in range(6):
+                # The last two are about 11km away from the first four
+                row = await add_review_at_location(
+                    user_id=user["user_id"], rating=4, comment=f"{word} review", place_name="Search test",
+                    address="nowhere", latitude=latitude + (0.1 if index >= 4 else 0.0), longitude=longitude,
+                )
+                review_ids.append(row["review_id"])
+                place_ids.add(row["place_id"])
+
+            async def pages(**location) -> list:
+                found, cursor = [], None
+                while True:
+                    page = await reviews.search_reviews(
+                        None, q=word, radius_m=1000.0, limit=1, cursor=cursor,
+                        **{"latitude": None, "longitude": None, **location},
+                    )
+                    found += [review["review_id"] for review in page["reviews"]]
+                    cursor = page["next_cursor"]
+                    if cursor is None:
+                        return found
+
+            # Only the newest SEARCH_MAX_CANDIDATES matches are ranked
+            assert await pages() == sorted(review_ids, reverse=True)[:4]
+            assert await pages(latitude=latitude, longitude=longitude) == sorted(review_ids[:4], reverse=True)
+        finally:
+            await delete_user(user["user_id"])
+            await database.execute("DELETE FROM places WHERE place_id = ANY(:place_ids)",
+                                   values={"place_ids": list(place_ids)})
+
+    with_database(scenario)
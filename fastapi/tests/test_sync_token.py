@@ -0,0 +1,45 @@
+import itertools
+import pytest
+import sync
+from sync import CHANGE_KINDS, change_key_values, decode_sync_token, encode_sync_token, token_expired
+
+
+@pytest.mark.parametrize("xid, kind, entity_id", [(0, 0, 0), (1, 2, 3), (2**63 + 5, 5, 2**31 - 1)])
+def test_sync_token_round_trip(xid, kind, entity_id):
+    token = encode_sync_token(xid, kind, entity_id, issued_at=1_700_000_000.9)
+    assert decode_sync_token(token) == (xid, kind, entity_id, 1_700_000_000.0)
+    assert "=" not in token
+
+
+def test_sync_token_is_stamped_with_the_current_time(monkeypatch):
+    monkeypatch.setattr(sync.time, "time", lambda: 1_700_000_123.5)
+    assert decode_sync_token(encode_sync_token(10))[3] == 1_700_000_123.0
+
+
+@pytest.mark.parametrize("token", ["", "garbage!", "W10", "WzEsMiwzXQ", "WyJ4IiwxLDIsM10", "eyJhIjoxfQ"])
+def test_malformed_sync_tokens_raise_value_error(token):
+    # "", garbage, [], [1, 2, 3], ["x", 1, 2, 3], {"a": 1}
+    with pytest.raises(ValueError):
+        decode_sync_token(token)
+
+
+def test_token_expires_before_its_tombstones_are_pruned(monkeypatch):
+    now = 1_700_000_000.0
+    monkeypatch.setattr(sync.time, "time", lambda: now)
+    usable = sync.SYNC_RETENTION_DAYS * 86400 - sync.SYNC_TOKEN_SAFETY_SECONDS
+    assert not token_expired(now)
+    assert not token_expired(now - usable)
+    assert token_expired(now - usable - 1)
+
+
+def test_change_key_values_match_stream_order():
+    # For every kind, (change_xid, id) > (xid, after_kind) must pick out exactly the
+    # changes after the token in (change_xid, kind, id) order
+    xids, ids = range(3, 6), range(0, 4)
+    for xid, kind, entity_id in itertools.product((4,), [0, *CHANGE_KINDS], ids):
+        values = change_key_values(xid, kind, entity_id)
+        assert values["xid"] == "4"
+        for change in itertools.product(xids, CHANGE_KINDS, ids):
+            change_xid, change_kind, change_id = change
+            selected = (change_xid, change_id) > (xid, values[f"after_{change_kind}"])
+            assert selected == (change > (xid, kind, entity_id)), (kind, entity_id, change)
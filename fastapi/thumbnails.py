@@ -0,0 +1,103 @@
+# thumbnails.py
+# Fixed-size derivatives of stored review images.
+# Rendering is CPU bound, so it runs in a process pool. Results are cached on disk
+# under uploads/derived/<size>/ (paths and sizes are in storage.py, whose gc removes
+# them with their original). New uploads are rendered by a background job
+# (render_derivatives); anything missing is regenerated on demand.
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import aiofiles.os
+from PIL import Image, ImageOps
+from storage import DERIVATIVE_SIZES, IMAGE_EXTENSIONS, content_path, derivative_path
+
+DERIVATIVE_MEDIA_TYPE = "image/webp"
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_in_progress = {}  # derivative path -> future, so concurrent requests render once
+
+
+def derivative_urls(content_hash: Optional[str]) -> dict:
+    """URLs for review payloads, relative like image_path."""
+    if not content_hash:
+        return {"thumbnail_url": None, "medium_url": None}
+    return {
+        "thumbnail_url": f"api/images/{content_hash}/thumb",
+        "medium_url": f"api/images/{content_hash}/medium",
+    }
+
+
+def _render(source_path: str, dest_path: str, max_edge: int) -> None:
+    # Runs in a worker process
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+        image.save(tmp_path, "WEBP", quality=80, method=4)
+    os.replace(tmp_path, dest_path)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _pool
+
+
+async def find_original(content_hash: str) -> Optional[str]:
+    for extension in IMAGE_EXTENSIONS:
+        path = content_path(content_hash, extension)
+        if await aiofiles.os.path.exists(path):
+            return path
+    return None
+
+
+async def ensure_derivative(content_hash: str, size: str, source_path: Optional[str] = None) -> Optional[str]:
+    """Return the derivative's path, rendering it first if it is not on disk yet."""
+    path = derivative_path(content_hash, size)
+    if await aiofiles.os.path.exists(path):
+        return path
+
+    pending = _in_progress.get(path)
+    if pending is None:
+        source_path = source_path or await find_original(content_hash)
+        if source_path is None:
+            return None
+        loop = asyncio.get_running_loop()
+        pending = loop.run_in_executor(_get_pool(), _render, source_path, path, DERIVATIVE_SIZES[size])
+        _in_progress[path] = pending
+        pending.add_done_callback(lambda _: _in_progress.pop(path, None))
+    await asyncio.shield(pending)
+    return path
+
+
+async def render_derivatives(payload: dict) -> None:
+    """Job handler (jobs.py): render every derivative size for a freshly stored image.
+
+    Errors propagate so the job is retried; the image route still renders on demand
+    if a derivative is requested first.
+    """
+    content_hash = payload["content_hash"]
+    source_path = await find_original(content_hash)
+    if source_path is None:
+        # Nothing to retry: the image was deleted before the job ran
+        logger.warning("Original image %s is gone, skipping derivatives", content_hash)
+        return
+    await asyncio.gather(*(
+        ensure_derivative(content_hash, size, source_path) for size in DERIVATIVE_SIZES
+    ))
+
+
+def shutdown_thumbnail_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
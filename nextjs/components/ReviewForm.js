@@ -74,6 +74,7 @@ export default function ReviewForm({ onAddReview, selectedPosition }) {
       const response = await fetch("http://localhost:8000/api/reviews", {
         method: "POST",
         body: submitData,
+        credentials: "include",
       });
 
       if (!response.ok) {
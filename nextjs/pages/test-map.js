@@ -1,5 +1,5 @@
 "use client";
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useSearchParams } from "next/navigation";
 import {
   Container,
@@ -89,6 +89,13 @@ export default function ReviewsAndMapPage() {
   const [selectedImage, setSelectedImage] = useState(null);
   const [imagePreview, setImagePreview] = useState(null);
 
+  // Position whose reviews are listed, and whether the live feed is connected;
+  // refs because the feed's event handlers outlive any single render
+  const listedPositionRef = useRef(defaultLocation);
+  const feedOpenRef = useRef(false);
+  // Delta-sync position in /api/reviews/changes, taken just before the full load
+  const syncTokenRef = useRef(null);
+
   const [newReview, setNewReview] = useState({
     title: "",
     comment: "",
@@ -112,25 +119,140 @@ export default function ReviewsAndMapPage() {
     fetchAllReviews();
   }, []);
 
-  // Filter reviews when selected position or data changes
+  // Live feed: new reviews from every client arrive as deltas, so nothing is
+  // refetched after a post. EventSource reconnects by itself and the server
+  // replays what was missed; "resync" means that was not possible.
+  useEffect(() => {
+    const source = new EventSource("http://localhost:8000/api/reviews/stream");
+    source.onopen = () => {
+      feedOpenRef.current = true;
+    };
+    source.onerror = () => {
+      feedOpenRef.current = false;
+    };
+    source.addEventListener("review", (event) => {
+      applyNewReview(JSON.parse(event.data));
+    });
+    source.addEventListener("resync", () => {
+      catchUp();
+    });
+    return () => source.close();
+  }, []);
+
+  // Filter reviews when the selected position changes
   useEffect(() => {
-    if (selectedPosition) {
-      filterReviewsByLocation(selectedPosition.lat, selectedPosition.lng);
-    } else {
-      // No selection → show default location
-      filterReviewsByLocation(defaultLocation.lat, defaultLocation.lng);
+    const pos = selectedPosition || defaultLocation; // No selection → show default location
+    listedPositionRef.current = pos;
+    filterReviewsByLocation(pos.lat, pos.lng);
+  }, [selectedPosition]);
+
+  // Catch up through the delta endpoint instead of reloading every review
+  const catchUp = async () => {
+    if (!syncTokenRef.current) {
+      await fetchAllReviews();
+      return;
+    }
+    try {
+      let hasMore = true;
+      while (hasMore) {
+        const params = new URLSearchParams({ since: syncTokenRef.current });
+        const response = await fetch(
+          `http://localhost:8000/api/reviews/changes?${params.toString()}`
+        );
+        if (response.status === 410) {
+          // Too long ago to catch up; start over
+          await fetchAllReviews();
+          return;
+        }
+        if (!response.ok) {
+          throw new Error("Failed to fetch review changes");
+        }
+        const changes = await response.json();
+        applyChanges(changes);
+        syncTokenRef.current = changes.next_token;
+        hasMore = changes.has_more;
+      }
+    } catch (error) {
+      console.error("Error syncing reviews:", error);
     }
-  }, [selectedPosition, allReviews]);
+  };
+
+  const applyChanges = (changes) => {
+    const changed = new Map(changes.reviews.map((r) => [r.review_id, r]));
+    const deleted = new Set(changes.deleted.reviews);
+    const places = new Map(changes.places.map((p) => [p.place_id, p]));
+    const usernames = new Map(changes.users.map((u) => [u.user_id, u.username]));
+    const patch = (list) => [
+      ...changed.values(),
+      ...list
+        .filter((r) => !changed.has(r.review_id) && !deleted.has(r.review_id))
+        .map((r) => {
+          const place = places.get(r.place_id);
+          const username = usernames.get(r.user_id);
+          if (!place && username === undefined) return r;
+          return {
+            ...r,
+            ...(place && {
+              place_name: place.name,
+              address: place.address,
+              latitude: place.latitude,
+              longitude: place.longitude,
+              place_review_count: place.review_count,
+              place_avg_rating: place.avg_rating,
+            }),
+            ...(username !== undefined && { user_name: username }),
+          };
+        }),
+    ];
+    setAllReviews(patch);
+    const pos = listedPositionRef.current;
+    setFilteredReviews((list) =>
+      patch(list).filter(
+        (r) =>
+          !changed.has(r.review_id) ||
+          calculateDistance(pos.lat, pos.lng, r.latitude, r.longitude) < 1
+      )
+    );
+  };
+
+  const applyNewReview = (review) => {
+    const prepend = (list) =>
+      list.some((r) => r.review_id === review.review_id) ? list : [review, ...list];
+    setAllReviews(prepend);
+    // The location list covers 1 km around the listed position (the API default)
+    const pos = listedPositionRef.current;
+    if (calculateDistance(pos.lat, pos.lng, review.latitude, review.longitude) < 1) {
+      setFilteredReviews(prepend);
+    }
+  };
 
   // Fetch all reviews from the database
   const fetchAllReviews = async () => {
     setIsLoading(true);
     try {
-      const response = await fetch("http://localhost:8000/api/reviews");
-      if (!response.ok) {
-        throw new Error("Failed to fetch reviews");
+      // Changes made while the pages load are picked up from this token later
+      const tokenResponse = await fetch("http://localhost:8000/api/reviews/changes");
+      if (tokenResponse.ok) {
+        syncTokenRef.current = (await tokenResponse.json()).next_token;
       }
-      const reviewsData = await response.json();
+      // Follow next_cursor until the API reports no more pages
+      const reviewsData = [];
+      let cursor = null;
+      do {
+        const params = new URLSearchParams({ limit: "500" });
+        if (cursor) params.set("cursor", cursor);
+        // credentials: the API pins reads to the primary for a moment after our writes
+        const response = await fetch(
+          `http://localhost:8000/api/reviews?${params.toString()}`,
+          { credentials: "include" }
+        );
+        if (!response.ok) {
+          throw new Error("Failed to fetch reviews");
+        }
+        const page = await response.json();
+        reviewsData.push(...page.reviews);
+        cursor = page.next_cursor;
+      } while (cursor);
       setAllReviews(reviewsData);
     } catch (error) {
       console.error("Error fetching reviews:", error);
@@ -144,12 +266,13 @@ export default function ReviewsAndMapPage() {
   const filterReviewsByLocation = async (lat, lng) => {
     try {
       const response = await fetch(
-        `http://localhost:8000/api/reviews?latitude=${lat}&longitude=${lng}`
+        `http://localhost:8000/api/reviews?latitude=${lat}&longitude=${lng}`,
+        { credentials: "include" }
       );
 
       if (response.ok) {
         const locationReviews = await response.json();
-        setFilteredReviews(locationReviews);
+        setFilteredReviews(locationReviews.reviews);
       } else {
         // fallback: nearby reviews
         const nearbyReviews = allReviews.filter((review) => {
@@ -267,6 +390,7 @@ export default function ReviewsAndMapPage() {
       const response = await fetch("http://localhost:8000/api/reviews", {
         method: "POST",
         body: submitData,
+        credentials: "include",
       });
 
       if (!response.ok) {
@@ -274,7 +398,10 @@ export default function ReviewsAndMapPage() {
         throw new Error(err.detail || "Failed to submit review");
       }
 
-      await fetchAllReviews();
+      // The new review comes back through the live feed; otherwise catch up
+      if (!feedOpenRef.current) {
+        await catchUp();
+      }
       setNewReview({ title: "", comment: "", rating: 1, address: "" });
       setSelectedImage(null);
       setImagePreview(null);
@@ -381,7 +508,7 @@ export default function ReviewsAndMapPage() {
                 </Typography>
               ) : (
                 paginatedReviews.map((review) => (
-                  <Card key={review.id} variant="outlined" sx={{ mb: 2, p: 2 }}>
+                  <Card key={review.review_id} variant="outlined" sx={{ mb: 2, p: 2 }}>
                     <Box display="flex" alignItems="center" mb={1}>
                       <Avatar sx={{ mr: 2, bgcolor: "primary.main" }}>
                         {getAvatarInitial(review.user_name || "User")}
@@ -408,7 +535,7 @@ export default function ReviewsAndMapPage() {
                     {review.image_path && (
                       <Box sx={{ mb: 2 }}>
                         <img
-                          src={getImageUrl(review.image_path)}
+                          src={getImageUrl(review.medium_url || review.image_path)}
                           alt="Review"
                           style={{
                             maxWidth: "100%",